@@ -11,6 +11,8 @@ from urllib.parse import urlparse
 import logging
 import time
 
+from claim_cache import ClaimCache, claim_cache_key
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -34,6 +36,7 @@ TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 
 client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+claim_cache = ClaimCache(redis_client)
 
 class ChatSession:
     def __init__(self, sender_number):
@@ -175,11 +178,18 @@ def handle_button_response(button_text, chat_session, sender_number):
 
 def call_external_api(user_query, chat_session):
     try:
+        cache_key = claim_cache_key(user_query)
+        cached = claim_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         payload = {"user_input": user_query}
         response = requests.post(EXTERNAL_API_URL, json=payload, timeout=600)
         response.raise_for_status()
         data = response.json()
-        return {"message": data.get("result", "Unexpected API response format.")}
+        result = {"message": data.get("result", "Unexpected API response format.")}
+        claim_cache.set(cache_key, result)
+        return result
     except Exception as e:
         logger.error(f"Error calling external API: {e}")
         return {"message": f"An error occurred: {e}", "status": "error"}
@@ -1,50 +1,93 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from twilio.twiml.messaging_response import MessagingResponse
-from twilio.rest import Client
-import requests
+from twilio.request_validator import RequestValidator
 from requests.exceptions import Timeout, RequestException
 import os
-import json
+import time
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
-import redis
-from urllib.parse import urlparse
+from datetime import datetime
 import logging
-import time
 from googletrans import Translator
-from pydub import AudioSegment  # For processing audio files
 #import speech_recognition as sr  # For transcribing voice messages
 #from openai import OpenAI  # For using OpenAI's API
 import openai
 
-import re
 from celery import Celery
 
+import metrics
+import tracing
+from redis_store import make_redis_client, track_usage
+from outbound import OutboundDispatcher, TwilioMessagesAPI, track_sends
+from job_queue import JobQueue, QUEUE_BACKEND, QUEUE_CONCURRENCY
+from claim_cache import ClaimCache, claim_cache_key
+from claim_index import ClaimIndex, RedisIndexStore
+from singleflight import SingleFlight, QUEUED
+from translation_cache import TranslationCache
+from message_catalog import MessageCatalog
+from messages import (
+    GREETING_MORNING, GREETING_AFTERNOON, GREETING_EVENING, WELCOME_MESSAGE, PROCESSING_MESSAGE,
+    PROCESSING_VOICE_MESSAGE, VOICE_ERROR_MESSAGE, IMAGE_ERROR_MESSAGE, UNSUPPORTED_MEDIA_MESSAGE,
+    RATING_PROMPT, FEEDBACK_THANKS_MESSAGE, ERROR_MESSAGE, BUSY_MESSAGE, SLOW_DOWN_MESSAGE,
+    SMALL_TALK_REPLIES, STATIC_MESSAGES,
+)
+from language_detect import LanguageDetector
+from transcription import Transcriber
+from ocr import ImageReader
+from media_pipeline import (
+    MediaPipeline, VOICE, IMAGE, UNSUPPORTED, attachments_of, kind_of, media_type_of, merge_text,
+)
+from fact_stream import split_message
+from upstream import CircuitOpen, FactCheckClient, EXTERNAL_API_FALLBACK
+from idempotency import IdempotencyGuard
+from feedback import FeedbackStore, extract_verdict
+from serialization import epoch, parse_time, serializer
+from history_compactor import HistoryCompactor, HISTORY_COMPACT_INTERVAL, HISTORY_KEY, SEEN_KEY
+from intents import IntentClassifier, GREETING
+from scheduler import FairScheduler, Overloaded, SCHED_ENABLED, SCHED_MEDIA_COST
+
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-url = urlparse(os.environ.get("REDIS_URL"))
-redis_client = redis.Redis(
-    host=url.hostname,
-    port=url.port,
-    password=url.password,
-    ssl=(url.scheme == "rediss"),
-    ssl_cert_reqs=None
-)
+# Pooled, health-checked client shared by all threads of this worker
+redis_client = make_redis_client()
 
 EXTERNAL_API_URL = os.getenv("EXTERNAL_API")
 TWILIO_WHATSAPP_NUMBER = os.getenv("TWILIO_WHATSAPP_NUMBER")
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
+TWILIO_VALIDATE_SIGNATURE = os.getenv("TWILIO_VALIDATE_SIGNATURE", "false").lower() == "true"
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 #client_ = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+# Outbound messages go through one dispatcher per worker: ordered per
+# recipient, rate limited per sending number, retried on 429/5xx
+outbound = OutboundDispatcher(
+    TwilioMessagesAPI(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN),
+    TWILIO_WHATSAPP_NUMBER,
+    redis_client
+)
 translator = Translator()
+translation_cache = TranslationCache(translator, redis_client)
+language_detector = LanguageDetector(translator)
+transcriber = Transcriber(redis_client)
+image_reader = ImageReader(redis_client)
+# All attachments of a message are fetched at once, voice notes are
+# transcribed and screenshots read with OCR
+media_pipeline = MediaPipeline(transcriber, image_reader, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN))
+intent_classifier = IntentClassifier()
+claim_cache = ClaimCache(redis_client)
+claim_index = ClaimIndex(RedisIndexStore(redis_client))
+# Pooled upstream client with a circuit breaker, adaptive timeouts and
+# hedging to EXTERNAL_API_FALLBACK
+fact_check_client = FactCheckClient([EXTERNAL_API_URL, EXTERNAL_API_FALLBACK])
+# Twilio retries slow webhooks, each MessageSid is only queued once
+idempotency = IdempotencyGuard(redis_client)
+feedback_store = FeedbackStore(redis_client)
+single_flight = SingleFlight(redis_client, fanout=lambda waiter, result: deliver_fanout(waiter, result))
 
 def make_celery(app):
     celery = Celery(
@@ -53,189 +96,238 @@ def make_celery(app):
         backend=os.getenv("REDIS_URL")
     )
     celery.conf.update(app.config)
+    celery.conf.update(
+        worker_concurrency=QUEUE_CONCURRENCY,
+        worker_prefetch_multiplier=1,
+        task_acks_late=True,
+        task_reject_on_worker_lost=True,
+    )
     return celery
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv("FLASK_SECRET_KEY")
 
-#celery=make_celery(app)
+celery = make_celery(app) if QUEUE_BACKEND == "celery" else None
+
+CHAT_HISTORY_MAX = int(os.getenv("CHAT_HISTORY_MAX", 50))
+# Seconds a conversation's history stays live, idle ones are archived by
+# the compactor well before that
+CHAT_HISTORY_TTL = int(os.getenv("CHAT_HISTORY_TTL", 24 * 60 * 60))
+SESSION_KEY = "chat:{}"
+
+# Sessions expire with their last-seen key, idle conversations are packed
+# into a compressed per-sender archive in the background
+history_compactor = HistoryCompactor(redis_client)
+history_compactor.start_in_background(HISTORY_COMPACT_INTERVAL)
 
 class ChatSession:
+    # The small session fields live in a Redis hash, the conversation in a
+    # capped Redis list. Only messages added during this turn are written.
+    __slots__ = (
+        "sender_number", "last_activity", "last_message_id", "last_verdict",
+        "is_new_session", "language", "new_messages",
+    )
+
     def __init__(self, sender_number):
         self.sender_number = sender_number
         self.last_activity = datetime.now()
-        self.conversation_history = []
         self.last_message_id = None
+        # Verdict of the last answer, recorded with its 👍/👎
+        self.last_verdict = "unknown"
         self.is_new_session = True
         self.language = "en"  # Default language is English
-        
+        self.new_messages = []
+
+    def add_message(self, message, message_type, message_id=None):
+        entry = {
+            "timestamp": epoch(),
+            "message": message,
+            "type": message_type
+        }
+        if message_id:
+            entry["message_id"] = message_id
+        self.new_messages.append(entry)
+
     def to_dict(self):
         return {
             "sender_number": self.sender_number,
-            "last_activity": self.last_activity.isoformat(),
-            "conversation_history": self.conversation_history,
-            "last_message_id": self.last_message_id,
-            "is_new_session": self.is_new_session,
+            "last_activity": epoch(self.last_activity),
+            "last_message_id": self.last_message_id or "",
+            "last_verdict": self.last_verdict,
             "language": self.language
         }
     
     @staticmethod
     def from_dict(data):
         session = ChatSession(data["sender_number"])
-        session.last_activity = datetime.fromisoformat(data["last_activity"])
-        session.conversation_history = data["conversation_history"]
-        session.last_message_id = data.get("last_message_id")
+        session.last_activity = parse_time(data["last_activity"])
+        session.last_message_id = data.get("last_message_id") or None
+        session.last_verdict = data.get("last_verdict", "unknown")
         session.is_new_session = False
         session.language = data.get("language", "en")
         return session
 
 
+WELCOME_LAYOUT = "{greeting} {name} \n {welcome}"
+message_catalog = MessageCatalog(STATIC_MESSAGES, translation_cache).load()
+message_catalog.warm_in_background()
+
+
+def localized(text, language):
+    # One of STATIC_MESSAGES in the user's language, no network call
+    return message_catalog.get(text, language)
+
+
 def translate_text(text, dest_language):
     if dest_language=="en":
         return text
-        
-    try:
-        # Regular expression to find URLs in the text
-        url_pattern = re.compile(r'(https?://\S+)')
-        urls = re.findall(url_pattern, text)
-        
-        # Unique placeholder format
-        placeholder_format = '__URL_PLACEHOLDER_{}__'
-        
-        # Replace URLs with placeholders
-        for i, url in enumerate(urls):
-            placeholder = placeholder_format.format(i)
-            text = text.replace(url, placeholder)
-        
-        # Translate the text without URLs
-        translated = translator.translate(text, dest=dest_language).text
-        
-        # Replace placeholders with original URLs
-        for i, url in enumerate(urls):
-            placeholder = placeholder_format.format(i)
-            translated = translated.replace(placeholder, url)
-        
-        return translated
-    except Exception as e:
-        logger.error(f"Error translating text: {e}")
-        return text  # Return original text if translation fails
-
+    with metrics.timed("translate"):
+        return translation_cache.translate(text, dest_language)
 
-def needs_rating(response_text):
-    # Responses that don't need rating
-    casual_patterns = [
-        "thank you", "thanks", "you're welcome", "noted",
-        "got it", "understood", "👍", "🙏", "nice","bravo","amazing","impressive",
-        "sorry", "please", "hi", "hello", "hey", "good morning", "good afternoon", 
-        "good evening", "thanks", "thank you", "bye", "goodbye", "cool","yeah","yah","alright",
-        "oh","oops","ok","yes"
-    ]
 
-    text = response_text.lower().strip()
-    
-    # Check conditions
-    is_short = len(text.split()) < 10
-    is_casual = any(pattern in text for pattern in casual_patterns)
-    is_error = "error" in text or "an error occurred" in text
-    has_emoji_ending = text.endswith(('!', '👋', '🙂', '😊'))
-    
-    return not (is_short and (is_casual or has_emoji_ending or is_error))
+def needs_rating(user_input):
+    # Small talk and short error messages don't get a rating prompt
+    text = user_input.lower().strip()
+    is_error = len(text.split()) < 10 and "error" in text
+    return intent_classifier.classify(user_input) is None and not is_error
 
 def get_chat_session(sender_number):
-    session_key = f"chat_session:{sender_number}"
+    session_key = SESSION_KEY.format(sender_number)
     try:
-        session_data = redis_client.get(session_key)
-        if session_data:
-            session_dict = json.loads(session_data.decode('utf-8'))
-            session = ChatSession.from_dict(session_dict)
-            last_activity = datetime.fromisoformat(session_dict["last_activity"])
-            if datetime.now() - last_activity > timedelta(hours=2):
-                session = ChatSession(sender_number)
-        else:
-            session = ChatSession(sender_number)
-        return session
+        with metrics.timed("session_load"):
+            # Both keys expire SESSION_IDLE_TIMEOUT after the last message, an
+            # ended session is never read or parsed
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.exists(SEEN_KEY.format(sender_number))
+            pipe.hgetall(session_key)
+            seen, session_data = pipe.execute()
+        if seen and session_data:
+            session_dict = {k.decode('utf-8'): v.decode('utf-8') for k, v in session_data.items()}
+            return ChatSession.from_dict(session_dict)
+        return ChatSession(sender_number)
     except Exception as e:
         logger.error(f"Error getting chat session: {e}")
+        metrics.record_error("session_load")
         return ChatSession(sender_number)
 
-def save_chat_session(session):
+def save_chat_session(session, pipe=None):
+    # With a pipeline the writes are only queued, the caller executes it
     try:
-        session_key = f"chat_session:{session.sender_number}"
-        session_data = json.dumps(session.to_dict())
-        redis_client.setex(session_key, timedelta(hours=24), session_data)
+        session_key = SESSION_KEY.format(session.sender_number)
+        history_key = HISTORY_KEY.format(session.sender_number)
+        execute = pipe is None
+        if execute:
+            pipe = redis_client.pipeline()
+        if session.is_new_session:
+            # A fresh session starts a fresh conversation, the previous one
+            # is left to the compactor
+            history_compactor.end_conversation(pipe, session.sender_number)
+            feedback_store.first_seen(pipe, session.sender_number)
+        pipe.hset(session_key, mapping=session.to_dict())
+        pipe.expire(session_key, history_compactor.idle_timeout)
+        if session.new_messages:
+            pipe.rpush(history_key, *[serializer.dumps(entry) for entry in session.new_messages])
+            pipe.ltrim(history_key, -CHAT_HISTORY_MAX, -1)
+        history_compactor.touch(pipe, session.sender_number, CHAT_HISTORY_TTL)
+        if execute:
+            pipe.execute()
+        session.new_messages = []
+        session.is_new_session = False
     except Exception as e:
         logger.error(f"Error saving chat session: {e}")
 
-def get_greeting_message(language="en"):
-    
+def get_greeting_text():
     hour = datetime.now().hour
     if 5 <= hour < 12:
-        greeting = translate_text("Good morning! 🌅", language)
+        return GREETING_MORNING
     elif 12 <= hour < 17:
-        greeting = translate_text("Good afternoon! 🌞", language)
-    else:
-        greeting = translate_text("Good evening! 🌙", language)
-    return greeting
+        return GREETING_AFTERNOON
+    return GREETING_EVENING
 
 def create_welcome_message(profile_name, language="en"):
-    greeting = get_greeting_message(language)
-    
     # Get the user's WhatsApp profile name
     name = f"{profile_name}!" if profile_name else "User!"
-    
-    welcome_text = translate_text(
-        "Welcome to AI Fact Checker! 🤖✨\n\n"
-        "I'm here to help you verify information and check facts. "
-        "Feel free to ask me any questions or share statements you'd like to fact-check.\n\n"
-        "To get started, simply type your question or statement! 📝",
-        language
+
+    return WELCOME_LAYOUT.format(
+        greeting=localized(get_greeting_text(), language), name=name, welcome=localized(WELCOME_MESSAGE, language)
     )
-    return f"{greeting} {name} \n {welcome_text}"
 
-def store_feedback(message_id, feedback_type, sender_number):
+def store_feedback(message_id, feedback_type, sender_number, pipe=None, language="en", verdict="unknown"):
+    # The raw record plus the daily counters and event stream, see feedback.py
     try:
-        feedback_key = f"feedback:{message_id}"
-        feedback_data = {
-            "timestamp": datetime.now().isoformat(),
-            "feedback_type": feedback_type,
-            "sender_number": sender_number
-        }
-        redis_client.setex(feedback_key, timedelta(days=30), json.dumps(feedback_data))
+        feedback_store.record(message_id, feedback_type, sender_number, language, verdict, pipe)
     except Exception as e:
         logger.error(f"Error storing feedback: {e}")
 
-def send_message_with_template(to_number, body_text, user_input, is_greeting=False, language="en"):
+def track_first_reply(future, received_at):
+    # Time to the first message that answers the user
+    if received_at is None:
+        return
+
+    def done(f):
+        if f.exception() is None:
+            metrics.observe_first_reply(received_at)
+
+    future.add_done_callback(done)
+
+def send_message_with_template(to_number, body_text, user_input, is_greeting=False, language="en", received_at=None):
+    with tracing.span("send_message_with_template"):
+        return _send_message_with_template(to_number, body_text, user_input, is_greeting, language, received_at)
+
+def _send_message_with_template(to_number, body_text, user_input, is_greeting, language, received_at):
     try:
+        wants_rating = not is_greeting and needs_rating(user_input)
         translated_body = translate_text(body_text, language)
-        main_message = client.messages.create(
-            from_=TWILIO_WHATSAPP_NUMBER,
-            to=to_number,
-            body=translated_body
-        )
-        time.sleep(1)
-        if not is_greeting and needs_rating(user_input):
-            template_message = client.messages.create(
-                from_=TWILIO_WHATSAPP_NUMBER,
-                to=to_number,
-                body=translate_text("Was this response helpful? Reply with 👍 for Yes or 👎 for No.", language)
-            )
-            return translate_text(template_message,language)
+        # Long answers go out as several messages, the dispatcher keeps them in order
+        futures = [outbound.send(to_number, part) for part in split_message(translated_body)]
+        track_first_reply(futures[0], received_at)
+        main_message = futures[-1].result()
+        if wants_rating:
+            # Delivered a second after the answer without holding this worker
+            outbound.send(to_number, localized(RATING_PROMPT, language), delay=1)
         return main_message
     except Exception as e:
         logger.error(f"Error sending message: {str(e)}")
         raise
 
-def handle_button_response(user_response, chat_session, previous, sender_number):
+class ProgressiveReply:
+    # Forwards each part of a streamed fact-check as soon as it arrives,
+    # e.g. the preliminary verdict before the sources
+    def __init__(self, to_number, language, received_at=None):
+        self.to_number = to_number
+        self.language = language
+        self.received_at = received_at
+        self.parts = []
+        self.last = None
+
+    def send(self, text):
+        for part in split_message(translate_text(text, self.language)):
+            future = outbound.send(self.to_number, part)
+            if self.last is None:
+                track_first_reply(future, self.received_at)
+            self.last = future
+        self.parts.append(text)
+
+    @property
+    def message(self):
+        return "\n\n".join(self.parts)
+
+    def finish(self, user_input, wants_rating=True):
+        main_message = self.last.result()
+        if wants_rating and needs_rating(user_input):
+            outbound.send(self.to_number, localized(RATING_PROMPT, self.language), delay=1)
+        return main_message
+
+def handle_button_response(user_response, chat_session, previous, sender_number, pipe=None):
     try:
         if user_response in ["👍", "👎"]:
             feedback_type = "positive" if user_response == "👍" else "negative"
             if chat_session.last_message_id:
-                store_feedback(chat_session.last_message_id, feedback_type, sender_number)
-                message = client.messages.create(
-                    from_=TWILIO_WHATSAPP_NUMBER,
-                    to=sender_number,
-                    body=translate_text("Thank you for your feedback! 🙏.\n Would you like to verify another claim?", previous)
+                store_feedback(
+                    chat_session.last_message_id, feedback_type, sender_number, pipe,
+                    language=previous, verdict=chat_session.last_verdict
                 )
+                message = outbound.send(sender_number, localized(FEEDBACK_THANKS_MESSAGE, previous)).result()
                 return True, message.sid
         return False, None
         
@@ -243,286 +335,430 @@ def handle_button_response(user_response, chat_session, previous, sender_number)
         logger.error(f"Error handling button response: {e}")
         return False, None
 
-def call_external_api(user_query, chat_session):
+def translate_to_english(text, language):
+    if language == "en":
+        return text
+    with metrics.timed("translate"):
+        return translation_cache.translate(text, "en")
+
+def lookup_fact_check(user_query, chat_session):
+    # Returns (cached result or None, english query, cache key)
+    english_query = translate_to_english(user_query, chat_session.language)
+    cache_key = claim_cache_key(user_query, english_query)
+    cached = claim_cache.get(cache_key)
+    if cached is not None:
+        return cached, english_query, cache_key
+
+    # Forwarded claims often differ by a word or an emoji from one we
+    # already verified
+    match = claim_index.lookup(english_query)
+    if match is not None:
+        cached = claim_cache.get(match[0])
+        if cached is not None:
+            return cached, english_query, cache_key
+    return None, english_query, cache_key
+
+def remember_fact_check(english_query, cache_key, result):
+    claim_cache.set(cache_key, result)
+    if result.get("status") != "error":
+        claim_index.add(english_query, cache_key)
+
+def call_external_api(user_query, chat_session, reply=None):
+    with tracing.span("call_external_api"):
+        return _call_external_api(user_query, chat_session, reply)
+
+def _call_external_api(user_query, chat_session, reply):
+    try:
+        cached, english_query, cache_key = lookup_fact_check(user_query, chat_session)
+        if cached is not None:
+            return cached
+
+        def fetch():
+            result = fetch_fact_check(user_query, reply.send if reply else None)
+            remember_fact_check(english_query, cache_key, result)
+            return result
+
+        # Identical claims arriving at the same time share one upstream call
+        waiter = {
+            "sender_number": chat_session.sender_number,
+            "language": chat_session.language,
+            "user_query": user_query,
+            "received_at": reply.received_at if reply else None,
+        }
+        return single_flight.do(cache_key, fetch, waiter=waiter)
+    except Exception as e:
+        logger.error(f"Error calling external API: {e}")
+        return {"message": f"An error occurred: {e}", "status": "error"}
+
+def fetch_fact_check(user_query, on_partial=None):
+    start = time.perf_counter()
+    metrics.UPSTREAM_IN_FLIGHT.inc()
     try:
-        payload = {"query": user_query}
-        response = requests.post(EXTERNAL_API_URL, json=payload, timeout=600)
-        response.raise_for_status()
-        data = response.json()
-        return {"message": data.get("result", "Unexpected API response format.")}
+        with tracing.span("upstream"):
+            return fact_check_client.fact_check(user_query, on_partial)
+    except CircuitOpen:
+        # The backend is failing, answer straight away instead of waiting
+        logger.warning("Fact-check backend unavailable, sending busy reply.")
+        metrics.record_error("upstream")
+        return {"message": BUSY_MESSAGE, "status": "error"}
     except Timeout:
         logger.error("External API request timed out.")
+        metrics.record_error("upstream")
         return {"message": "The request to the external API timed out.", "status": "error"}
     except Exception as e:
         logger.error(f"Error calling external API: {e}")
+        metrics.record_error("upstream")
         return {"message": f"An error occurred: {e}", "status": "error"}
+    finally:
+        metrics.UPSTREAM_IN_FLIGHT.dec()
+        metrics.observe("upstream", time.perf_counter() - start)
+
+def deliver_fanout(waiter, result):
+    # Answer a duplicate request that was parked while the leader was busy
+    sender_number = waiter["sender_number"]
+    response_text = result.get("message", "I am unable to provide a response now. Please try your query again.")
+    message = send_message_with_template(
+        sender_number, response_text, waiter["user_query"],
+        language=waiter["language"], received_at=waiter.get("received_at")
+    )
 
-def transcribe_voice_message(audio_url,chat_session):
-    try:
-        # Download the audio file
-        response = requests.get(audio_url)
-        response.raise_for_status()
-        
-        # Save the audio file temporarily
-        with open("temp_audio.ogg", "wb") as f:
-            f.write(response.content)
-        
-        # Convert .ogg to .wav using pydub
-        audio = AudioSegment.from_file("temp_audio.ogg", format="ogg")
-        audio.export("temp_audio.wav", format="wav")
-        
-        # Transcribe the audio using speech_recognition
-        #with sr.AudioFile("temp_audio.wav") as source:
-        #    audio_data = recognizer.record(source)
-        #    text = recognizer.recognize_google(audio_data)
-
-        # Step 3: Transcribe the audio using Whisper API
-        with open("temp_audio.wav", "rb") as audio_file:
-            
-            #transcription = client_.audio.transcriptions.create(model="gpt-4o-transcribe", file=audio_file)
-            transcription = openai.Audio.transcribe(model="whisper-1",file=audio_file,response_format="text")
-        
-        print(transcription)
-
-        detected_language = translator.detect(transcription).lang
-        chat_session.language = detected_language
+    chat_session = get_chat_session(sender_number)
+    chat_session.last_message_id = message.sid
+    chat_session.last_verdict = extract_verdict(response_text)
+    chat_session.add_message(response_text, "outgoing", message.sid)
+    chat_session.last_activity = datetime.now()
+    save_chat_session(chat_session)
+
+def read_attachments(payload, chat_session):
+    # The caption and the text of every attachment as one claim. None when
+    # nothing could be read, the user has been told why.
+    sender_number = payload["sender_number"]
+    body = payload.get("body", "")
+    attachments = attachments_of(payload)
+    kinds = [kind_of(content_type) for _, content_type in attachments]
+    has_voice = VOICE in kinds
+    if has_voice:
+        outbound.send(sender_number, localized(PROCESSING_VOICE_MESSAGE, chat_session.language))
+    elif IMAGE in kinds:
+        outbound.send(sender_number, localized(PROCESSING_MESSAGE, chat_session.language))
+
+    results = media_pipeline.process(attachments)
+    text = merge_text(body, results)
+    if text:
+        return text
+    if has_voice:
+        error = VOICE_ERROR_MESSAGE
+    elif all(result.kind == UNSUPPORTED for result in results):
+        error = UNSUPPORTED_MEDIA_MESSAGE
+    else:
+        error = IMAGE_ERROR_MESSAGE
+    outbound.send(sender_number, localized(error, chat_session.language))
+    return None
 
-        # Clean up temporary files
-        os.remove("temp_audio.ogg")
-        os.remove("temp_audio.wav")
-        
-        return transcription
+def send_error_message(sender_number, language="en"):
+    try:
+        outbound.send(sender_number, localized(ERROR_MESSAGE, language))
     except Exception as e:
-        logger.error(f"Error transcribing voice message: {e}")
-        return None
+        logger.error(f"Error sending error message: {e}")
 
-#@celery.task
-def process_whatsapp_message(sender_number, profile_name, incoming_message, chat_session_dict):
+def save_message_state(pipe):
     try:
-        chat_session = ChatSession.from_dict(chat_session_dict)
-
-        # Previous Language
-        previous = chat_session.language
-
-        # Detect language from the incoming message
-        detected_language = translator.detect(incoming_message).lang
-        chat_session.language = detected_language
-
-        # Handle feedback (thumbs up/down)
-        if incoming_message in ["👍", "👎"]:
-            is_feedback, message_sid = handle_button_response(incoming_message, chat_session, previous, sender_number)
-            if is_feedback:
-                return
-
-        if chat_session.is_new_session:
-            welcome_message = send_message_with_template(
-                sender_number,
-                create_welcome_message(profile_name, chat_session.language),
-                incoming_message,
-                is_greeting=True,
-                language=chat_session.language
-            )
-            chat_session.conversation_history.append({
-                "timestamp": datetime.now().isoformat(),
-                "message": create_welcome_message(profile_name, chat_session.language),
-                "type": "outgoing",
-                "message_id": welcome_message.sid
-            })
-
-        chat_session.conversation_history.append({
-            "timestamp": datetime.now().isoformat(),
-            "message": incoming_message,
-            "type": "incoming"
-        })
-
-        # Send a processing message for text inputs
-        if needs_rating(incoming_message):
-            processing_message = client.messages.create(
-                from_=TWILIO_WHATSAPP_NUMBER,
-                to=sender_number,
-                body=translate_text("Processing your request. ⏳", chat_session.language)
-            )
-
-        api_response = call_external_api(incoming_message, chat_session)
-        response_text = api_response.get("message", "I am unable to provide a response now. Please try your query again.")
-
-        print(response_text)
-
-        message = send_message_with_template(sender_number, response_text, incoming_message, language=chat_session.language)
-        chat_session.last_message_id = message.sid
-
-        chat_session.conversation_history.append({
-            "timestamp": datetime.now().isoformat(),
-            "message": response_text,
-            "type": "outgoing",
-            "message_id": message.sid
-        })
+        with metrics.timed("session_save"):
+            pipe.execute()
+    except Exception as e:
+        logger.error(f"Error saving message state: {e}")
+
+def reply_after_failure(payload, error):
+    # The message failed after a reply went out. A retry would send the
+    # welcome, the processing message or part of the answer again, so the
+    # user gets the error reply instead.
+    sender_number = payload["sender_number"]
+    logger.error(f"Message {payload.get('message_sid')} failed after replying, not retrying: {error}")
+    send_error_message(sender_number, get_chat_session(sender_number).language)
+
+def process_whatsapp_message(payload):
+    # Continues the webhook's trace, the context travels in the payload
+    with tracing.message_span(
+        "process_whatsapp_message", payload.get("message_sid"), payload.get(tracing.CARRIER_KEY),
+        kind=tracing.SpanKind.CONSUMER,
+    ):
+        _process_whatsapp_message(payload)
+
+def _process_whatsapp_message(payload):
+    with track_usage() as usage, track_sends() as sends:
+        # Every write for this message goes to Redis in one MULTI at the end
+        pipe = redis_client.pipeline()
+        try:
+            handle_whatsapp_message(payload, pipe)
+            failed = None
+        except Exception as e:
+            if not sends:
+                # Nothing reached the user, the job queue retries the message
+                raise
+            failed = e
+        save_message_state(pipe)
+        if failed is not None:
+            reply_after_failure(payload, failed)
+    metrics.observe_message(media_type_of(payload), payload.get("received_at"))
+    metrics.observe_redis(usage)
+    logger.debug(
+        f"Processed message {payload.get('message_sid')}: {usage.round_trips} Redis round trips, "
+        f"{usage.commands} commands, {usage.bytes_sent} bytes sent, {usage.bytes_received} bytes received"
+    )
+
+class MessageContext:
+    # What prepare_message hands to the upstream call and finish_message
+    __slots__ = ("sender_number", "chat_session", "incoming_message", "received_at", "reply")
+
+    def __init__(self, sender_number, chat_session, incoming_message, received_at=None):
+        self.sender_number = sender_number
+        self.chat_session = chat_session
+        self.incoming_message = incoming_message
+        self.received_at = received_at
+        self.reply = ProgressiveReply(sender_number, chat_session.language, received_at)
+
+def handle_whatsapp_message(payload, pipe):
+    context = prepare_message(payload, pipe)
+    if context is None:
+        return
+    api_response = call_external_api(context.incoming_message, context.chat_session, context.reply)
+    finish_message(context, api_response, pipe)
+
+def prepare_message(payload, pipe):
+    # Everything before the fact-check call. Returns None when the message
+    # was fully handled here (feedback, small talk).
+    sender_number = payload["sender_number"]
+    profile_name = payload.get("profile_name", "User")
+    chat_session = get_chat_session(sender_number)
+
+    # Voice notes and images become the text of the claim
+    num_media = payload.get("num_media", 0)
+    if num_media > 0:
+        incoming_message = read_attachments(payload, chat_session)
+        if incoming_message is None:
+            # Nothing to fact-check or cache
+            chat_session.last_activity = datetime.now()
+            save_chat_session(chat_session, pipe)
+            return None
+    else:
+        incoming_message = payload.get("body", "")
+
+    # Previous Language
+    previous = chat_session.language
+
+    # Detect language from the incoming message, emoji and very short
+    # messages keep the session's language
+    with metrics.timed("language_detect"):
+        chat_session.language = language_detector.detect(incoming_message, chat_session.language)
+    metrics.record_message(chat_session.language, media_type_of(payload))
+
+    # Handle feedback (thumbs up/down)
+    if incoming_message in ["👍", "👎"]:
+        is_feedback, message_sid = handle_button_response(incoming_message, chat_session, previous, sender_number, pipe)
+        if is_feedback:
+            save_chat_session(chat_session, pipe)
+            return None
+
+    if chat_session.is_new_session:
+        welcome_text = create_welcome_message(profile_name, chat_session.language)
+        welcome_message = send_message_with_template(
+            sender_number,
+            welcome_text,
+            incoming_message,
+            is_greeting=True,
+            language=chat_session.language
+        )
+        chat_session.add_message(welcome_text, "outgoing", welcome_message.sid)
+        # Queued now, so the session is no longer new if a later step fails
+        save_chat_session(chat_session, pipe)
 
+    chat_session.add_message(incoming_message, "incoming")
+
+    # Greetings, thanks and other small talk skip the fact-check
+    intent = intent_classifier.route(incoming_message) if num_media == 0 else None
+    if intent is not None:
+        reply_small_talk(chat_session, intent, pipe)
+        return None
+
+    # Send a processing message for text inputs
+    if num_media == 0 and needs_rating(incoming_message):
+        outbound.send(sender_number, localized(PROCESSING_MESSAGE, chat_session.language))
+
+    return MessageContext(sender_number, chat_session, incoming_message, payload.get("received_at"))
+
+def reply_small_talk(chat_session, intent, pipe):
+    # A new session's greeting is already answered by the welcome message
+    if not (chat_session.is_new_session and intent == GREETING):
+        reply = localized(SMALL_TALK_REPLIES[intent], chat_session.language)
+        outbound.send(chat_session.sender_number, reply)
+        chat_session.add_message(reply, "outgoing")
+    chat_session.last_activity = datetime.now()
+    save_chat_session(chat_session, pipe)
+
+def finish_message(context, api_response, pipe):
+    sender_number = context.sender_number
+    chat_session = context.chat_session
+    incoming_message = context.incoming_message
+    if api_response is QUEUED:
+        # Another worker is checking the same claim and will send the answer
         chat_session.last_activity = datetime.now()
-        save_chat_session(chat_session)
+        save_chat_session(chat_session, pipe)
+        return
+    response_text = api_response.get("message", "I am unable to provide a response now. Please try your query again.")
+
+    if context.reply.parts:
+        # The answer was already streamed to the user part by part
+        failed = api_response.get("status") == "error"
+        response_text = context.reply.message
+        message = context.reply.finish(incoming_message, wants_rating=not failed)
+        if failed:
+            # The stream broke off, tell the user the answer is incomplete
+            send_error_message(sender_number, chat_session.language)
+    else:
+        message = send_message_with_template(
+            sender_number, response_text, incoming_message,
+            language=chat_session.language, received_at=context.received_at
+        )
+    chat_session.last_message_id = message.sid
+    chat_session.last_verdict = extract_verdict(response_text)
+
+    chat_session.add_message(response_text, "outgoing", message.sid)
+
+    chat_session.last_activity = datetime.now()
+    save_chat_session(chat_session, pipe)
+
+def classify_job(payload):
+    # (sender, cheap, cost) for the scheduler. Feedback and small talk are
+    # answered without a fact-check, so they jump the queue.
+    body = payload.get("body", "")
+    num_media = payload.get("num_media", 0)
+    cheap = num_media == 0 and (body in ["👍", "👎"] or not needs_rating(body))
+    return payload["sender_number"], cheap, SCHED_MEDIA_COST if num_media else 1
+
+def send_busy_message(sender_number, reason):
+    try:
+        message = SLOW_DOWN_MESSAGE if reason == "rate_limited" else BUSY_MESSAGE
+        outbound.send(sender_number, localized(message, get_chat_session(sender_number).language))
     except Exception as e:
-        logger.error(f"Error in process_whatsapp_message: {str(e)}")
+        logger.error(f"Error sending busy message: {e}")
+
+def handle_dead_letter(payload):
+    # The job ran out of retries, let the user know instead of staying silent
+    send_error_message(payload["sender_number"], get_chat_session(payload["sender_number"]).language)
+
+# Fair scheduling across senders with per-sender caps and backpressure
+scheduler = FairScheduler(redis_client, classify_job) if SCHED_ENABLED else None
+
+job_queue = JobQueue(
+    process_whatsapp_message,
+    redis_client,
+    on_dead_letter=handle_dead_letter,
+    celery=celery,
+    scheduler=scheduler
+)
+
+# Read from the components' own counters when /metrics is scraped
+for name, component in (
+    ("claim_cache", claim_cache), ("claim_index", claim_index), ("translation_cache", translation_cache),
+    ("message_catalog", message_catalog),
+    ("history_compactor", history_compactor), ("transcriber", transcriber), ("image_reader", image_reader),
+    ("media", media_pipeline), ("language_detector", language_detector), ("intents", intent_classifier),
+    ("idempotency", idempotency),
+    ("single_flight", single_flight), ("outbound", outbound), ("upstream", fact_check_client),
+    ("queue", job_queue), ("scheduler", scheduler),
+):
+    if component is not None:
+        metrics.stats_collector.add(name, component.stats)
+
+def is_valid_twilio_request(url=None, form=None, signature=None):
+    if not TWILIO_VALIDATE_SIGNATURE:
+        return True
+    validator = RequestValidator(TWILIO_AUTH_TOKEN)
+    return validator.validate(
+        url if url is not None else request.url,
+        form if form is not None else request.form,
+        signature if signature is not None else request.headers.get("X-Twilio-Signature", "")
+    )
+
+def build_job_payload(form):
+    # Shared by the Flask and asyncio webhooks. None when there is no sender.
+    sender_number = form.get("From")
+    if not sender_number:
+        return None
 
-"""
-@app.route("/whatsapp", methods=["POST"])
-def whatsapp_reply():
     try:
-        print(request.form)
-        sender_number = request.form.get("From")
-        chat_session = get_chat_session(sender_number)
+        num_media = int(form.get("NumMedia", 0))
+    except ValueError:
+        num_media = 0
 
+    return {
+        "message_sid": form.get("MessageSid"),
+        "sender_number": sender_number,
         # Get the user's WhatsApp profile name
-        profile_name = request.form.get("ProfileName", "User")
-
-        # Check if the message is a voice note
-        num_media = int(request.form.get("NumMedia", 0))
-        if num_media > 0:
-            media_url = request.form.get("MediaUrl0")
-            media_type = request.form.get("MediaContentType0", "")
-
-            # Check if the media is a voice note (audio/ogg)
-            if media_type == "audio/ogg":
-                # Send a processing message
-                processing_message = client.messages.create(
-                    from_=TWILIO_WHATSAPP_NUMBER,
-                    to=sender_number,
-                    body=translate_text("Processing your voice note... ⏳", chat_session.language)
-                )
+        "profile_name": form.get("ProfileName", "User"),
+        "body": form.get("Body", "").strip(),
+        "num_media": num_media,
+        # Every attachment, WhatsApp allows several per message
+        "media": [
+            {"url": form.get(f"MediaUrl{i}"), "type": form.get(f"MediaContentType{i}", "")}
+            for i in range(num_media) if form.get(f"MediaUrl{i}")
+        ],
+        "received_at": time.time(),
+    }
+
+def accept_message(payload):
+    # Idempotency check and enqueue, returns the webhook response
+    duplicate = idempotency.begin(payload["message_sid"])
+    if duplicate is not None:
+        tracing.set_attributes({"whatsapp.duplicate": True})
+        return duplicate
+
+    if tracing.enabled:
+        payload[tracing.CARRIER_KEY] = tracing.inject()
+    # Queue the message and acknowledge Twilio straight away
+    try:
+        job_id = job_queue.enqueue(payload)
+    except Overloaded as e:
+        # Backpressure: answer now instead of queueing behind everyone
+        send_busy_message(payload["sender_number"], e.reason)
+        response = {"status": "busy", "reason": e.reason}
+        idempotency.complete(payload["message_sid"], response)
+        return response
+    except Exception:
+        idempotency.abandon(payload["message_sid"])
+        raise
+    response = {"status": "queued", "job_id": job_id}
+    idempotency.complete(payload["message_sid"], response)
+    return response
 
-                # Transcribed Text
-                transcribed_text = transcribe_voice_message(media_url, chat_session)
-                if transcribed_text:
-                    incoming_message = transcribed_text
-                else:
-                    incoming_message = translate_text("Sorry, I couldn't process the voice note.", chat_session.language)
-            else:
-                incoming_message = translate_text("Unsupported media type. Please send a voice note.", chat_session.language)
-        else:
-            incoming_message = request.form.get("Body", "").strip()
-
-        # Queue the task for asynchronous processing
-        process_whatsapp_message.delay(sender_number, profile_name, incoming_message, chat_session.to_dict())
-
-        return jsonify({"status": "success", "message": "Processing your request."}), 200
-    except Exception as e:
-        logger.error(f"Error in whatsapp_reply: {str(e)}")
-        error_message = translate_text("An error occurred. Please try again later.", chat_session.language)
-        client.messages.create(
-            from_=TWILIO_WHATSAPP_NUMBER,
-            to=sender_number,
-            body=error_message
-        )
-        return jsonify({"status": "error", "message": str(e)}), 500    
-"""
+@app.route("/metrics")
+def metrics_endpoint():
+    body, content_type = metrics.metrics_response()
+    return Response(body, content_type=content_type)
 
 @app.route("/whatsapp", methods=["POST"])
 def whatsapp_reply():
+    start = time.perf_counter()
     try:
-        print(request.form)
-        sender_number = request.form.get("From")
-        chat_session = get_chat_session(sender_number)
-
-        # Get the user's WhatsApp profile name
-        profile_name = request.form.get("ProfileName","User")
-        
-        
-        # Check if the message is a voice note
-        num_media = int(request.form.get("NumMedia", 0))
-        if num_media > 0:
-            media_url = request.form.get("MediaUrl0")
-            media_type = request.form.get("MediaContentType0", "")
-            
-            # Check if the media is a voice note (audio/ogg)
-            if media_type == "audio/ogg":
-                # Send a processing message
-                processing_message = client.messages.create(
-                    from_=TWILIO_WHATSAPP_NUMBER,
-                    to=sender_number,
-                    body=translate_text("Processing your voice note... ⏳",chat_session.language)
-                )
-
-                #Transcribed Text
-                transcribed_text = transcribe_voice_message(media_url,chat_session)
-                if transcribed_text:
-                    incoming_message = transcribed_text
-                else:
-                    incoming_message = translate_text("Sorry, I couldn't process the voice note.", chat_session.language)
-            else:
-                incoming_message = translate_text("Unsupported media type. Please send a voice note.", chat_session.language)
-        else:
-            incoming_message = request.form.get("Body", "").strip()
-
-        #Previous Language
-        previous=chat_session.language
-        
-        # Detect language from the incoming message
-        detected_language = translator.detect(incoming_message).lang
-        chat_session.language = detected_language
-        
-        
-        # Handle feedback (thumbs up/down)
-        if incoming_message in ["👍", "👎"]:
-        #if button_text:
-            is_feedback, message_sid = handle_button_response(incoming_message, chat_session, previous, sender_number)
-            if is_feedback:
-                return jsonify({"status": "success", "message_sid": message_sid})
-        
-        if chat_session.is_new_session:
-            welcome_message = send_message_with_template(
-                sender_number,
-                create_welcome_message(profile_name, chat_session.language),
-                incoming_message,
-                is_greeting=True,
-                language=chat_session.language
-            )
-            chat_session.conversation_history.append({
-                "timestamp": datetime.now().isoformat(),
-                "message": create_welcome_message(profile_name, chat_session.language),
-                "type": "outgoing",
-                "message_id": welcome_message.sid
-            })
-        
-        chat_session.conversation_history.append({
-            "timestamp": datetime.now().isoformat(),
-            "message": incoming_message,
-            "type": "incoming"
-        })
-
-        # Send a processing message for text inputs
-        if num_media == 0 and needs_rating(incoming_message):
-            processing_message = client.messages.create(
-                from_=TWILIO_WHATSAPP_NUMBER,
-                to=sender_number,
-                body=translate_text("Processing your request. ⏳",chat_session.language)
-            )
-            
-        api_response = call_external_api(incoming_message, chat_session)
-        response_text = api_response.get("message", "I am unable to provide a response now. Please try your query again.")
-
-        print(response_text)
-        
-        message = send_message_with_template(sender_number, response_text, incoming_message, language=chat_session.language)
-        chat_session.last_message_id = message.sid
-        
-        chat_session.conversation_history.append({
-            "timestamp": datetime.now().isoformat(),
-            "message": response_text,
-            "type": "outgoing",
-            "message_id": message.sid
-        })
-        
-        chat_session.last_activity = datetime.now()
-        save_chat_session(chat_session)
-        return jsonify({"status": "success", "message_sid": message.sid})
+        if not is_valid_twilio_request():
+            return jsonify({"status": "error", "message": "Invalid Twilio signature."}), 403
+
+        payload = build_job_payload(request.form)
+        if payload is None:
+            return jsonify({"status": "error", "message": "Missing sender."}), 400
+        if not payload["body"] and payload["num_media"] == 0:
+            return jsonify({"status": "ignored", "message": "Empty message."}), 200
+
+        # One trace per MessageSid, from here to the last reply
+        with tracing.message_span("whatsapp_reply", payload["message_sid"]):
+            response = accept_message(payload)
+        return jsonify(response), 200
     except Exception as e:
         logger.error(f"Error in whatsapp_reply: {str(e)}")
-        error_message = translate_text("An error occurred. Please try again later.", chat_session.language)
-        client.messages.create(
-            from_=TWILIO_WHATSAPP_NUMBER,
-            to=sender_number,
-            body=error_message
-        )
+        metrics.record_error("webhook")
         return jsonify({"status": "error", "message": str(e)}), 500
+    finally:
+        metrics.observe("webhook", time.perf_counter() - start)
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,325 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+
+import app2
+import metrics
+import tracing
+from app2 import (
+    BUSY_MESSAGE, build_job_payload, fact_check_client, idempotency, finish_message, is_valid_twilio_request,
+    job_queue, lookup_fact_check, prepare_message, redis_client, remember_fact_check, reply_after_failure,
+    save_message_state, scheduler, send_busy_message,
+)
+from fact_stream import EXTERNAL_API_STREAM, STREAM_ACCEPT, FactCheckStream
+from job_queue import WORKER_HEARTBEAT_TTL, InflightJobs, retry_delay
+from media_pipeline import media_type_of
+from outbound import track_sends
+from redis_store import make_async_redis_client, track_usage
+from scheduler import Overloaded
+from singleflight import AsyncSingleFlight
+
+logger = logging.getLogger(__name__)
+
+# asyncio webhook: run with
+#   gunicorn async_app:app --worker-class aiohttp.GunicornWebWorker
+# The slow fact-check call is awaited on the event loop, so one worker keeps
+# thousands of messages in flight. The short stages (sessions, translation,
+# media, sending) reuse app2's code on a thread pool.
+ASYNC_MAX_INFLIGHT = int(os.getenv("ASYNC_MAX_INFLIGHT", 2000))
+ASYNC_STAGE_THREADS = int(os.getenv("ASYNC_STAGE_THREADS", 64))
+ASYNC_UPSTREAM_CONNECTIONS = int(os.getenv("ASYNC_UPSTREAM_CONNECTIONS", 500))
+
+
+async def fetch_fact_check_async(http, user_query, on_partial=None):
+    start = time.perf_counter()
+    metrics.UPSTREAM_IN_FLIGHT.inc()
+    try:
+        result = await _fetch_fact_check_async(http, user_query, on_partial)
+    finally:
+        metrics.UPSTREAM_IN_FLIGHT.dec()
+        metrics.observe("upstream", time.perf_counter() - start)
+    if result.get("status") == "error":
+        metrics.record_error("upstream")
+    return result
+
+
+async def _fetch_fact_check_async(http, user_query, on_partial=None):
+    # Same circuit breakers, adaptive timeouts and failover as the sync
+    # client, without hedging
+    client = fact_check_client
+    headers = {"Accept": STREAM_ACCEPT} if EXTERNAL_API_STREAM else {}
+    tried = []
+    result = None
+    while True:
+        endpoint = client.pick(exclude=tried)
+        if endpoint is None:
+            break
+        tried.append(endpoint)
+        start = time.monotonic()
+        timeout = aiohttp.ClientTimeout(
+            total=None, connect=client.connect_timeout, sock_read=client.read_timeout(endpoint)
+        )
+        streamed = []
+
+        async def forward(part):
+            streamed.append(part)
+            if on_partial:
+                await on_partial(part)
+
+        try:
+            with tracing.http_span("fact_check.request", "POST", endpoint.url):
+                async with http.post(
+                    endpoint.url, json={"query": user_query}, headers=tracing.inject(dict(headers)), timeout=timeout
+                ) as response:
+                    tracing.set_attributes({"http.response.status_code": response.status})
+                    response.raise_for_status()
+                    content_type = response.headers.get("Content-Type", "")
+                    if "text/event-stream" in content_type or "ndjson" in content_type:
+                        result = await read_fact_check_stream_async(response, content_type, forward)
+                    else:
+                        data = await response.json(content_type=None)
+                        result = {"message": data.get("result", "Unexpected API response format.")}
+            endpoint.record_success(time.monotonic() - start)
+            return result
+        except asyncio.TimeoutError as e:
+            client.record_error(endpoint, e)
+            result = {"message": "The request to the external API timed out.", "status": "error"}
+        except Exception as e:
+            client.record_error(endpoint, e)
+            result = {"message": f"An error occurred: {e}", "status": "error"}
+        if streamed:
+            # The user already has part of this answer, don't start over
+            return result
+    if result is None:
+        client.rejected += 1
+        logger.warning("Fact-check backend unavailable, sending busy reply.")
+        return {"message": BUSY_MESSAGE, "status": "error"}
+    return result
+
+
+async def read_fact_check_stream_async(response, content_type, on_partial):
+    stream = FactCheckStream(content_type)
+    async for raw in response.content:
+        for part in stream.feed(raw.decode("utf-8").rstrip("\r\n")):
+            if on_partial:
+                await on_partial(part)
+    for part in stream.close():
+        if on_partial:
+            await on_partial(part)
+    if not stream.parts:
+        return {"message": "Unexpected API response format."}
+    return {"message": stream.message}
+
+
+async def call_external_api_async(state, user_query, chat_session, reply=None):
+    try:
+        cached, english_query, cache_key = await asyncio.to_thread(
+            lookup_fact_check, user_query, chat_session
+        )
+        if cached is not None:
+            return cached
+
+        async def send_part(part):
+            # Parts are sent one at a time so they stay in order
+            await asyncio.to_thread(reply.send, part)
+
+        async def fetch():
+            on_partial = send_part if reply is not None else None
+            result = await fetch_fact_check_async(state["http"], user_query, on_partial)
+            await asyncio.to_thread(remember_fact_check, english_query, cache_key, result)
+            return result
+
+        # Duplicates wait on the event loop instead of being parked for fan-out
+        return await state["single_flight"].do(cache_key, fetch)
+    except Exception as e:
+        logger.error(f"Error calling external API: {e}")
+        return {"message": f"An error occurred: {e}", "status": "error"}
+
+
+async def handle_whatsapp_message_async(state, payload):
+    with track_usage() as usage, track_sends() as sends:
+        # to_thread copies the context, so the stages count into usage and
+        # sends too
+        pipe = redis_client.pipeline()
+        try:
+            context = await asyncio.to_thread(prepare_message, payload, pipe)
+            if context is not None:
+                api_response = await call_external_api_async(
+                    state, context.incoming_message, context.chat_session, context.reply
+                )
+                await asyncio.to_thread(finish_message, context, api_response, pipe)
+            failed = None
+        except Exception as e:
+            if not sends:
+                # Nothing reached the user, retried below
+                raise
+            failed = e
+        await asyncio.to_thread(save_message_state, pipe)
+        if failed is not None:
+            await asyncio.to_thread(reply_after_failure, payload, failed)
+    metrics.observe_message(media_type_of(payload), payload.get("received_at"))
+    metrics.observe_redis(usage)
+    logger.debug(
+        f"Processed message {payload.get('message_sid')}: {usage.round_trips} Redis round trips, "
+        f"{usage.commands} commands, {usage.bytes_sent} bytes sent, {usage.bytes_received} bytes received"
+    )
+
+
+async def process_whatsapp_message_async(state, job):
+    # Same retry schedule and dead-letter list as the sync job queue
+    payload = job["payload"]
+    try:
+        with tracing.message_span(
+            "process_whatsapp_message", payload.get("message_sid"), payload.get(tracing.CARRIER_KEY),
+            kind=tracing.SpanKind.CONSUMER,
+        ):
+            await _process_whatsapp_message_async(state, job)
+    finally:
+        await asyncio.to_thread(state["jobs"].done, job)
+
+
+async def _process_whatsapp_message_async(state, job):
+    async with state["inflight"]:
+        while True:
+            try:
+                await handle_whatsapp_message_async(state, job["payload"])
+                return
+            except Exception as e:
+                logger.error(f"Job {job['id']} failed (attempt {job['attempt'] + 1}): {e}")
+                if job["attempt"] >= job_queue.max_retries:
+                    await asyncio.to_thread(job_queue.dead_letter, job, e)
+                    return
+                delay = retry_delay(job["attempt"])
+                job["attempt"] += 1
+                await asyncio.sleep(delay)
+
+
+async def deliver_fanout_async(waiter, result):
+    await asyncio.to_thread(app2.deliver_fanout, waiter, result)
+
+
+async def metrics_endpoint(request):
+    body, content_type = await asyncio.to_thread(metrics.metrics_response)
+    return web.Response(body=body, headers={"Content-Type": content_type})
+
+
+async def accept_message_async(app, payload):
+    # Idempotency check, admission and task start, returns the webhook response
+    duplicate = await asyncio.to_thread(idempotency.begin, payload["message_sid"])
+    if duplicate is not None:
+        tracing.set_attributes({"whatsapp.duplicate": True})
+        return duplicate
+
+    # Tasks are not queued through the fair scheduler, but the same
+    # per-sender rate and a cap on messages in flight apply
+    try:
+        if len(app["tasks"]) >= ASYNC_MAX_INFLIGHT:
+            raise Overloaded("busy")
+        if scheduler is not None:
+            await asyncio.to_thread(scheduler.admit, payload)
+    except Overloaded as e:
+        await asyncio.to_thread(send_busy_message, payload["sender_number"], e.reason)
+        response = {"status": "busy", "reason": e.reason}
+        await asyncio.to_thread(idempotency.complete, payload["message_sid"], response)
+        return response
+
+    if tracing.enabled:
+        payload[tracing.CARRIER_KEY] = tracing.inject()
+    # The job is in Redis before Twilio is acknowledged, so a crash doesn't
+    # lose the message: another process picks it up
+    try:
+        job = await asyncio.to_thread(app["jobs"].add, payload)
+    except Exception:
+        await asyncio.to_thread(idempotency.abandon, payload["message_sid"])
+        raise
+    start_job(app, job)
+    response = {"status": "queued", "job_id": job["id"]}
+    await asyncio.to_thread(idempotency.complete, payload["message_sid"], response)
+    return response
+
+
+def start_job(app, job):
+    tasks = app["tasks"]
+    task = asyncio.create_task(process_whatsapp_message_async(app, job))
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+
+
+async def keep_inflight_jobs(app):
+    # Heartbeat for this process's jobs, and takes over those of processes
+    # that stopped
+    while True:
+        try:
+            await asyncio.to_thread(app["jobs"].heartbeat)
+            for job in await asyncio.to_thread(app["jobs"].recover):
+                start_job(app, job)
+        except Exception as e:
+            logger.error(f"Error keeping in-flight jobs: {e}")
+        await asyncio.sleep(WORKER_HEARTBEAT_TTL / 3)
+
+
+async def whatsapp_reply(request):
+    start = time.perf_counter()
+    try:
+        form = await request.post()
+        signature = request.headers.get("X-Twilio-Signature", "")
+        if not is_valid_twilio_request(str(request.url), dict(form), signature):
+            return web.json_response({"status": "error", "message": "Invalid Twilio signature."}, status=403)
+
+        payload = build_job_payload(form)
+        if payload is None:
+            return web.json_response({"status": "error", "message": "Missing sender."}, status=400)
+        if not payload["body"] and payload["num_media"] == 0:
+            return web.json_response({"status": "ignored", "message": "Empty message."})
+
+        # One trace per MessageSid, from here to the last reply
+        with tracing.message_span("whatsapp_reply", payload["message_sid"]):
+            response = await accept_message_async(request.app, payload)
+        return web.json_response(response)
+    except Exception as e:
+        logger.error(f"Error in whatsapp_reply: {str(e)}")
+        metrics.record_error("webhook")
+        return web.json_response({"status": "error", "message": str(e)}, status=500)
+    finally:
+        metrics.observe("webhook", time.perf_counter() - start)
+
+
+async def on_startup(app):
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(ASYNC_STAGE_THREADS, thread_name_prefix="async-stage"))
+    app["http"] = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=ASYNC_UPSTREAM_CONNECTIONS, keepalive_timeout=60),
+    )
+    app["async_redis"] = make_async_redis_client()
+    app["single_flight"] = AsyncSingleFlight(app["async_redis"], fanout=deliver_fanout_async)
+    app["inflight"] = asyncio.Semaphore(ASYNC_MAX_INFLIGHT)
+    app["tasks"] = set()
+    # Created here, in the worker process, its id includes the pid
+    app["jobs"] = InflightJobs(redis_client)
+    metrics.stats_collector.add("inflight_jobs", app["jobs"].stats)
+    app["jobs_keeper"] = asyncio.create_task(keep_inflight_jobs(app))
+
+
+async def on_cleanup(app):
+    # Let in-flight messages finish before the worker exits
+    app["jobs_keeper"].cancel()
+    if app["tasks"]:
+        await asyncio.gather(*app["tasks"], return_exceptions=True)
+    await app["http"].close()
+    await app["async_redis"].aclose()
+
+
+app = web.Application()
+app.router.add_post("/whatsapp", whatsapp_reply)
+app.router.add_get("/metrics", metrics_endpoint)
+app.on_startup.append(on_startup)
+app.on_cleanup.append(on_cleanup)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(app, port=int(os.getenv("PORT", 5000)))
@@ -0,0 +1,136 @@
+# Benchmark for the near-duplicate claim index.
+#
+#   python -m benchmarks.bench_claim_index --claims 100000 --queries 5000
+#
+# Builds a synthetic corpus of forwarded-style claims, indexes it, then looks
+# up perturbed copies (extra words, emoji, "pls check") and unseen claims to
+# report hit rate, false matches and lookup latency. Pass --redis to use the
+# Redis store from REDIS_URL instead of the in-memory one.
+import argparse
+import os
+import random
+import statistics
+import time
+from urllib.parse import urlparse
+
+from claim_index import ClaimIndex, MemoryIndexStore, RedisIndexStore, NUM_SLOTS
+
+SUBJECTS = [
+    "the government", "the ministry of health", "the central bank", "the president",
+    "WHO", "scientists", "the governor", "NCDC", "the army", "a new study", "the senate",
+    "the electoral commission", "the police", "the university", "doctors", "the UN",
+]
+VERBS = [
+    "will give", "has banned", "confirmed", "announced", "is distributing", "secretly approved",
+    "has cancelled", "warned about", "is paying", "discovered", "has closed", "recalled",
+]
+OBJECTS = [
+    "free data to every citizen", "a cure for malaria", "a new naira note", "salt water as treatment",
+    "5G towers in the capital", "vaccines with microchips", "cash grants for students",
+    "a curfew from tomorrow", "fuel at half price", "exams for next week", "contaminated rice",
+    "a lockdown in all states", "bank accounts without BVN", "a new strain of the virus",
+]
+PLACES = ["in Lagos", "in Abuja", "in Kano", "nationwide", "in Nairobi", "in Accra", "in all schools", ""]
+FILLERS = ["pls check", "is this true?", "forward to everyone", "😱😱", "🙏", "!!!", "share before they delete it"]
+
+
+def make_claim(rng):
+    amount = rng.choice(["", f" worth {rng.randint(1, 500) * 1000} naira", f" of {rng.randint(2, 90)} percent"])
+    link = rng.choice(["", f" https://news{rng.randint(1, 9999)}.example.com/story/{rng.randint(1, 10 ** 6)}"])
+    return (
+        f"{rng.choice(SUBJECTS)} {rng.choice(VERBS)} {rng.choice(OBJECTS)}{amount} "
+        f"{rng.choice(PLACES)}{link} ref {rng.randint(1, 10 ** 9)}"
+    ).strip()
+
+
+def perturb(rng, claim):
+    words = claim.split()
+    choice = rng.random()
+    if choice < 0.4:
+        words.append(rng.choice(FILLERS))
+    elif choice < 0.6:
+        words.insert(0, rng.choice(FILLERS))
+    elif choice < 0.8:
+        i = rng.randrange(len(words))
+        words[i] = words[i].upper()
+        words.append(rng.choice(FILLERS))
+    else:
+        # Change one word, like a forward that was retyped
+        i = rng.randrange(len(words) - 1)
+        words[i] = rng.choice(["really", "now", "officially", "just"])
+    return " ".join(words)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def make_store(use_redis):
+    if not use_redis:
+        return MemoryIndexStore()
+    import redis
+    url = urlparse(os.environ.get("REDIS_URL"))
+    client = redis.Redis(
+        host=url.hostname,
+        port=url.port,
+        password=url.password,
+        ssl=(url.scheme == "rediss"),
+        ssl_cert_reqs=None
+    )
+    return RedisIndexStore(client, ttl=3600)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--claims", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--threshold", type=float, default=None)
+    parser.add_argument("--redis", action="store_true")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [make_claim(rng) for _ in range(args.claims)]
+    index = ClaimIndex(make_store(args.redis))
+    if args.threshold is not None:
+        index.threshold = args.threshold
+
+    start = time.perf_counter()
+    for i, claim in enumerate(corpus):
+        index.add(claim, f"claim{i}")
+    build_seconds = time.perf_counter() - start
+
+    def run(queries):
+        latencies = []
+        results = []
+        for expected, text in queries:
+            t0 = time.perf_counter()
+            match = index.lookup(text)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            results.append((expected, match))
+        return latencies, results
+
+    near = [(i, perturb(rng, corpus[i])) for i in rng.sample(range(len(corpus)), args.queries)]
+    unseen = [(None, make_claim(rng)) for _ in range(args.queries)]
+    near_latency, near_results = run(near)
+    unseen_latency, unseen_results = run(unseen)
+
+    correct = sum(1 for i, m in near_results if m is not None and m[0] == f"claim{i}")
+    wrong = sum(1 for i, m in near_results if m is not None and m[0] != f"claim{i}")
+    false_matches = sum(1 for _, m in unseen_results if m is not None)
+    latencies = near_latency + unseen_latency
+
+    print(f"claims indexed:        {len(corpus)} in {build_seconds:.1f}s "
+          f"({len(corpus) / build_seconds:.0f}/s)")
+    print(f"signature size:        {NUM_SLOTS * 4} bytes")
+    print(f"threshold:             {index.threshold}")
+    print(f"near-duplicate hits:   {correct / len(near):.1%} ({wrong} matched the wrong claim)")
+    print(f"unseen false matches:  {false_matches / len(unseen):.2%}")
+    print(f"overall hit rate:      {index.stats()['hit_rate']:.1%}")
+    print(f"lookup latency:        p50 {percentile(latencies, 50):.3f} ms, "
+          f"p99 {percentile(latencies, 99):.3f} ms, mean {statistics.mean(latencies):.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+# End-to-end load test of app2 with every external service running locally.
+#
+#   python -m benchmarks.bench_e2e --rate 20 --duration 30
+#   python -m benchmarks.bench_e2e --rate 20 --json run.json --compare baseline.json
+#
+# Starts the fake fact-check API (fake_upstream), the mock Twilio API, which
+# also serves voice note and screenshot media, and fake translation,
+# transcription and OCR services (fake_services). It runs app2's Flask app on a local port with
+# fakeredis, or REDIS_URL with --redis. A traffic generator then posts
+# Twilio-style webhook forms at a steady rate: new claims, repeated claims,
+# claims in other languages, 👍/👎 feedback, greetings, voice notes and
+# forwarded screenshots, some with two attachments. Every
+# --viral-every seconds a burst of senders forwards the same claim at once.
+#
+# It reports webhook RPS and latency, end-to-end latency per kind of message
+# (webhook received to message handled, including queueing) and the
+# per-stage breakdown from the Prometheus histograms. --json saves the
+# results. --compare fails if p99 latency or throughput regressed by more
+# than --tolerance against a saved run.
+#
+# The app runs with its production settings, including TWILIO_RATE_LIMIT (10
+# messages per second per sending number) and the per-sender scheduler
+# limits. Override them through the environment to look past those limits.
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from benchmarks.bench_claim_index import make_claim
+from benchmarks.fake_services import FakeServicesServer, HTTPOCRBackend, HTTPTranscriptionBackend, HTTPTranslator
+from benchmarks.fake_upstream import FakeUpstreamServer
+from benchmarks.mock_twilio import MockTwilioServer
+
+KINDS = ("claim", "repeat", "foreign", "feedback", "greeting", "voice", "screenshot", "viral")
+FOREIGN_CLAIMS = [
+    "Shin gaskiya ne cewa gwamnati za ta ba kowa kudi a wannan watan?",
+    "Est-ce vrai que le gouvernement va fermer toutes les écoles demain?",
+    "Je, ni kweli kwamba serikali itatoa chakula bure kwa kila mtu?",
+    "Se otito ni pe ijoba yoo fun gbogbo eniyan ni owo?",
+]
+GREETINGS = ["hi", "Hello", "good morning", "thanks 🙏", "ok", "Sannu"]
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        kind, _, weight = item.partition("=")
+        if kind.strip() not in KINDS:
+            raise ValueError(f"Unknown message kind: {kind}")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def make_voice_note(path=None):
+    # Ogg bytes for voice notes: --voice-file, or two seconds of tone encoded
+    # with ffmpeg. None when neither is available.
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    if shutil.which("ffmpeg") is None:
+        return None
+    from pydub.generators import Sine
+    buffer = io.BytesIO()
+    Sine(440).to_audio_segment(duration=2000).export(buffer, format="ogg", codec="libopus")
+    return buffer.getvalue()
+
+
+def make_screenshots(rng, count, size=80 * 1024):
+    # Stand-in JPEG bytes, the fake OCR doesn't decode them. A few of them
+    # keep being forwarded, like viral screenshots do.
+    return [b"\xff\xd8\xff\xe0" + rng.randbytes(size) for _ in range(count)]
+
+
+class Traffic:
+    # Twilio webhook forms for each kind of message
+    def __init__(self, rng, senders, popular, voice_url, screenshot_urls=()):
+        self.rng = rng
+        self.senders = [f"whatsapp:+234{n:010d}" for n in range(senders)]
+        self.popular = [make_claim(rng) for _ in range(popular)]
+        self.voice_url = voice_url
+        self.screenshot_urls = list(screenshot_urls)
+
+    def form(self, kind, sender=None, body=None):
+        sender = sender or self.rng.choice(self.senders)
+        form = {
+            "MessageSid": "SM" + uuid.uuid4().hex,
+            "AccountSid": "ACbench",
+            "From": sender,
+            "To": os.environ["TWILIO_WHATSAPP_NUMBER"],
+            "ProfileName": f"Bench {sender[-4:]}",
+            "WaId": sender.split("+")[-1],
+            "SmsStatus": "received",
+            "NumMedia": "0",
+            "Body": body or "",
+        }
+        if kind == "voice":
+            form.update(NumMedia="1", MediaUrl0=self.voice_url, MediaContentType0="audio/ogg")
+        elif kind == "screenshot":
+            urls = self.rng.sample(self.screenshot_urls, 2 if self.rng.random() < 0.3 else 1)
+            form["NumMedia"] = str(len(urls))
+            for i, url in enumerate(urls):
+                form.update({f"MediaUrl{i}": url, f"MediaContentType{i}": "image/jpeg"})
+        elif body is None:
+            form["Body"] = {
+                "claim": lambda: make_claim(self.rng),
+                "repeat": lambda: self.rng.choice(self.popular),
+                "foreign": lambda: self.rng.choice(FOREIGN_CLAIMS),
+                "feedback": lambda: self.rng.choice(["👍", "👎"]),
+                "greeting": lambda: self.rng.choice(GREETINGS),
+            }[kind]()
+        return form
+
+    def schedule(self, mix, rate, duration, viral_every, viral_size):
+        # (offset in seconds, kind, form), sorted by offset
+        kinds = list(mix)
+        weights = [mix[k] for k in kinds]
+        events = []
+        for i in range(int(rate * duration)):
+            kind = self.rng.choices(kinds, weights)[0]
+            events.append((i / rate, kind, self.form(kind)))
+        if viral_every:
+            t = viral_every
+            while t < duration:
+                claim = make_claim(self.rng)
+                for sender in self.rng.sample(self.senders, min(viral_size, len(self.senders))):
+                    events.append((t + self.rng.uniform(0, 0.5), "viral", self.form("viral", sender, claim)))
+                t += viral_every
+        return sorted(events, key=lambda event: event[0])
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.kinds = {}
+        self.webhook = []
+        self.statuses = {}
+        self.handled = {kind: [] for kind in KINDS}
+        self.first_handled = None
+        self.last_handled = None
+
+    def posted(self, sid, kind, latency, status):
+        with self.lock:
+            self.kinds[sid] = kind
+            self.webhook.append(latency)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def finished(self, payload):
+        now = time.time()
+        with self.lock:
+            kind = self.kinds.get(payload.get("message_sid"), "claim")
+            self.handled[kind].append(now - payload["received_at"])
+            self.first_handled = self.first_handled or now
+            self.last_handled = now
+
+    def handled_count(self):
+        with self.lock:
+            return sum(len(samples) for samples in self.handled.values())
+
+
+def histogram_breakdown(histogram, label="stage"):
+    # Count, mean and bucket-interpolated p50/p99 per label value, "all"
+    # for a histogram without labels
+    buckets, sums, counts = {}, {}, {}
+    for family in histogram.collect():
+        for sample in family.samples:
+            stage = sample.labels.get(label, "all")
+            if sample.name.endswith("_bucket"):
+                buckets.setdefault(stage, []).append((float(sample.labels["le"]), sample.value))
+            elif sample.name.endswith("_sum"):
+                sums[stage] = sample.value
+            elif sample.name.endswith("_count"):
+                counts[stage] = sample.value
+
+    def quantile(stage, q):
+        target = q * counts[stage]
+        lower_bound, lower_count = 0.0, 0.0
+        for bound, cumulative in sorted(buckets[stage]):
+            if cumulative >= target:
+                if bound == float("inf"):
+                    return lower_bound
+                share = (target - lower_count) / (cumulative - lower_count) if cumulative > lower_count else 0
+                return lower_bound + (bound - lower_bound) * share
+            lower_bound, lower_count = bound, cumulative
+        return lower_bound
+
+    return {
+        stage: {
+            "count": int(counts[stage]),
+            "mean": sums[stage] / counts[stage],
+            "p50": quantile(stage, 0.5),
+            "p99": quantile(stage, 0.99),
+        }
+        for stage in counts if counts[stage]
+    }
+
+
+def compare(summary, baseline, tolerance):
+    # Regressions against a saved run, as printable strings
+    regressions = []
+    for kind, stats in summary["e2e"].items():
+        before = baseline.get("e2e", {}).get(kind)
+        if before and before["p99"] and stats["p99"] > before["p99"] * (1 + tolerance):
+            regressions.append(f"{kind} p99 {before['p99']:.2f}s -> {stats['p99']:.2f}s")
+    if summary["throughput"] < baseline.get("throughput", 0) * (1 - tolerance):
+        regressions.append(f"throughput {baseline['throughput']:.1f} -> {summary['throughput']:.1f} msg/s")
+    before = (baseline.get("first_reply") or {}).get("p99")
+    if before and summary["first_reply"] and summary["first_reply"]["p99"] > before * (1 + tolerance):
+        regressions.append(f"first reply p99 {before:.2f}s -> {summary['first_reply']['p99']:.2f}s")
+    before = baseline.get("webhook", {}).get("p99")
+    if before and summary["webhook"]["p99"] > before * (1 + tolerance):
+        regressions.append(f"webhook p99 {before * 1000:.1f}ms -> {summary['webhook']['p99'] * 1000:.1f}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test with local stand-ins")
+    parser.add_argument("--rate", type=float, default=20, help="webhooks per second, not counting viral bursts")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of traffic")
+    parser.add_argument("--concurrency", type=int, default=64, help="webhook requests in flight")
+    parser.add_argument("--senders", type=int, default=2000)
+    parser.add_argument(
+        "--mix", default="claim=0.25,repeat=0.15,foreign=0.1,feedback=0.15,greeting=0.15,voice=0.1,screenshot=0.1"
+    )
+    parser.add_argument("--screenshots", type=int, default=8, help="distinct screenshots being forwarded")
+    parser.add_argument("--popular", type=int, default=20, help="claims that keep coming back")
+    parser.add_argument("--viral-every", type=float, default=10, help="seconds between viral bursts, 0 disables them")
+    parser.add_argument("--viral-size", type=int, default=50, help="senders forwarding each viral claim")
+    parser.add_argument("--upstream-ms", type=float, default=1500, help="fact-check API latency")
+    parser.add_argument("--upstream-jitter-ms", type=float, default=500)
+    parser.add_argument("--upstream-error-rate", type=float, default=0.0)
+    parser.add_argument("--stream", action="store_true", help="fact-check API answers with server-sent events")
+    parser.add_argument("--twilio-ms", type=float, default=80)
+    parser.add_argument("--translate-ms", type=float, default=120)
+    parser.add_argument("--transcribe-ms", type=float, default=900)
+    parser.add_argument("--ocr-ms", type=float, default=400)
+    parser.add_argument("--sigma", type=float, default=0.5, help="log-normal spread of translate/transcribe latency")
+    parser.add_argument("--voice-file", help="Ogg voice note to send, generated with ffmpeg by default")
+    parser.add_argument("--cold", action="store_true", help="don't pre-translate the fixed bot messages")
+    parser.add_argument("--redis", action="store_true", help="use REDIS_URL instead of fakeredis")
+    parser.add_argument("--drain-timeout", type=float, default=120, help="seconds to wait for queued messages")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression against --compare")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+
+    upstream = FakeUpstreamServer(
+        latency_ms=args.upstream_ms, jitter_ms=args.upstream_jitter_ms,
+        error_rate=args.upstream_error_rate, stream=args.stream
+    ).start()
+    twilio = MockTwilioServer(latency_ms=args.twilio_ms).start()
+    services = FakeServicesServer(
+        translate_ms=args.translate_ms, transcribe_ms=args.transcribe_ms, sigma=args.sigma, ocr_ms=args.ocr_ms
+    ).start()
+
+    # app2 reads its configuration at import time
+    os.environ.update({
+        "EXTERNAL_API": upstream.url,
+        "EXTERNAL_API_STREAM": "true" if args.stream else "false",
+        "TWILIO_API_BASE": twilio.url,
+        "TWILIO_ACCOUNT_SID": "ACbench",
+        "TWILIO_AUTH_TOKEN": "bench",
+        "TWILIO_WHATSAPP_NUMBER": "whatsapp:+10000000000",
+        "TWILIO_VALIDATE_SIGNATURE": "false",
+        "QUEUE_BACKEND": "thread",
+        # Warmed below, once the fake translator is in place
+        "TRANSLATION_WARM_LANGUAGES": "",
+        # Filled with the fake translations, kept out of the real catalog
+        "MESSAGE_CATALOG_FILE": os.path.join(tempfile.mkdtemp(), "message_catalog.json"),
+    })
+    if not args.redis:
+        os.environ["REDIS_URL"] = "fakeredis://"
+
+    import app2
+    import metrics
+    from werkzeug.serving import make_server
+
+    translator = HTTPTranslator(services.url)
+    app2.translation_cache.translator = translator
+    app2.language_detector.translator = translator
+    app2.transcriber.backend = HTTPTranscriptionBackend(services.url)
+    app2.image_reader.backend = HTTPOCRBackend(services.url)
+    if args.redis:
+        app2.redis_client.flushdb()
+    if not args.cold:
+        for language in ("ha", "fr", "sw", "yo"):
+            app2.message_catalog.fill(language)
+
+    mix = parse_mix(args.mix)
+    voice = make_voice_note(args.voice_file)
+    if voice is None and mix.pop("voice", None):
+        print("No ffmpeg and no --voice-file, skipping voice notes")
+    voice_url = twilio.add_media("voice.ogg", "audio/ogg", voice) if voice else None
+    screenshot_urls = [
+        twilio.add_media(f"screenshot{i}.jpg", "image/jpeg", image)
+        for i, image in enumerate(make_screenshots(rng, max(2, args.screenshots)))
+    ]
+
+    results = Results()
+    handler = app2.job_queue.handler
+
+    def timed_handler(payload):
+        try:
+            handler(payload)
+        finally:
+            results.finished(payload)
+
+    app2.job_queue.handler = timed_handler
+
+    server = make_server("127.0.0.1", 0, app2.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    webhook_url = f"http://127.0.0.1:{server.server_port}/whatsapp"
+
+    traffic = Traffic(rng, args.senders, args.popular, voice_url, screenshot_urls)
+    events = traffic.schedule(mix, args.rate, args.duration, args.viral_every, args.viral_size)
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=args.concurrency))
+    print(f"Sending {len(events)} webhooks over {args.duration:.0f}s to {webhook_url}")
+
+    def post(event):
+        offset, kind, form = event
+        time.sleep(max(0.0, start + offset - time.monotonic()))
+        sent = time.perf_counter()
+        try:
+            response = session.post(webhook_url, data=form, timeout=30)
+            status = response.json().get("status", str(response.status_code))
+        except Exception as e:
+            status = type(e).__name__
+        results.posted(form["MessageSid"], kind, time.perf_counter() - sent, status)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(post, events))
+    sent_for = time.monotonic() - start
+
+    queued = results.statuses.get("queued", 0)
+    deadline = time.monotonic() + args.drain_timeout
+    while results.handled_count() < queued and time.monotonic() < deadline:
+        time.sleep(0.2)
+    # Rating prompts and fan-out replies go out a moment after the answer
+    time.sleep(1.5)
+    server.shutdown()
+
+    handled = results.handled_count()
+    busy_window = (results.last_handled - results.first_handled) if handled > 1 else 0
+    summary = {
+        "webhooks": len(events),
+        "statuses": results.statuses,
+        "webhook": {
+            "rps": len(events) / sent_for,
+            "p50": percentile(results.webhook, 0.5),
+            "p99": percentile(results.webhook, 0.99),
+        },
+        "handled": handled,
+        "throughput": handled / busy_window if busy_window else 0.0,
+        "e2e": {
+            kind: {
+                "count": len(samples),
+                "p50": percentile(samples, 0.5),
+                "p99": percentile(samples, 0.99),
+                "max": max(samples),
+            }
+            for kind, samples in results.handled.items() if samples
+        },
+        "stages": histogram_breakdown(metrics.STAGE_SECONDS),
+        "first_reply": histogram_breakdown(metrics.FIRST_REPLY_SECONDS).get("all"),
+        "upstream_requests": upstream.requests,
+        "twilio_messages": len(twilio.messages),
+        "twilio_throttled": app2.outbound.stats()["throttled"],
+        "services": dict(services.counts),
+    }
+
+    print(
+        f"webhook   {summary['webhook']['rps']:6.1f} req/s  p50 {summary['webhook']['p50'] * 1000:6.1f}ms  "
+        f"p99 {summary['webhook']['p99'] * 1000:6.1f}ms  {results.statuses}"
+    )
+    print(f"handled   {handled}/{queued} queued messages, {summary['throughput']:.1f} msg/s")
+    print("end-to-end (webhook received -> message handled)")
+    for kind, stats in summary["e2e"].items():
+        print(f"  {kind:<9} {stats['count']:5d}  p50 {stats['p50']:6.2f}s  p99 {stats['p99']:6.2f}s  max {stats['max']:6.2f}s")
+    if summary["first_reply"]:
+        stats = summary["first_reply"]
+        print(
+            f"first reply (webhook received -> first answer sent) {stats['count']:5d}  "
+            f"p50 ~{stats['p50']:6.2f}s  p99 ~{stats['p99']:6.2f}s"
+        )
+    print("stages (from factcheck_stage_seconds)")
+    for stage, stats in summary["stages"].items():
+        print(
+            f"  {stage:<15} {stats['count']:6d}  mean {stats['mean'] * 1000:8.1f}ms  "
+            f"p50 ~{stats['p50'] * 1000:8.1f}ms  p99 ~{stats['p99'] * 1000:8.1f}ms"
+        )
+    print(
+        f"upstream  {summary['upstream_requests']} fact-check requests, "
+        f"twilio {summary['twilio_messages']} messages ({summary['twilio_throttled']} throttled), "
+        f"services {summary['services']}"
+    )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(summary, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
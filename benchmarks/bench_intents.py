@@ -0,0 +1,108 @@
+# Benchmark for the small-talk intent classifier.
+#
+#   python -m benchmarks.bench_intents --messages 50000 --chat-share 0.3
+#
+# Builds a mix of chit-chat ("hi", "thanks 🙏", "ok bye") and claims, some of
+# them short or starting with a greeting ("hello, is it true that ..."), and
+# runs it through IntentClassifier and through the old substring scan used by
+# needs_rating. Reports per-message cost, the share of fact-check calls the
+# classifier avoids, claims wrongly answered with small talk and chit-chat
+# that would still go upstream.
+import argparse
+import random
+import time
+
+from benchmarks.bench_claim_index import SUBJECTS, VERBS, OBJECTS, PLACES
+from intents import IntentClassifier
+
+CHAT = [
+    "hi", "Hi", "hello", "Hello!", "hey", "heyyy", "good morning", "Good evening sir", "hello bot",
+    "how are you", "how far", "Sannu", "ina kwana", "bawo ni", "kedu", "jambo", "bonjour",
+    "thanks", "Thank you so much 🙏", "thank you", "thanks a lot", "na gode", "e se", "asante",
+    "ok", "Okay", "ok thanks", "ok thanks bye", "alright", "noted", "got it", "cool", "nice one",
+    "wow", "amazing", "lol", "hmm", "yes", "no", "bye", "goodbye", "good night", "take care",
+    "🙏", "😂😂", "👍", "👎", "👍🏽",
+]
+PREFIXES = ["", "", "", "hi ", "hello, ", "good morning ", "pls ", "ok but "]
+SUFFIXES = ["", "", "is this true?", "pls check", "🙏", "thanks", "!!!"]
+SHORT_CLAIMS = [
+    "Is salt water a cure?", "garlic cures covid", "vaccines contain microchips",
+    "is this true?", "the election is cancelled", "hi is it true that fuel price doubled?",
+    "this is fake news right", "NCDC confirmed lockdown", "bank holiday tomorrow?",
+]
+
+
+def old_needs_rating(response_text):
+    # needs_rating before the classifier, a substring scan
+    casual_patterns = [
+        "thank you", "thanks", "you're welcome", "noted",
+        "got it", "understood", "👍", "🙏", "nice", "bravo", "amazing", "impressive",
+        "sorry", "please", "hi", "hello", "hey", "good morning", "good afternoon",
+        "good evening", "thanks", "thank you", "bye", "goodbye", "cool", "yeah", "yah", "alright",
+        "oh", "oops", "ok", "yes"
+    ]
+    text = response_text.lower().strip()
+    is_short = len(text.split()) < 10
+    is_casual = any(pattern in text for pattern in casual_patterns)
+    is_error = "error" in text or "an error occurred" in text
+    has_emoji_ending = text.endswith(('!', '👋', '🙂', '😊'))
+    return not (is_short and (is_casual or has_emoji_ending or is_error))
+
+
+def make_claim(rng):
+    if rng.random() < 0.2:
+        return rng.choice(SHORT_CLAIMS)
+    claim = f"{rng.choice(SUBJECTS)} {rng.choice(VERBS)} {rng.choice(OBJECTS)} {rng.choice(PLACES)}".strip()
+    return f"{rng.choice(PREFIXES)}{claim} {rng.choice(SUFFIXES)}".strip()
+
+
+def corpus(rng, total, chat_share):
+    # (message, is_chat)
+    messages = []
+    for _ in range(total):
+        if rng.random() < chat_share:
+            messages.append((rng.choice(CHAT), True))
+        else:
+            messages.append((make_claim(rng), False))
+    return messages
+
+
+def measure(name, is_chat, messages):
+    skipped = false_skips = misses = 0
+    start = time.perf_counter()
+    verdicts = [is_chat(text) for text, _ in messages]
+    elapsed = time.perf_counter() - start
+    for verdict, (_, chat) in zip(verdicts, messages):
+        if verdict:
+            skipped += 1
+            if not chat:
+                false_skips += 1
+        elif chat:
+            misses += 1
+    claims = sum(1 for _, chat in messages if not chat)
+    print(
+        f"{name:<12} {elapsed / len(messages) * 1e6:6.2f}µs/msg  "
+        f"upstream calls avoided {skipped / len(messages):6.1%}  "
+        f"claims treated as chat {false_skips:5d} ({false_skips / max(claims, 1):.1%})  "
+        f"chat sent upstream {misses:5d}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Intent classifier benchmark")
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--chat-share", type=float, default=0.3, help="share of messages that are small talk")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    messages = corpus(rng, args.messages, args.chat_share)
+    classifier = IntentClassifier()
+
+    measure("substring", lambda text: not old_needs_rating(text), messages)
+    measure("classifier", lambda text: classifier.route(text) is not None, messages)
+    print(f"classifier stats: {classifier.stats()}")
+
+
+if __name__ == "__main__":
+    main()
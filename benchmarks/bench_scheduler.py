@@ -0,0 +1,178 @@
+# Simulation of the fair scheduler under a spammy sender.
+#
+#   python -m benchmarks.bench_scheduler --workers 8 --spam 300 --users 40
+#
+# One sender floods the bot with fact-checks while ordinary users send one
+# claim and one 👍 each. Workers "process" jobs by sleeping for the service
+# time. Runs the same traffic through a plain FIFO queue and through
+# FairScheduler (on fakeredis, or REDIS_URL with --redis) and reports how
+# long each group waited before its job started, and how many were rejected.
+import argparse
+import queue
+import random
+import threading
+import time
+
+from scheduler import FairScheduler, Overloaded
+from redis_store import make_redis_client
+
+SPAMMER = "whatsapp:+2340000000000"
+
+
+def classify(payload):
+    cheap = payload["body"] == "👍"
+    return payload["sender_number"], cheap, 1
+
+
+def traffic(args):
+    # (arrival offset in seconds, payload)
+    events = [(i * 0.001, {"sender_number": SPAMMER, "body": f"claim {i}"}) for i in range(args.spam)]
+    for u in range(args.users):
+        sender = f"whatsapp:+2348{u:09d}"
+        arrival = random.uniform(0.05, args.window)
+        events.append((arrival, {"sender_number": sender, "body": f"claim from user {u}"}))
+        events.append((arrival + random.uniform(0.05, 0.5), {"sender_number": sender, "body": "👍"}))
+    return sorted(events, key=lambda event: event[0])
+
+
+def group(payload):
+    if payload["body"] == "👍":
+        return "cheap"
+    return "spammer" if payload["sender_number"] == SPAMMER else "users"
+
+
+class Recorder:
+    def __init__(self):
+        self.waits = {"spammer": [], "users": [], "cheap": []}
+        self.rejected = {"spammer": 0, "users": 0, "cheap": 0}
+        self.lock = threading.Lock()
+
+    def started(self, payload):
+        with self.lock:
+            self.waits[group(payload)].append(time.monotonic() - payload["enqueued_at"])
+
+    def reject(self, payload):
+        with self.lock:
+            self.rejected[group(payload)] += 1
+
+    def report(self, name):
+        print(name)
+        for key, waits in self.waits.items():
+            waits = sorted(waits)
+            if waits:
+                p50 = waits[len(waits) // 2]
+                p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))]
+                summary = f"p50 {p50:6.2f}s  p95 {p95:6.2f}s  max {waits[-1]:6.2f}s"
+            else:
+                summary = "-"
+            print(f"  {key:<8} started {len(waits):4d}  rejected {self.rejected[key]:4d}  wait {summary}")
+
+
+def service_time(payload, args):
+    return args.cheap_ms / 1000 if payload["body"] == "👍" else args.service_ms / 1000
+
+
+def run_fifo(events, args):
+    jobs = queue.Queue()
+    recorder = Recorder()
+    remaining = [len(events)]
+    done = threading.Event()
+
+    def worker():
+        while True:
+            payload = jobs.get()
+            recorder.started(payload)
+            time.sleep(service_time(payload, args))
+            with recorder.lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    done.set()
+
+    for _ in range(args.workers):
+        threading.Thread(target=worker, daemon=True).start()
+    start = time.monotonic()
+    for offset, payload in events:
+        time.sleep(max(0.0, start + offset - time.monotonic()))
+        payload = dict(payload, enqueued_at=time.monotonic())
+        jobs.put(payload)
+    done.wait()
+    recorder.report("FIFO queue")
+
+
+def run_fair(events, args, redis_client):
+    redis_client.flushdb()
+    scheduler = FairScheduler(
+        redis_client, classify, max_depth=args.max_depth, sender_max_queued=args.sender_max_queued,
+        sender_concurrency=1, sender_rate=args.sender_rate, sender_burst=args.sender_burst, weights={}
+    )
+    recorder = Recorder()
+    payloads = {}
+    remaining = [0]
+    done = threading.Event()
+    feeding = threading.Event()
+
+    def finish():
+        with recorder.lock:
+            remaining[0] -= 1
+            if remaining[0] == 0 and feeding.is_set():
+                done.set()
+
+    def worker():
+        while True:
+            item = scheduler.pop(timeout=1)
+            if item is None:
+                continue
+            job_id, sender = item
+            payload = payloads[job_id]
+            recorder.started(payload)
+            time.sleep(service_time(payload, args))
+            scheduler.release(sender)
+            finish()
+
+    for _ in range(args.workers):
+        threading.Thread(target=worker, daemon=True).start()
+    start = time.monotonic()
+    for i, (offset, payload) in enumerate(events):
+        time.sleep(max(0.0, start + offset - time.monotonic()))
+        job = {"id": str(i), "payload": dict(payload, enqueued_at=time.monotonic())}
+        payloads[job["id"]] = job["payload"]
+        with recorder.lock:
+            remaining[0] += 1
+        try:
+            scheduler.push(job)
+        except Overloaded:
+            recorder.reject(job["payload"])
+            finish()
+    feeding.set()
+    with recorder.lock:
+        if remaining[0] == 0:
+            done.set()
+    done.wait()
+    recorder.report(f"Fair scheduler ({scheduler.stats()['rejected']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fair scheduler simulation")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--spam", type=int, default=300, help="fact-checks sent by the spammer at once")
+    parser.add_argument("--users", type=int, default=40, help="ordinary users, one claim and one 👍 each")
+    parser.add_argument("--window", type=float, default=2.0, help="seconds over which users arrive")
+    parser.add_argument("--service-ms", type=float, default=100, help="time to fact-check one claim")
+    parser.add_argument("--cheap-ms", type=float, default=5, help="time to handle a 👍")
+    parser.add_argument("--max-depth", type=int, default=2000)
+    parser.add_argument("--sender-max-queued", type=int, default=1000)
+    parser.add_argument("--sender-rate", type=float, default=0, help="per-sender token bucket, 0 disables it")
+    parser.add_argument("--sender-burst", type=int, default=5)
+    parser.add_argument("--redis", action="store_true", help="use REDIS_URL instead of fakeredis")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    events = traffic(args)
+    redis_client = make_redis_client() if args.redis else make_redis_client("fakeredis://")
+    run_fifo(events, args)
+    run_fair(events, args, redis_client)
+
+
+if __name__ == "__main__":
+    main()
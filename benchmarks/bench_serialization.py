@@ -0,0 +1,120 @@
+# Benchmark for the record serializer.
+#
+#   python -m benchmarks.bench_serialization --iterations 20000
+#
+# Encodes and decodes the records the app keeps in Redis (a chat history
+# entry, a raw feedback record and a cached fact-check result) with the
+# previous json.dumps format and each serializer configuration available
+# here. Reports the time per encode and decode and the bytes stored per
+# record. With --redis the records are also written to that Redis and its
+# MEMORY USAGE is reported, which includes the key and allocator overhead.
+import argparse
+import json
+import time
+from datetime import datetime
+
+from serialization import Serializer, epoch, msgpack, zstandard
+
+ANSWER = (
+    "**Claim:** Drinking salt water cures malaria.\n\n"
+    "**Verdict: False** ❌\n\n"
+    "There is no scientific evidence that salt water cures or prevents malaria. Malaria is caused by "
+    "Plasmodium parasites transmitted through the bites of infected female Anopheles mosquitoes, and it "
+    "is treated with antimalarial medicines such as artemisinin-based combination therapies (ACTs). "
+    "Drinking large amounts of salt water can cause dehydration, vomiting and dangerous changes in "
+    "blood sodium levels.\n\n"
+    "**Sources:**\n"
+    "1. World Health Organization, Malaria fact sheet: https://www.who.int/news-room/fact-sheets/detail/malaria\n"
+    "2. Nigeria Centre for Disease Control: https://ncdc.gov.ng/diseases/info/M\n"
+    "3. CDC, Malaria treatment guidelines: https://www.cdc.gov/malaria/diagnosis_treatment/treatment.html\n\n"
+    "If you or someone you know has a fever in a malaria area, please visit a health facility and get "
+    "tested."
+)
+
+
+def records(now):
+    # (name, legacy JSON record, new record) as each writer builds them
+    iso = now.isoformat()
+    return [
+        (
+            "history entry",
+            {"timestamp": iso, "message": "Is it true that drinking salt water cures malaria?", "type": "incoming"},
+            {"timestamp": epoch(now), "message": "Is it true that drinking salt water cures malaria?", "type": "incoming"},
+        ),
+        (
+            "feedback",
+            {"timestamp": iso, "feedback_type": "positive", "sender_number": "whatsapp:+2348012345678",
+             "language": "ha", "verdict": "false"},
+            {"timestamp": epoch(now), "feedback_type": "positive", "sender_number": "whatsapp:+2348012345678",
+             "language": "ha", "verdict": "false"},
+        ),
+        (
+            "fact-check result",
+            {"message": ANSWER, "status": "success"},
+            {"message": ANSWER, "status": "success"},
+        ),
+    ]
+
+
+def configurations():
+    yield "json (before)", None
+    yield "json", Serializer("json", "none")
+    yield "json+zlib", Serializer("json", "zlib")
+    if zstandard is not None:
+        yield "json+zstd", Serializer("json", "zstd")
+    if msgpack is not None:
+        yield "msgpack", Serializer("msgpack", "none")
+        yield "msgpack+zlib", Serializer("msgpack", "zlib")
+        if zstandard is not None:
+            yield "msgpack+zstd", Serializer("msgpack", "zstd")
+
+
+def per_call_us(fn, value, iterations, repeat=5):
+    # Best of a few runs, the others are mostly scheduler noise
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn(value)
+        best = min(best, time.perf_counter() - start)
+    return best / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serializer benchmark")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--redis", help="Redis URL to report MEMORY USAGE per record")
+    args = parser.parse_args()
+
+    redis_client = None
+    if args.redis:
+        import redis
+        redis_client = redis.Redis.from_url(args.redis)
+
+    if msgpack is None:
+        print("msgpack isn't installed, only JSON configurations are compared")
+    for name, legacy, record in records(datetime.now()):
+        print(name)
+        for label, serializer in configurations():
+            if serializer is None:
+                # What the app wrote before: default json.dumps, ISO timestamps
+                dumps, loads, value = json.dumps, lambda data: json.loads(data.decode("utf-8")), legacy
+            else:
+                dumps, loads, value = serializer.dumps, serializer.loads, record
+            data = dumps(value)
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            assert loads(data) == value
+            encode_us = per_call_us(dumps, value, args.iterations)
+            decode_us = per_call_us(loads, data, args.iterations)
+            line = f"  {label:<14} encode {encode_us:6.2f} us  decode {decode_us:6.2f} us  {len(data):5d} bytes"
+            if redis_client is not None:
+                key = f"bench:serialization:{label}"
+                redis_client.set(key, data)
+                line += f"  {redis_client.memory_usage(key):5d} bytes in Redis"
+                redis_client.delete(key)
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Load test for the resilient fact-check client.
+#
+#   python -m benchmarks.bench_upstream --requests 300 --concurrency 30
+#
+# Runs three phases against two fake backends: healthy, primary degraded
+# (errors and stalled requests) and recovered. For each phase it reports
+# answered/busy/failed requests, latency percentiles, hedged requests and
+# circuit breaker state. --baseline runs the old fixed-timeout requests.post
+# instead, to show how long workers hang without the client.
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.fake_upstream import FakeUpstreamServer
+from upstream import CircuitOpen, FactCheckClient
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def run_phase(name, call, total, concurrency, rate):
+    outcomes = {"ok": 0, "busy": 0, "failed": 0}
+    latencies = []
+
+    def one(i):
+        # Requests arrive at a steady rate rather than all at once
+        time.sleep(max(0.0, phase_start + i / rate - time.monotonic()))
+        start = time.monotonic()
+        try:
+            call(f"claim {i}")
+            outcome = "ok"
+        except CircuitOpen:
+            outcome = "busy"
+        except Exception:
+            outcome = "failed"
+        return outcome, time.monotonic() - start
+
+    start = phase_start = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for outcome, latency in pool.map(one, range(total)):
+            outcomes[outcome] += 1
+            latencies.append(latency)
+    elapsed = time.monotonic() - start
+    print(
+        f"{name:<10} {elapsed:6.1f}s  ok {outcomes['ok']:4d}  busy {outcomes['busy']:4d}  "
+        f"failed {outcomes['failed']:4d}  p50 {statistics.median(latencies):6.2f}s  "
+        f"p99 {percentile(latencies, 0.99):6.2f}s  max {max(latencies):6.2f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fact-check client load test")
+    parser.add_argument("--requests", type=int, default=300, help="requests per phase")
+    parser.add_argument("--concurrency", type=int, default=30)
+    parser.add_argument("--rate", type=float, default=50, help="requests per second")
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--degraded-error-rate", type=float, default=0.5)
+    parser.add_argument("--degraded-stall-rate", type=float, default=0.2)
+    parser.add_argument("--stall-seconds", type=float, default=20)
+    parser.add_argument("--max-timeout", type=float, default=20, help="upper bound for the read timeout")
+    parser.add_argument("--no-fallback", action="store_true", help="only one backend, no hedging")
+    parser.add_argument("--stream", action="store_true", help="backends answer with server-sent events")
+    parser.add_argument("--baseline", action="store_true", help="plain requests.post with a fixed timeout")
+    args = parser.parse_args()
+
+    primary = FakeUpstreamServer(latency_ms=args.latency_ms, stall_seconds=args.stall_seconds, stream=args.stream).start()
+    fallback = FakeUpstreamServer(latency_ms=args.latency_ms, stall_seconds=args.stall_seconds, stream=args.stream).start()
+    urls = [primary.url] if args.no_fallback else [primary.url, fallback.url]
+
+    if args.baseline:
+        def call(query):
+            response = requests.post(primary.url, json={"query": query}, timeout=args.max_timeout)
+            response.raise_for_status()
+            return response.content
+        client = None
+    else:
+        client = FactCheckClient(
+            urls, pool_size=args.concurrency * 2, min_read_timeout=1,
+            max_read_timeout=args.max_timeout, reset_timeout=2
+        )
+
+        def call(query):
+            return client.fact_check(query)
+
+    run_phase("healthy", call, args.requests, args.concurrency, args.rate)
+    primary.error_rate = args.degraded_error_rate
+    primary.stall_rate = args.degraded_stall_rate
+    run_phase("degraded", call, args.requests, args.concurrency, args.rate)
+    primary.error_rate = 0.0
+    primary.stall_rate = 0.0
+    run_phase("recovered", call, args.requests, args.concurrency, args.rate)
+
+    print(f"primary:   {primary.requests} requests, {primary.errors} 503s, {primary.stalls} stalls")
+    print(f"fallback:  {fallback.requests} requests")
+    if client is not None:
+        stats = client.stats()
+        print(f"hedged:    {stats['hedged']} ({stats['hedge_wins']} answered by the fallback), fast-failed {stats['rejected']}")
+        for endpoint in stats["endpoints"]:
+            print(f"breaker:   {endpoint['url']} {endpoint['state']}, opened {endpoint['opens']} times, "
+                  f"{endpoint['failures']} failures")
+        print(f"read timeout now {client.read_timeout(client.endpoints[0]):.1f}s (max {args.max_timeout}s)")
+    primary.stop()
+    fallback.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# Local stand-ins for Google Translate, the transcription API and OCR.
+#
+#   python -m benchmarks.fake_services --port 8083 --translate-ms 120 --transcribe-ms 900 --ocr-ms 400
+#
+# googletrans only talks to translate.google.com over https, the
+# transcription backends call OpenAI or a local model and OCR runs
+# tesseract, so the app can't be pointed at a URL. Instead HTTPTranslator,
+# HTTPTranscriptionBackend and HTTPOCRBackend speak to this server and are
+# swapped in by the load test. Latencies are
+# log-normal (median and sigma), like real network services with a long tail.
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ocr import OCRBackend
+from transcription import TranscriptionBackend
+
+
+class Latency:
+    def __init__(self, median_ms, sigma=0.5):
+        self.median_ms = median_ms
+        self.sigma = sigma
+
+    def sample(self):
+        if self.median_ms <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.median_ms), self.sigma) / 1000
+
+
+class FakeServicesServer:
+    # POST /translate {"q": [...], "target": "ha"} -> {"translations": [...]}
+    # POST /detect {"q": "..."} -> {"language": "en"}
+    # POST /transcribe (audio bytes) -> {"text": "..."}
+    # POST /ocr (image bytes) -> {"text": "..."}
+    def __init__(self, port=0, translate_ms=100, transcribe_ms=800, sigma=0.5, error_rate=0.0,
+                 transcript="Is it true that drinking salt water cures malaria?", ocr_ms=400,
+                 screenshot_text="BREAKING: Government to give every citizen N50,000 this month. Share before it is deleted!"):
+        self.translate_latency = Latency(translate_ms, sigma)
+        self.transcribe_latency = Latency(transcribe_ms, sigma)
+        self.ocr_latency = Latency(ocr_ms, sigma)
+        self.error_rate = error_rate
+        self.transcript = transcript
+        self.screenshot_text = screenshot_text
+        self.counts = {"translate": 0, "detect": 0, "transcribe": 0, "ocr": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                name = self.path.strip("/")
+                if name not in ("translate", "detect", "transcribe", "ocr"):
+                    self._reply(404, {"message": "Not found"})
+                    return
+                server._count(name)
+                latency = {"transcribe": server.transcribe_latency, "ocr": server.ocr_latency}.get(
+                    name, server.translate_latency
+                )
+                time.sleep(latency.sample())
+                if random.random() < server.error_rate:
+                    server._count("errors")
+                    self._reply(503, {"message": "Service Unavailable"})
+                    return
+                if name == "transcribe":
+                    self._reply(200, {"text": server.transcript})
+                    return
+                if name == "ocr":
+                    self._reply(200, {"text": server.screenshot_text})
+                    return
+                request = json.loads(data.decode("utf-8"))
+                if name == "detect":
+                    # Only reached when the local detector is unsure
+                    self._reply(200, {"language": "en"})
+                    return
+                # Translation keeps the text and tags it, good enough to
+                # exercise the caches and the message sizes
+                target = request["target"]
+                self._reply(200, {"translations": [f"({target}) {q}" for q in request["q"]]})
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+class Translated:
+    __slots__ = ("text", "dest")
+
+    def __init__(self, text, dest):
+        self.text = text
+        self.dest = dest
+
+
+class Detected:
+    __slots__ = ("lang",)
+
+    def __init__(self, lang):
+        self.lang = lang
+
+
+def _session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    return session
+
+
+class HTTPTranslator:
+    # The subset of googletrans.Translator the app uses
+    def __init__(self, url, pool_size=32, timeout=10):
+        self.url = url
+        self.timeout = timeout
+        self.session = _session(pool_size)
+
+    def translate(self, text, dest="en", src="auto"):
+        # One string per call, like googletrans 4.0.0-rc1
+        if not isinstance(text, str):
+            raise TypeError(f"translate() takes a single string, not {type(text).__name__}")
+        response = self.session.post(f"{self.url}/translate", json={"q": [text], "target": dest}, timeout=self.timeout)
+        response.raise_for_status()
+        return Translated(response.json()["translations"][0], dest)
+
+    def detect(self, text):
+        response = self.session.post(f"{self.url}/detect", json={"q": text}, timeout=self.timeout)
+        response.raise_for_status()
+        return Detected(response.json()["language"])
+
+
+class HTTPTranscriptionBackend(TranscriptionBackend):
+    name = "fake"
+
+    def __init__(self, url, pool_size=16, timeout=60):
+        self.url = url
+        self.timeout = timeout
+        self.session = _session(pool_size)
+
+    def transcribe(self, audio_file):
+        data = audio_file.read() if hasattr(audio_file, "read") else audio_file
+        response = self.session.post(f"{self.url}/transcribe", data=data, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["text"]
+
+
+class HTTPOCRBackend(OCRBackend):
+    name = "fake"
+
+    def __init__(self, url, pool_size=16, timeout=60):
+        self.url = url
+        self.timeout = timeout
+        self.session = _session(pool_size)
+
+    def read(self, data):
+        response = self.session.post(f"{self.url}/ocr", data=data, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["text"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake translation, transcription and OCR services")
+    parser.add_argument("--port", type=int, default=8083)
+    parser.add_argument("--translate-ms", type=float, default=100, help="median latency")
+    parser.add_argument("--transcribe-ms", type=float, default=800, help="median latency")
+    parser.add_argument("--ocr-ms", type=float, default=400, help="median latency")
+    parser.add_argument("--sigma", type=float, default=0.5, help="log-normal spread, larger means a longer tail")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeServicesServer(
+        args.port, args.translate_ms, args.transcribe_ms, args.sigma, args.error_rate, ocr_ms=args.ocr_ms
+    )
+    print(f"Fake services listening on {server.url}")
+    server.httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# Local stand-in for the fact-check backend (EXTERNAL_API).
+#
+#   python -m benchmarks.fake_upstream --port 8082 --latency-ms 2000 --error-rate 0.1
+#
+# Answers POST {"query": ...} with {"result": ...} after a configurable delay,
+# or as server-sent events with --stream. Can inject 503s and stalls (requests
+# that hang for --stall-seconds). The settings are plain attributes, so a
+# benchmark can degrade and heal the server while it runs.
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeUpstreamServer:
+    def __init__(self, port=0, latency_ms=500, jitter_ms=100, error_rate=0.0,
+                 stall_rate=0.0, stall_seconds=60, stream=False):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.stream = stream
+        self.requests = 0
+        self.errors = 0
+        self.stalls = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}/"
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _chunk(self, data):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def _stream(self, query, delay):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(delay / 3)
+                self._chunk(b'event: verdict\ndata: {"result": "Preliminary verdict: misleading."}\n\n')
+                time.sleep(delay * 2 / 3)
+                sources = json.dumps({"result": f"Sources for '{query}': https://example.org/check"})
+                self._chunk(f"data: {sources}\n\n".encode("utf-8"))
+                self._chunk(b"")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                query = json.loads(self.rfile.read(length) or b"{}").get("query", "")
+                server._count("requests")
+                if random.random() < server.stall_rate:
+                    server._count("stalls")
+                    time.sleep(server.stall_seconds)
+                delay = max(0.0, random.gauss(server.latency_ms, server.jitter_ms)) / 1000
+                if random.random() < server.error_rate:
+                    server._count("errors")
+                    time.sleep(delay / 10)
+                    self._reply(503, {"message": "Service Unavailable"})
+                    return
+                if server.stream:
+                    self._stream(query, delay)
+                    return
+                time.sleep(delay)
+                self._reply(200, {"result": f"'{query}' is misleading. Sources: https://example.org/check"})
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake fact-check backend")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency-ms", type=float, default=500)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--stall-seconds", type=float, default=60)
+    parser.add_argument("--stream", action="store_true", help="answer with server-sent events")
+    args = parser.parse_args()
+    server = FakeUpstreamServer(
+        args.port, args.latency_ms, args.jitter_ms, args.error_rate,
+        args.stall_rate, args.stall_seconds, args.stream
+    )
+    print(f"Fake fact-check backend listening on {server.url}")
+    server.httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# Local stand-in for Twilio's Messages API.
+#
+#   python -m benchmarks.mock_twilio --port 8081 --latency-ms 80 --rate-limit 10
+#
+# Point the app at it with TWILIO_API_BASE=http://127.0.0.1:8081. It accepts
+# POST /2010-04-01/Accounts/<sid>/Messages.json, answers like Twilio and can
+# inject latency, random 5xx errors and per-number 429 throttling. Media
+# added with add_media() is served at GET /media/<name>, like MediaUrl0.
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class MockTwilioServer:
+    def __init__(self, port=0, latency_ms=50, jitter_ms=20, error_rate=0.0, rate_limit=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.messages = []
+        self.media = {}
+        self.rejected = 0
+        self.errors = 0
+        self._sent_at = {}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+
+    def _throttled(self, from_number):
+        # Sliding one second window per sending number
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            window = [t for t in self._sent_at.get(from_number, []) if now - t < 1.0]
+            if len(window) >= self.rate_limit:
+                self._sent_at[from_number] = window
+                return True
+            window.append(now)
+            self._sent_at[from_number] = window
+            return False
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload, headers=None):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                data = server.media.get(self.path.rsplit("/", 1)[-1]) if self.path.startswith("/media/") else None
+                if data is None:
+                    self._reply(404, {"message": "Not found"})
+                    return
+                content_type, body = data
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+                delay = max(0.0, random.gauss(server.latency_ms, server.jitter_ms)) / 1000
+                time.sleep(delay)
+                if not self.path.endswith("/Messages.json"):
+                    self._reply(404, {"message": "Not found"})
+                    return
+                if server._throttled(form.get("From")):
+                    with server._lock:
+                        server.rejected += 1
+                    self._reply(429, {"code": 20429, "message": "Too Many Requests"}, {"Retry-After": "1"})
+                    return
+                if random.random() < server.error_rate:
+                    with server._lock:
+                        server.errors += 1
+                    self._reply(503, {"message": "Service Unavailable"})
+                    return
+                sid = "SM" + uuid.uuid4().hex
+                with server._lock:
+                    server.messages.append({
+                        "sid": sid,
+                        "from": form.get("From"),
+                        "to": form.get("To"),
+                        "body": form.get("Body"),
+                        "received_at": time.monotonic(),
+                    })
+                self._reply(201, {"sid": sid, "status": "queued", "to": form.get("To"), "body": form.get("Body")})
+
+        return Handler
+
+    def add_media(self, name, content_type, body):
+        self.media[name] = (content_type, body)
+        return f"{self.url}/media/{name}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Twilio Messages API")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, default=None, help="messages per second per From number")
+    args = parser.parse_args()
+    server = MockTwilioServer(args.port, args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit)
+    print(f"Mock Twilio listening on {server.url}")
+    server.httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    # Bounded in-process cache shared by a worker's threads, least recently
+    # used entries are dropped first
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TextCache:
+    # Text by Redis key, with an LRUCache in front so hot entries skip the
+    # round trip. Redis errors are logged and read as a miss.
+    def __init__(self, redis_client, ttl, local_size, name):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.name = name
+        self.local = LRUCache(local_size)
+
+    def get(self, key):
+        text = self.local.get(key)
+        if text is not None:
+            return text
+        try:
+            data = self.redis_client.get(key)
+        except Exception as e:
+            logger.error(f"Error reading {self.name} cache: {e}")
+            return None
+        if data is None:
+            return None
+        text = data.decode("utf-8")
+        self.local.set(key, text)
+        return text
+
+    def set(self, key, text):
+        self.local.set(key, text)
+        try:
+            self.redis_client.setex(key, self.ttl, text)
+        except Exception as e:
+            logger.error(f"Error writing {self.name} cache: {e}")
@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from serialization import serializer as default_serializer
+
+logger = logging.getLogger(__name__)
+
+CLAIM_CACHE_TTL = int(os.getenv("CLAIM_CACHE_TTL", 6 * 60 * 60))
+CLAIM_CACHE_MAX_ENTRIES = int(os.getenv("CLAIM_CACHE_MAX_ENTRIES", 50000))
+CLAIM_CACHE_LOCAL_SIZE = int(os.getenv("CLAIM_CACHE_LOCAL_SIZE", 512))
+CLAIM_CACHE_LOCAL_TTL = int(os.getenv("CLAIM_CACHE_LOCAL_TTL", 300))
+
+CACHE_KEY = "claim_cache:{}"
+LRU_KEY = "claim_cache:lru"
+
+URL_PATTERN = re.compile(r'(https?://\S+)', re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+# Query parameters that only track where a link was shared from
+TRACKING_PARAMS = {"fbclid", "gclid", "igshid", "si", "ref", "mibextid"}
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name.startswith("utm_") or name in TRACKING_PARAMS
+
+
+def canonicalize_url(url):
+    url = url.rstrip(".,;:!?)]}'\"")
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url.lower()
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if host.startswith("m."):
+        host = host[2:]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not is_tracking_param(k)
+    ]
+    path = parts.path.rstrip("/")
+    # http/https and fragments never change the claim being checked
+    return urlunsplit(("https", host, path, urlencode(sorted(query)), ""))
+
+
+def normalize_claim(text):
+    text = unicodedata.normalize("NFKC", text or "")
+    urls = []
+
+    def keep_url(match):
+        urls.append(canonicalize_url(match.group(0)))
+        return f" __url{len(urls) - 1}__ "
+
+    text = URL_PATTERN.sub(keep_url, text).casefold()
+    text = "".join(
+        " " if unicodedata.category(ch).startswith("P") and ch != "_" else ch
+        for ch in text
+    )
+    text = WHITESPACE_PATTERN.sub(" ", text).strip()
+    for i, url in enumerate(urls):
+        text = text.replace(f"__url{i}__", url)
+    return text
+
+
+def claim_cache_key(text, english_text=None):
+    # Key on the English translation when there is one, so the same claim
+    # forwarded in different languages shares a cache entry
+    normalized = normalize_claim(english_text or text)
+    if not normalized:
+        return None
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class ClaimCache:
+    def __init__(self, redis_client, ttl=CLAIM_CACHE_TTL, max_entries=CLAIM_CACHE_MAX_ENTRIES,
+                 local_size=CLAIM_CACHE_LOCAL_SIZE, local_ttl=CLAIM_CACHE_LOCAL_TTL, serializer=default_serializer):
+        self.redis_client = redis_client
+        self.serializer = serializer
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.local_size = local_size
+        self.local_ttl = local_ttl
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_local = 0
+        self.hits_redis = 0
+        self.misses = 0
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            expires_at, result = entry
+            if expires_at < time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return result
+
+    def _set_local(self, key, result):
+        with self._lock:
+            self._local[key] = (time.monotonic() + self.local_ttl, result)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def get(self, key):
+        if key is None:
+            return None
+        result = self._get_local(key)
+        if result is not None:
+            self.hits_local += 1
+            return result
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.get(CACHE_KEY.format(key))
+            pipe.zadd(LRU_KEY, {key: time.time()}, xx=True)
+            data, _ = pipe.execute()
+        except Exception as e:
+            logger.error(f"Error reading claim cache: {e}")
+            data = None
+        if data is None:
+            self.misses += 1
+            return None
+        result = self.serializer.loads(data)
+        self.hits_redis += 1
+        self._set_local(key, result)
+        return result
+
+    def set(self, key, result):
+        if key is None or result.get("status") == "error":
+            return
+        self._set_local(key, result)
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.setex(CACHE_KEY.format(key), self.ttl, self.serializer.dumps(result))
+            pipe.zadd(LRU_KEY, {key: time.time()})
+            pipe.zcard(LRU_KEY)
+            size = pipe.execute()[-1]
+            if size > self.max_entries:
+                self._evict(size - self.max_entries)
+        except Exception as e:
+            logger.error(f"Error writing claim cache: {e}")
+
+    def _evict(self, count):
+        # Drop the least recently used claims
+        evicted = self.redis_client.zpopmin(LRU_KEY, count)
+        if evicted:
+            self.redis_client.delete(*[CACHE_KEY.format(k.decode("utf-8")) for k, _ in evicted])
+
+    def stats(self):
+        return {
+            "hits_local": self.hits_local,
+            "hits_redis": self.hits_redis,
+            "misses": self.misses,
+            "local_entries": len(self._local),
+        }
@@ -0,0 +1,245 @@
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from array import array
+from collections import Counter, defaultdict
+
+from claim_cache import CLAIM_CACHE_TTL, normalize_claim
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", 0.85))
+SIMILARITY_SHINGLE_SIZE = int(os.getenv("SIMILARITY_SHINGLE_SIZE", 4))
+# A claim above the threshold shares about half of its bands with the query,
+# candidates that only collide once or twice are not worth comparing
+SIMILARITY_MIN_BANDS = int(os.getenv("SIMILARITY_MIN_BANDS", 3))
+# 64 slots split into 16 bands of 4 rows: pairs above ~0.5 Jaccard collide
+# in at least one band, the exact similarity check does the rest
+NUM_SLOTS = 64
+NUM_BANDS = 16
+ROWS_PER_BAND = NUM_SLOTS // NUM_BANDS
+
+MASK64 = (1 << 64) - 1
+MASK32 = (1 << 32) - 1
+EMPTY = 1 << 32
+GOLDEN = 0x9E3779B97F4A7C15
+
+SIGNATURE_BYTES = NUM_SLOTS * 4
+
+# A near-duplicate whose extra or missing words include one of these says
+# something else: "has banned" and "has not banned" are ~0.9 similar
+NEGATIONS = {
+    "not", "no", "never", "nor", "neither", "none", "nobody", "nothing", "nowhere", "cannot", "without",
+}
+NUMBER_WORDS = {
+    "zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven",
+    "twelve", "twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety", "hundred",
+    "thousand", "million", "billion", "trillion", "percent", "half", "double", "twice", "triple",
+}
+WORD_PATTERN = re.compile(r"[\w']+")
+
+BUCKET_KEY = "claim_index:lsh:{}:{:08x}"
+SIGNATURE_KEY = "claim_index:sig:{}"
+
+
+def shingle_text(text):
+    # Emoji and other symbols never change what is being claimed
+    text = normalize_claim(text)
+    return "".join(ch for ch in text if not unicodedata.category(ch).startswith("S"))
+
+
+def shingles(text, size=SIMILARITY_SHINGLE_SIZE):
+    text = shingle_text(text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def minhash_signature(text):
+    # One-permutation MinHash: every shingle is hashed once and only kept if
+    # it is the smallest value in its slot; empty slots borrow from the next
+    # filled slot so short claims still produce comparable signatures
+    slots = [EMPTY] * NUM_SLOTS
+    for shingle in shingles(text):
+        h = (zlib.crc32(shingle.encode("utf-8")) * GOLDEN) & MASK64
+        slot = h >> 58
+        value = h & MASK32
+        if value < slots[slot]:
+            slots[slot] = value
+    if all(v == EMPTY for v in slots):
+        return None
+    for i in range(NUM_SLOTS):
+        if slots[i] == EMPTY:
+            j = (i + 1) % NUM_SLOTS
+            while slots[j] == EMPTY:
+                j = (j + 1) % NUM_SLOTS
+            slots[i] = (slots[j] + (j - i) % NUM_SLOTS * GOLDEN) & MASK32
+    # 32-bit slots keep a signature at 256 bytes
+    return array("I", slots)
+
+
+def band_hashes(signature):
+    raw = signature.tobytes()
+    width = ROWS_PER_BAND * signature.itemsize
+    return [zlib.crc32(raw[i * width:(i + 1) * width]) for i in range(NUM_BANDS)]
+
+
+def similarity(sig_a, sig_b):
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_SLOTS
+
+
+def claim_words(text):
+    # Lowercased words of a claim, and the ones that look like names:
+    # capitalized away from the start of a sentence, or acronyms
+    text = unicodedata.normalize("NFKC", text).replace("\u2019", "'")
+    words, names = set(), set()
+    previous_end = None
+    for match in WORD_PATTERN.finditer(text):
+        word = match.group().strip("'")
+        sentence_start = previous_end is None or any(ch in ".!?\n" for ch in text[previous_end:match.start()])
+        previous_end = match.end()
+        if not word:
+            continue
+        lower = word.lower()
+        words.add(lower)
+        if (word[0].isupper() and not sentence_start) or (len(word) > 1 and word.isupper()):
+            names.add(lower)
+    return words, names
+
+
+def changes_meaning(text, other):
+    # Whether the words one claim has and the other lacks can flip the
+    # verdict: negations, numbers or names
+    words, names = claim_words(text)
+    other_words, other_names = claim_words(other)
+    names |= other_names
+    for word in words ^ other_words:
+        if word in NEGATIONS or word.endswith("n't") or word in NUMBER_WORDS or word in names:
+            return True
+        if any(ch.isdigit() for ch in word):
+            return True
+    return False
+
+
+def pack_entry(signature, text):
+    # The claim text follows the signature so lookups can compare words
+    return signature.tobytes() + text.encode("utf-8")
+
+
+def unpack_entry(raw):
+    return array("I", raw[:SIGNATURE_BYTES]), raw[SIGNATURE_BYTES:].decode("utf-8", "replace")
+
+
+class MemoryIndexStore:
+    # Process-local store, used by the benchmark and when Redis is unavailable
+    def __init__(self):
+        self.buckets = defaultdict(set)
+        self.signatures = {}
+        self._lock = threading.Lock()
+
+    def add(self, cache_key, entry, bands):
+        with self._lock:
+            self.signatures[cache_key] = entry
+            for band, h in enumerate(bands):
+                self.buckets[(band, h)].add(cache_key)
+
+    def candidates(self, bands, min_bands=1):
+        found = Counter()
+        for band, h in enumerate(bands):
+            found.update(self.buckets.get((band, h), ()))
+        return {
+            key: self.signatures[key] for key, count in found.items()
+            if count >= min_bands and key in self.signatures
+        }
+
+
+class RedisIndexStore:
+    def __init__(self, redis_client, ttl=CLAIM_CACHE_TTL):
+        self.redis_client = redis_client
+        self.ttl = ttl
+
+    def add(self, cache_key, entry, bands):
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.setex(SIGNATURE_KEY.format(cache_key), self.ttl, entry)
+        for band, h in enumerate(bands):
+            bucket = BUCKET_KEY.format(band, h)
+            pipe.sadd(bucket, cache_key)
+            pipe.expire(bucket, self.ttl)
+        pipe.execute()
+
+    def candidates(self, bands, min_bands=1):
+        pipe = self.redis_client.pipeline(transaction=False)
+        for band, h in enumerate(bands):
+            pipe.smembers(BUCKET_KEY.format(band, h))
+        found = Counter()
+        for members in pipe.execute():
+            found.update(m.decode("utf-8") for m in members)
+        keys = [key for key, count in found.items() if count >= min_bands]
+        if not keys:
+            return {}
+        values = self.redis_client.mget([SIGNATURE_KEY.format(k) for k in keys])
+        return {k: v for k, v in zip(keys, values) if v is not None}
+
+
+class ClaimIndex:
+    def __init__(self, store, threshold=SIMILARITY_THRESHOLD, min_bands=SIMILARITY_MIN_BANDS):
+        self.store = store
+        self.threshold = threshold
+        self.min_bands = min_bands
+        self.lookups = 0
+        self.hits = 0
+        self.rejected = 0
+        self.lookup_seconds = 0.0
+
+    def add(self, text, cache_key):
+        if cache_key is None:
+            return
+        signature = minhash_signature(text)
+        if signature is None:
+            return
+        try:
+            self.store.add(cache_key, pack_entry(signature, text), band_hashes(signature))
+        except Exception as e:
+            logger.error(f"Error indexing claim: {e}")
+
+    def lookup(self, text):
+        # Returns (cache_key, similarity) of the closest verified claim that
+        # doesn't differ from the query by a negation, number or name
+        start = time.perf_counter()
+        self.lookups += 1
+        try:
+            signature = minhash_signature(text)
+            if signature is None:
+                return None
+            matches = []
+            for cache_key, raw in self.store.candidates(band_hashes(signature), self.min_bands).items():
+                candidate, candidate_text = unpack_entry(raw)
+                score = similarity(signature, candidate)
+                if score >= self.threshold:
+                    matches.append((score, cache_key, candidate_text))
+            for score, cache_key, candidate_text in sorted(matches, reverse=True):
+                # Entries indexed without their text can't be checked
+                if not candidate_text or changes_meaning(text, candidate_text):
+                    self.rejected += 1
+                    continue
+                self.hits += 1
+                return cache_key, score
+            return None
+        except Exception as e:
+            logger.error(f"Error looking up similar claims: {e}")
+            return None
+        finally:
+            self.lookup_seconds += time.perf_counter() - start
+
+    def stats(self):
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "rejected": self.rejected,
+            "avg_lookup_ms": 1000 * self.lookup_seconds / self.lookups if self.lookups else 0.0,
+        }
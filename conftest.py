@@ -0,0 +1 @@
+# Lets the tests under tests/ import the app's modules from the repo root
@@ -0,0 +1,124 @@
+import json
+import os
+import re
+
+# Twilio rejects WhatsApp bodies longer than this
+WHATSAPP_MAX_CHARS = int(os.getenv("WHATSAPP_MAX_CHARS", 1600))
+# Ask EXTERNAL_API for a streamed answer. Servers that only return JSON still work.
+EXTERNAL_API_STREAM = os.getenv("EXTERNAL_API_STREAM", "true").lower() == "true"
+STREAM_ACCEPT = "text/event-stream, application/x-ndjson;q=0.9, application/json;q=0.8"
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_message(text, limit=WHATSAPP_MAX_CHARS):
+    # Break on paragraphs, then lines, then sentences, then words, so a
+    # long answer arrives as readable messages under the size limit
+    if len(text) <= limit:
+        return [text]
+    parts = []
+    current = ""
+    for piece in _pieces(text, limit):
+        if current and len(current) + len(piece) > limit:
+            # Twilio rejects an empty body, whitespace between splits is dropped
+            if current.strip():
+                parts.append(current.rstrip())
+            current = ""
+        current += piece
+    if current.strip():
+        parts.append(current.rstrip())
+    return parts
+
+
+def _pieces(text, limit, separators=("\n\n", "\n")):
+    for i, separator in enumerate(separators):
+        if separator not in text:
+            continue
+        chunks = text.split(separator)
+        for j, chunk in enumerate(chunks):
+            tail = separator if j < len(chunks) - 1 else ""
+            if len(chunk) + len(tail) > limit:
+                yield from _pieces(chunk, limit, separators[i + 1:])
+                yield tail
+            else:
+                yield chunk + tail
+        return
+    for sentence in SENTENCE_END.split(text):
+        if len(sentence) + 1 <= limit:
+            yield sentence + " "
+            continue
+        for word in sentence.split(" "):
+            while len(word) >= limit:
+                yield word[:limit - 1]
+                word = word[limit - 1:]
+            yield word + " "
+
+
+class FactCheckStream:
+    # Turns a streamed EXTERNAL_API response into answer parts. Handles
+    # server-sent events and newline-delimited JSON; each event carries the
+    # next part in "result" (or is plain text).
+    def __init__(self, content_type):
+        self.sse = "text/event-stream" in (content_type or "")
+        self.parts = []
+        self._data = []
+
+    def feed(self, line):
+        # Returns the parts completed by this line
+        if not self.sse:
+            return self._event(line.strip())
+        if line == "":
+            data = "\n".join(self._data)
+            self._data = []
+            return self._event(data)
+        if line.startswith("data:"):
+            self._data.append(line[5:].lstrip(" "))
+        # event:, id:, retry: and comment lines carry nothing we use
+        return []
+
+    def close(self):
+        if self._data:
+            return self.feed("")
+        return []
+
+    def _event(self, data):
+        if not data or data == "[DONE]":
+            return []
+        try:
+            event = json.loads(data)
+        except ValueError:
+            event = data
+        if isinstance(event, dict):
+            text = event.get("result") or event.get("text") or event.get("message")
+        else:
+            text = str(event)
+        if not text or not text.strip():
+            return []
+        self.parts.append(text.strip())
+        return [text.strip()]
+
+    @property
+    def message(self):
+        return "\n\n".join(self.parts)
+
+
+def read_fact_check_response(response, on_partial=None):
+    # Reads a requests response from EXTERNAL_API, streamed or plain JSON
+    content_type = response.headers.get("Content-Type", "")
+    if "text/event-stream" not in content_type and "ndjson" not in content_type:
+        data = response.json()
+        return {"message": data.get("result", "Unexpected API response format.")}
+    stream = FactCheckStream(content_type)
+    response.encoding = response.encoding or "utf-8"
+    # chunk_size=None hands over data as soon as it arrives
+    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+        for part in stream.feed(line):
+            if on_partial:
+                on_partial(part)
+    for part in stream.close():
+        if on_partial:
+            on_partial(part)
+    if not stream.parts:
+        return {"message": "Unexpected API response format."}
+    return {"message": stream.message}
+
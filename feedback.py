@@ -0,0 +1,253 @@
+import argparse
+import csv
+import hashlib
+import logging
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+
+from serialization import epoch, serializer as default_serializer
+
+logger = logging.getLogger(__name__)
+
+# The raw feedback:{message_id} records keep their 30 days, the daily
+# counters are small and kept for a year
+FEEDBACK_TTL = int(os.getenv("FEEDBACK_TTL", 30 * 24 * 60 * 60))
+FEEDBACK_STATS_TTL = int(os.getenv("FEEDBACK_STATS_TTL", 400 * 24 * 60 * 60))
+# Approximate length cap of the raw event stream
+FEEDBACK_STREAM_MAXLEN = int(os.getenv("FEEDBACK_STREAM_MAXLEN", 1000000))
+FEEDBACK_EXPORT_BATCH = int(os.getenv("FEEDBACK_EXPORT_BATCH", 5000))
+# A sender's cohort (week first seen) is kept while they keep coming back,
+# and dropped after this long without a new session
+FEEDBACK_COHORT_TTL = int(os.getenv("FEEDBACK_COHORT_TTL", 400 * 24 * 60 * 60))
+
+FEEDBACK_KEY = "feedback:{}"
+DAILY_KEY = "feedback:daily:{}"
+DAYS_KEY = "feedback:days"
+# By sender hash, like the stream and exports
+FIRST_SEEN_KEY = "feedback:first_seen:{}"
+STREAM_KEY = "feedback:events"
+
+DIMENSIONS = ("all", "language", "verdict", "cohort")
+EXPORT_FIELDS = ("id", "ts", "message_id", "feedback", "language", "verdict", "cohort", "sender")
+
+# Ratings of the verdict the answer gave, first one found wins
+VERDICT_PATTERN = re.compile(
+    r"\b(partly true|partially true|mostly true|mostly false|half true|true|false|misleading|"
+    r"unverified|unproven|satire|out of context|fake)\b",
+    re.IGNORECASE,
+)
+
+# One atomic step queued in the message's pipeline: the raw record, the
+# sender's cohort (week first seen), a counter per dimension in the day's
+# hash, the day index and the raw event stream
+RECORD_SCRIPT = """
+redis.call("SETEX", KEYS[1], ARGV[2], ARGV[1])
+redis.call("SET", KEYS[4], ARGV[4], "NX", "EX", ARGV[3])
+local cohort = redis.call("GET", KEYS[4])
+local fields = {"all:all", "language:" .. ARGV[6], "verdict:" .. ARGV[7], "cohort:" .. cohort}
+for _, field in ipairs(fields) do
+    redis.call("HINCRBY", KEYS[2], field .. ":" .. ARGV[5], 1)
+end
+redis.call("EXPIRE", KEYS[2], ARGV[10])
+redis.call("ZADD", KEYS[3], ARGV[9], ARGV[8])
+redis.call("ZREMRANGEBYSCORE", KEYS[3], "-inf", ARGV[9] - ARGV[10])
+redis.call("XADD", KEYS[5], "MAXLEN", "~", ARGV[11], "*",
+    "ts", ARGV[12], "message_id", ARGV[13], "feedback", ARGV[5], "language", ARGV[6],
+    "verdict", ARGV[7], "cohort", cohort, "sender", ARGV[14])
+return cohort
+"""
+
+
+def extract_verdict(text):
+    # "false", "misleading", ... from a fact-check answer, "unknown" if none
+    match = VERDICT_PATTERN.search(text or "")
+    return match.group(1).lower() if match else "unknown"
+
+
+def cohort_of(when):
+    # ISO week, e.g. "2026-W42"
+    year, week, _ = when.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def sender_hash(sender_number):
+    # Exports and the stream don't carry phone numbers
+    return hashlib.sha256(sender_number.encode("utf-8")).hexdigest()[:16]
+
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class FeedbackStore:
+    def __init__(self, redis_client, ttl=FEEDBACK_TTL, stats_ttl=FEEDBACK_STATS_TTL,
+                 stream_maxlen=FEEDBACK_STREAM_MAXLEN, cohort_ttl=FEEDBACK_COHORT_TTL, serializer=default_serializer):
+        self.redis_client = redis_client
+        self.serializer = serializer
+        self.ttl = ttl
+        self.stats_ttl = stats_ttl
+        self.stream_maxlen = stream_maxlen
+        self.cohort_ttl = cohort_ttl
+        self._record = redis_client.register_script(RECORD_SCRIPT)
+
+    def first_seen(self, pipe, sender_number, when=None):
+        # Queued when a sender starts a session, fixes their cohort and
+        # keeps it for another cohort_ttl
+        key = FIRST_SEEN_KEY.format(sender_hash(sender_number))
+        pipe.set(key, cohort_of(when or datetime.now(timezone.utc)), nx=True, ex=self.cohort_ttl)
+        pipe.expire(key, self.cohort_ttl)
+
+    def record(self, message_id, feedback_type, sender_number, language="en", verdict="unknown", pipe=None):
+        # With a pipeline the writes are only queued, the caller executes it
+        now = datetime.now(timezone.utc)
+        day = now.strftime("%Y-%m-%d")
+        raw = {
+            "timestamp": epoch(now),
+            "feedback_type": feedback_type,
+            "sender_number": sender_number,
+            "language": language,
+            "verdict": verdict,
+        }
+        day_start = int(datetime(now.year, now.month, now.day, tzinfo=timezone.utc).timestamp())
+        hashed = sender_hash(sender_number)
+        return self._record(
+            keys=[FEEDBACK_KEY.format(message_id), DAILY_KEY.format(day), DAYS_KEY, FIRST_SEEN_KEY.format(hashed),
+                  STREAM_KEY],
+            args=[
+                self.serializer.dumps(raw), self.ttl, self.cohort_ttl, cohort_of(now), feedback_type, language,
+                verdict, day, day_start, self.stats_ttl, self.stream_maxlen, epoch(now), message_id, hashed,
+            ],
+            client=pipe if pipe is not None else self.redis_client,
+        )
+
+    def days(self, since=None, until=None):
+        low = "-inf" if since is None else int(since.replace(tzinfo=timezone.utc).timestamp())
+        high = "+inf" if until is None else int(until.replace(tzinfo=timezone.utc).timestamp())
+        return [_text(day) for day in self.redis_client.zrangebyscore(DAYS_KEY, low, high)]
+
+    def summary(self, dimension="all", since=None, until=None):
+        # {day: {value: {"positive", "negative", "rate"}}}, one HGETALL per day
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension: {dimension}")
+        days = self.days(since, until)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for day in days:
+            pipe.hgetall(DAILY_KEY.format(day))
+        result = {}
+        for day, counters in zip(days, pipe.execute()):
+            values = {}
+            for field, count in counters.items():
+                # "language:ha:positive"
+                rest, outcome = _text(field).rsplit(":", 1)
+                name, value = rest.split(":", 1)
+                if name != dimension:
+                    continue
+                entry = values.setdefault(value, {"positive": 0, "negative": 0})
+                entry[outcome] = entry.get(outcome, 0) + int(count)
+            for entry in values.values():
+                total = entry["positive"] + entry["negative"]
+                entry["rate"] = entry["positive"] / total if total else 0.0
+            result[day] = values
+        return result
+
+    def events(self, since=None, batch=FEEDBACK_EXPORT_BATCH):
+        # Raw events oldest first, read from the stream batch by batch
+        start = "-" if since is None else str(int(since.replace(tzinfo=timezone.utc).timestamp() * 1000))
+        while True:
+            entries = self.redis_client.xrange(STREAM_KEY, min=start, max="+", count=batch)
+            if not entries:
+                return
+            yield [
+                dict({_text(k): _text(v) for k, v in fields.items()}, id=_text(entry_id))
+                for entry_id, fields in entries
+            ]
+            if len(entries) < batch:
+                return
+            # Exclusive start after the last id
+            start = "(" + _text(entries[-1][0])
+
+
+def export_csv(batches, path, chunk_rows=0):
+    # Streams rows to path, or to path-0001.csv, path-0002.csv, ... of
+    # chunk_rows each. Returns the number of rows written.
+    base, ext = os.path.splitext(path)
+    rows = 0
+    chunk = 0
+    out = writer = None
+    try:
+        for batch in batches:
+            for event in batch:
+                if writer is None or (chunk_rows and rows % chunk_rows == 0 and rows):
+                    if out is not None:
+                        out.close()
+                    chunk += 1
+                    name = f"{base}-{chunk:04d}{ext or '.csv'}" if chunk_rows else path
+                    out = open(name, "w", newline="")
+                    writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+                    writer.writeheader()
+                writer.writerow(event)
+                rows += 1
+    finally:
+        if out is not None:
+            out.close()
+    return rows
+
+
+def export_parquet(batches, path):
+    # One row group per batch, needs pyarrow
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # ts is epoch seconds, every other field is text
+    schema = pa.schema([(field, pa.int64() if field == "ts" else pa.string()) for field in EXPORT_FIELDS])
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for batch in batches:
+            columns = {field: [event.get(field) for event in batch] for field in EXPORT_FIELDS}
+            columns["ts"] = [int(ts) if ts is not None else None for ts in columns["ts"]]
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            rows += len(batch)
+    return rows
+
+
+def parse_day(value):
+    return datetime.strptime(value, "%Y-%m-%d") if value else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Feedback analytics")
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary = commands.add_parser("summary", help="satisfaction rate per day")
+    summary.add_argument("--by", choices=DIMENSIONS, default="all")
+    summary.add_argument("--since", help="YYYY-MM-DD")
+    summary.add_argument("--until", help="YYYY-MM-DD")
+    export = commands.add_parser("export", help="stream raw feedback events to a file")
+    export.add_argument("out", help="output file, .csv or .parquet")
+    export.add_argument("--since", help="YYYY-MM-DD")
+    export.add_argument("--batch", type=int, default=FEEDBACK_EXPORT_BATCH, help="events read per round trip")
+    export.add_argument("--chunk-rows", type=int, default=0, help="split CSV output into files of this many rows")
+    args = parser.parse_args()
+
+    from redis_store import make_redis_client
+    store = FeedbackStore(make_redis_client())
+
+    if args.command == "summary":
+        for day, values in store.summary(args.by, parse_day(args.since), parse_day(args.until)).items():
+            for value, entry in sorted(values.items()):
+                print(f"{day}  {value:<14} {entry['rate']:6.1%}  👍 {entry['positive']:6d}  👎 {entry['negative']:6d}")
+        return
+
+    start = time.monotonic()
+    batches = store.events(parse_day(args.since), args.batch)
+    if args.out.endswith(".parquet"):
+        rows = export_parquet(batches, args.out)
+    else:
+        rows = export_csv(batches, args.out, args.chunk_rows)
+    print(f"Exported {rows} events in {time.monotonic() - start:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+from redis.exceptions import WatchError
+
+from serialization import serializer as default_serializer
+
+logger = logging.getLogger(__name__)
+
+# A conversation ends after this many seconds without a message
+SESSION_IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", 2 * 60 * 60))
+# Seconds between compaction passes, 0 disables the background compactor
+HISTORY_COMPACT_INTERVAL = int(os.getenv("HISTORY_COMPACT_INTERVAL", 300))
+HISTORY_COMPACT_BATCH = int(os.getenv("HISTORY_COMPACT_BATCH", 500))
+# Archived conversations kept per sender, and for how long
+CHAT_ARCHIVE_MAX = int(os.getenv("CHAT_ARCHIVE_MAX", 20))
+CHAT_ARCHIVE_TTL = int(os.getenv("CHAT_ARCHIVE_TTL", 90 * 24 * 60 * 60))
+
+HISTORY_KEY = "chat_history:{}"
+SEEN_KEY = "chat_seen:{}"
+ENDED_KEY = "chat_history:ended:{}"
+ARCHIVE_KEY = "chat_archive:{}"
+# Sender -> time their conversation goes idle
+IDLE_KEY = "chat:idle"
+
+# A new conversation moves the previous one aside for the compactor
+# instead of deleting it
+END_CONVERSATION_SCRIPT = """
+local entries = redis.call("LRANGE", KEYS[1], 0, -1)
+if #entries > 0 then
+    redis.call("RPUSH", KEYS[2], unpack(entries))
+    redis.call("EXPIRE", KEYS[2], ARGV[1])
+    redis.call("DEL", KEYS[1])
+end
+return #entries
+"""
+
+
+def summarize(entries):
+    # The conversation with a few fields to find it by without unpacking
+    return {
+        "start": entries[0].get("timestamp"),
+        "end": entries[-1].get("timestamp"),
+        "turns": len(entries),
+        "incoming": sum(1 for entry in entries if entry.get("type") == "incoming"),
+        "messages": entries,
+    }
+
+
+class HistoryCompactor:
+    # Each conversation that went idle is packed into one compressed entry
+    # of the sender's archive list and removed from the live history
+    def __init__(self, redis_client, idle_timeout=SESSION_IDLE_TIMEOUT, batch=HISTORY_COMPACT_BATCH,
+                 archive_max=CHAT_ARCHIVE_MAX, archive_ttl=CHAT_ARCHIVE_TTL, serializer=default_serializer):
+        self.redis_client = redis_client
+        self.serializer = serializer
+        self.idle_timeout = idle_timeout
+        self.batch = batch
+        self.archive_max = archive_max
+        self.archive_ttl = archive_ttl
+        self._end_conversation = redis_client.register_script(END_CONVERSATION_SCRIPT)
+        self.conversations = 0
+        self.turns = 0
+        self.bytes_raw = 0
+        self.bytes_packed = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def touch(self, pipe, sender_number, history_ttl):
+        # Queued with every session save: the last-seen key expires with the
+        # session and the sender is due for compaction once idle
+        pipe.set(SEEN_KEY.format(sender_number), int(time.time()), ex=self.idle_timeout)
+        pipe.zadd(IDLE_KEY, {sender_number: time.time() + self.idle_timeout})
+        # Outlives the idle timeout so the compactor finds it
+        pipe.expire(HISTORY_KEY.format(sender_number), history_ttl)
+
+    def end_conversation(self, pipe, sender_number):
+        self._end_conversation(
+            keys=[HISTORY_KEY.format(sender_number), ENDED_KEY.format(sender_number)],
+            args=[self.archive_ttl],
+            client=pipe,
+        )
+
+    def compact_once(self, now=None):
+        # One batch of idle senders, returns how many were archived
+        due = self.redis_client.zrangebyscore(IDLE_KEY, "-inf", now or time.time(), start=0, num=self.batch)
+        compacted = 0
+        for sender in due:
+            sender = sender.decode("utf-8") if isinstance(sender, bytes) else sender
+            try:
+                if self.compact_sender(sender):
+                    compacted += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error compacting history of {sender}: {e}")
+        return compacted
+
+    def compact_sender(self, sender_number):
+        seen_key = SEEN_KEY.format(sender_number)
+        history_key = HISTORY_KEY.format(sender_number)
+        ended_key = ENDED_KEY.format(sender_number)
+        archive_key = ARCHIVE_KEY.format(sender_number)
+        with self.redis_client.pipeline() as pipe:
+            try:
+                # A message arriving meanwhile touches the last-seen key and
+                # the transaction is dropped
+                pipe.watch(seen_key, history_key, ended_key)
+                if pipe.exists(seen_key):
+                    pipe.unwatch()
+                    self.skipped += 1
+                    return False
+                # The conversation a returning sender ended, then the live one
+                raws = [raw for raw in (pipe.lrange(ended_key, 0, -1), pipe.lrange(history_key, 0, -1)) if raw]
+                blobs = [
+                    self.serializer.dumps(summarize([self.serializer.loads(entry) for entry in raw]), compress=True)
+                    for raw in raws
+                ]
+                pipe.multi()
+                if blobs:
+                    pipe.rpush(archive_key, *blobs)
+                    pipe.ltrim(archive_key, -self.archive_max, -1)
+                    pipe.expire(archive_key, self.archive_ttl)
+                pipe.delete(history_key, ended_key)
+                pipe.zrem(IDLE_KEY, sender_number)
+                pipe.execute()
+            except WatchError:
+                self.skipped += 1
+                return False
+        self.conversations += len(blobs)
+        self.turns += sum(len(raw) for raw in raws)
+        self.bytes_raw += sum(len(entry) for raw in raws for entry in raw)
+        self.bytes_packed += sum(len(blob) for blob in blobs)
+        return True
+
+    def archive(self, sender_number):
+        # The sender's archived conversations, oldest first
+        return [self.serializer.loads(blob) for blob in self.redis_client.lrange(ARCHIVE_KEY.format(sender_number), 0, -1)]
+
+    def run(self, interval=HISTORY_COMPACT_INTERVAL):
+        while True:
+            try:
+                # Full batches mean a backlog, keep going without sleeping
+                while self.compact_once() >= self.batch:
+                    pass
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error compacting chat histories: {e}")
+            time.sleep(interval)
+
+    def start_in_background(self, interval=HISTORY_COMPACT_INTERVAL):
+        if not interval:
+            return None
+        thread = threading.Thread(target=self.run, args=(interval,), daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        return {
+            "conversations": self.conversations,
+            "turns": self.turns,
+            "bytes_raw": self.bytes_raw,
+            "bytes_packed": self.bytes_packed,
+            "skipped": self.skipped,
+            "errors": self.errors,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive idle chat histories")
+    parser.add_argument("--show", metavar="SENDER", help="print a sender's archived conversations")
+    args = parser.parse_args()
+
+    from redis_store import make_redis_client
+    compactor = HistoryCompactor(make_redis_client())
+    if args.show:
+        for conversation in compactor.archive(args.show):
+            print(json.dumps(conversation, ensure_ascii=False))
+        return
+    total = 0
+    while True:
+        compacted = compactor.compact_once()
+        total += compacted
+        if compacted < compactor.batch:
+            break
+    print(f"Archived {total} conversations: {compactor.stats()}")
+
+
+if __name__ == "__main__":
+    main()
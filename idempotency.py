@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Twilio retries a webhook for a few minutes at most, a day leaves room for
+# replays from its console or logs
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 86400))
+IDEMPOTENCY_KEY = "webhook:message:{}"
+
+
+class IdempotencyGuard:
+    # One inbound MessageSid is processed once. The first delivery claims the
+    # sid with SET NX and stores the webhook response; repeated deliveries get
+    # that response back without queueing anything.
+    def __init__(self, redis_client, ttl=IDEMPOTENCY_TTL):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.claims = 0
+        self.hits = 0
+        self.errors = 0
+
+    def begin(self, message_sid):
+        # None for a new delivery, otherwise the stored response
+        if not message_sid:
+            return None
+        key = IDEMPOTENCY_KEY.format(message_sid)
+        pending = {"status": "queued", "message_sid": message_sid}
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.set(key, json.dumps(pending), nx=True, ex=self.ttl)
+            pipe.get(key)
+            created, stored = pipe.execute()
+        except Exception as e:
+            # Without Redis a duplicate is better than a dropped message
+            self.errors += 1
+            logger.error(f"Error checking idempotency for {message_sid}: {e}")
+            return None
+        if created:
+            self.claims += 1
+            return None
+        self.hits += 1
+        logger.info(f"Duplicate delivery of {message_sid} ignored")
+        return json.loads(stored.decode("utf-8")) if stored else pending
+
+    def complete(self, message_sid, response):
+        if not message_sid:
+            return
+        try:
+            self.redis_client.set(IDEMPOTENCY_KEY.format(message_sid), json.dumps(response), xx=True, keepttl=True)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error storing response for {message_sid}: {e}")
+
+    def abandon(self, message_sid):
+        # Queueing failed, let Twilio's retry try again
+        if not message_sid:
+            return
+        try:
+            self.redis_client.delete(IDEMPOTENCY_KEY.format(message_sid))
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error releasing {message_sid}: {e}")
+
+    def stats(self):
+        total = self.claims + self.hits
+        return {
+            "claims": self.claims,
+            "duplicates": self.hits,
+            "duplicate_rate": self.hits / total if total else 0.0,
+            "errors": self.errors,
+        }
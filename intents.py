@@ -0,0 +1,130 @@
+import re
+import unicodedata
+
+GREETING = "greeting"
+THANKS = "thanks"
+FAREWELL = "farewell"
+ACKNOWLEDGEMENT = "acknowledgement"
+FEEDBACK = "feedback"
+
+# Phrases that make up a whole non-claim message. Listed once per intent,
+# including the greetings our users write in Pidgin, Hausa, Yoruba, Igbo,
+# Swahili and French.
+LEXICON = {
+    GREETING: [
+        "hi", "hii", "hiya", "hello", "helo", "hey", "heya", "yo", "howdy", "greetings",
+        "good morning", "good afternoon", "good evening", "good day", "morning", "evening",
+        "how are you", "how are you doing", "how you dey", "how far", "wetin dey", "how body",
+        "sannu", "ina kwana", "bawo", "bawo ni", "e kaaro", "kedu", "ndewo", "jambo", "habari",
+        "bonjour", "bonsoir", "salut", "salam", "salaam", "assalamu alaikum", "hola", "namaste",
+    ],
+    THANKS: [
+        "thanks", "thank you", "thank you so much", "thanks a lot", "many thanks", "thx", "tnx",
+        "ty", "appreciated", "much appreciated", "na gode", "e se", "e seun", "dalu", "daalu",
+        "asante", "merci", "gracias", "shukran",
+    ],
+    FAREWELL: [
+        "bye", "goodbye", "good bye", "bye bye", "see you", "see you later", "later", "good night",
+        "take care", "cheers", "au revoir", "sai anjima", "o dabo", "kwaheri",
+    ],
+    ACKNOWLEDGEMENT: [
+        "ok", "okay", "okk", "kk", "alright", "all right", "noted", "got it", "understood",
+        "cool", "nice", "great", "awesome", "amazing", "impressive", "bravo", "wow", "oh", "ohh",
+        "oops", "sorry", "yes", "yeah", "yah", "yep", "no", "nope", "sure", "fine", "i see",
+        "you're welcome", "youre welcome", "welcome", "lol", "haha", "hmm", "good", "perfect",
+        "no problem", "no wahala", "oya", "nice one",
+    ],
+}
+# Words that can pad chit-chat without making it a claim
+FILLERS = {
+    "bot", "sir", "madam", "ma", "please", "pls", "plz", "dear", "friend", "again", "very",
+    "so", "much", "and", "there", "all", "guys", "o", "oo", "too",
+}
+# Checked in this order when a message mixes intents ("ok thanks bye")
+PRIORITY = (THANKS, FAREWELL, GREETING, ACKNOWLEDGEMENT)
+FEEDBACK_EMOJIS = {"👍", "👎"}
+MAX_WORDS = 8
+
+URL_PATTERN = re.compile(r"https?://|www\.|\b\w+\.(?:com|org|net|ng|co|info|news)\b")
+
+
+def _build_pattern(lexicon):
+    # One alternation of every phrase, longest first so "thank you so much"
+    # wins over "thank you". Named groups tell which intent matched.
+    groups = []
+    for intent, phrases in lexicon.items():
+        unique = sorted({p.casefold() for p in phrases}, key=len, reverse=True)
+        alternation = "|".join(re.escape(p).replace(r"\ ", r"\s+") for p in unique)
+        groups.append(f"(?P<{intent}>{alternation})")
+    return re.compile(r"(?<!\w)(?:" + "|".join(groups) + r")(?!\w)")
+
+
+LEXICON_PATTERN = _build_pattern(LEXICON)
+WORD_PATTERN = re.compile(r"\w+(?:'\w+)?")
+
+
+def normalize(text):
+    # NFKC, casefold and stretched letters squeezed ("heyyyy" -> "hey")
+    text = unicodedata.normalize("NFKC", text).casefold().replace("’", "'")
+    return re.sub(r"(\w)\1{2,}", r"\1", text)
+
+
+class IntentClassifier:
+    def __init__(self, pattern=LEXICON_PATTERN, max_words=MAX_WORDS):
+        self.pattern = pattern
+        self.max_words = max_words
+        self.classified = 0
+        self.matched = 0
+
+    def route(self, text):
+        # classify() for the message being handled, counted in stats()
+        self.classified += 1
+        intent = self.classify(text)
+        if intent is not None:
+            self.matched += 1
+        return intent
+
+    def classify(self, text):
+        # The intent of a non-claim message, or None when it should be
+        # fact-checked
+        stripped = text.strip()
+        if not stripped:
+            return None
+        if stripped in FEEDBACK_EMOJIS:
+            return FEEDBACK
+        # Links and numbers point to a claim
+        if URL_PATTERN.search(stripped) or any(ch.isdigit() for ch in stripped):
+            return None
+        text = normalize(stripped)
+        words = WORD_PATTERN.findall(text)
+        if not words:
+            # Emoji-only messages ("🙏", "😂") are chit-chat
+            return ACKNOWLEDGEMENT
+        if len(words) > self.max_words:
+            return None
+
+        found = set()
+        covered = []
+        for match in self.pattern.finditer(text):
+            found.add(match.lastgroup)
+            covered.append(match.span())
+        if not found:
+            return None
+        # Any word outside the lexicon and FILLERS may be the topic of a
+        # claim: "no lockdown", "hey ebola" and "welcome bonus" are fact-checked
+        if any(
+            word.group() not in FILLERS and not any(start <= word.start() < end for start, end in covered)
+            for word in WORD_PATTERN.finditer(text)
+        ):
+            return None
+        for intent in PRIORITY:
+            if intent in found:
+                return intent
+        return None
+
+    def stats(self):
+        return {
+            "classified": self.classified,
+            "matched": self.matched,
+            "skip_rate": self.matched / self.classified if self.classified else 0.0,
+        }
@@ -0,0 +1,439 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from scheduler import Overloaded
+
+logger = logging.getLogger(__name__)
+
+# Which backend runs process_whatsapp_message: "thread" (in-process pool),
+# "redis" (Redis list consumed by worker.py) or "celery".
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "thread").lower()
+QUEUE_CONCURRENCY = int(os.getenv("QUEUE_CONCURRENCY", 4))
+QUEUE_MAX_RETRIES = int(os.getenv("QUEUE_MAX_RETRIES", 3))
+QUEUE_RETRY_BACKOFF = float(os.getenv("QUEUE_RETRY_BACKOFF", 5))
+
+JOB_KEY = "whatsapp:job:{}"
+QUEUE_KEY = "whatsapp:jobs"
+DELAYED_KEY = "whatsapp:jobs:delayed"
+DEAD_LETTER_KEY = "whatsapp:jobs:dead"
+# Job ids a worker has taken off the queue and not finished yet, one list per
+# worker. A worker that dies leaves its list behind and the next worker to
+# start puts those jobs back on the queue.
+PROCESSING_KEY = "whatsapp:jobs:processing:{}"
+WORKERS_KEY = "whatsapp:workers"
+HEARTBEAT_KEY = "whatsapp:worker:{}"
+WORKER_HEARTBEAT_TTL = 30
+# Stable across restarts where the platform names its processes (Heroku's
+# DYNO), so a restarted worker finds its own jobs straight away
+WORKER_ID = os.getenv("WORKER_ID") or os.getenv("DYNO") or f"{socket.gethostname()}:{os.getpid()}"
+# Jobs the asyncio app runs as tasks, one list per process, see InflightJobs
+ASYNC_PROCESSING_KEY = "whatsapp:async:processing:{}"
+ASYNC_WORKERS_KEY = "whatsapp:async:workers"
+JOB_TTL = timedelta(days=1)
+DEAD_LETTER_MAX = 1000
+
+
+def retry_delay(attempt):
+    # Exponential backoff: 5s, 10s, 20s, ... with the default base
+    return QUEUE_RETRY_BACKOFF * (2 ** attempt)
+
+
+class JobQueue:
+    def __init__(self, handler, redis_client, backend=QUEUE_BACKEND,
+                 concurrency=QUEUE_CONCURRENCY, max_retries=QUEUE_MAX_RETRIES,
+                 on_dead_letter=None, celery=None, scheduler=None, worker_id=WORKER_ID):
+        self.handler = handler
+        self.redis_client = redis_client
+        self.backend = backend
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.on_dead_letter = on_dead_letter
+        self.celery = celery
+        self.celery_task = None
+        # Optional FairScheduler deciding which waiting job runs next
+        self.scheduler = scheduler
+        self.worker_id = worker_id
+        self.processing_key = PROCESSING_KEY.format(worker_id)
+        self._executor = None
+        self._consumers_pid = None
+        self._consumers_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+        if backend == "celery":
+            if celery is None:
+                raise ValueError("QUEUE_BACKEND=celery requires a Celery app")
+            self.celery_task = self._register_celery_task(celery)
+        elif backend == "thread":
+            self._executor = ThreadPoolExecutor(
+                max_workers=concurrency, thread_name_prefix="whatsapp-job"
+            )
+        elif backend != "redis":
+            raise ValueError(f"Unknown QUEUE_BACKEND: {backend}")
+
+    def enqueue(self, payload):
+        job = {
+            "id": uuid.uuid4().hex,
+            "attempt": 0,
+            "enqueued_at": datetime.now().isoformat(),
+            "payload": payload,
+        }
+        if self.backend == "celery":
+            if self.scheduler is not None:
+                # Celery keeps its own queue, only the per-sender rate applies
+                self.scheduler.admit(payload)
+            self._persist(job)
+            self.celery_task.apply_async(args=[job["id"]], task_id=job["id"])
+        elif self.scheduler is not None:
+            self._persist(job)
+            self._schedule(job)
+        elif self.backend == "redis":
+            self._persist(job, push=True)
+        else:
+            self._persist(job)
+            self._executor.submit(self._run, job)
+        return job["id"]
+
+    def _persist(self, job, push=False):
+        # The job body is stored once; queues only carry the job id
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.setex(JOB_KEY.format(job["id"]), JOB_TTL, json.dumps(job))
+            if push:
+                pipe.rpush(QUEUE_KEY, job["id"])
+            pipe.execute()
+        except Exception as e:
+            if push or self.backend == "redis":
+                raise
+            # In-process backends still run the job if Redis is unavailable
+            logger.error(f"Error persisting job {job['id']}: {e}")
+
+    def _schedule(self, job, admit=True):
+        try:
+            self.scheduler.push(job, admit=admit)
+        except Overloaded:
+            self._finish(job)
+            raise
+        except Exception as e:
+            if self.backend == "redis":
+                raise
+            logger.error(f"Error scheduling job {job['id']}, running it directly: {e}")
+            self._executor.submit(self._run, job)
+            return
+        if self.backend == "thread":
+            self._ensure_consumers()
+
+    def _ensure_consumers(self):
+        # In-process consumers of the scheduler, started once per process
+        if self._consumers_pid == os.getpid():
+            return
+        with self._consumers_lock:
+            if self._consumers_pid == os.getpid():
+                return
+            self._consumers_pid = os.getpid()
+            for i in range(self.concurrency):
+                threading.Thread(target=self._consume, name=f"whatsapp-job-{i}", daemon=True).start()
+
+    def _load(self, job_id):
+        data = self.redis_client.get(JOB_KEY.format(job_id))
+        if data is None:
+            return None
+        return json.loads(data.decode("utf-8"))
+
+    def _finish(self, job):
+        try:
+            self.redis_client.delete(JOB_KEY.format(job["id"]))
+        except Exception as e:
+            logger.error(f"Error removing job {job['id']}: {e}")
+
+    def _run(self, job, sender=None):
+        try:
+            self.handler(job["payload"])
+        except Exception as e:
+            logger.error(f"Job {job['id']} failed (attempt {job['attempt'] + 1}): {e}")
+            self._retry_or_dead_letter(job, e)
+            return
+        finally:
+            if sender is not None:
+                self.scheduler.release(sender)
+        self._finish(job)
+
+    def _requeue(self, job):
+        if self.scheduler is not None:
+            self._schedule(job, admit=False)
+        else:
+            self._executor.submit(self._run, job)
+
+    def _retry_or_dead_letter(self, job, error):
+        if job["attempt"] < self.max_retries:
+            delay = retry_delay(job["attempt"])
+            job["attempt"] += 1
+            if self.backend == "redis":
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.setex(JOB_KEY.format(job["id"]), JOB_TTL, json.dumps(job))
+                pipe.zadd(DELAYED_KEY, {job["id"]: time.time() + delay})
+                pipe.execute()
+            else:
+                timer = threading.Timer(delay, self._requeue, args=(job,))
+                timer.daemon = True
+                timer.start()
+            return
+        self.dead_letter(job, error)
+
+    def dead_letter(self, job, error):
+        job["error"] = str(error)
+        job["failed_at"] = datetime.now().isoformat()
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.lpush(DEAD_LETTER_KEY, json.dumps(job))
+            pipe.ltrim(DEAD_LETTER_KEY, 0, DEAD_LETTER_MAX - 1)
+            pipe.delete(JOB_KEY.format(job["id"]))
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error dead-lettering job {job['id']}: {e}")
+        if self.on_dead_letter:
+            try:
+                self.on_dead_letter(job["payload"])
+            except Exception as e:
+                logger.error(f"Error in dead-letter callback for job {job['id']}: {e}")
+
+    def _register_celery_task(self, celery):
+        queue = self
+
+        @celery.task(
+            bind=True,
+            name="process_whatsapp_message",
+            acks_late=True,
+            max_retries=self.max_retries,
+        )
+        def process_whatsapp_message_task(task, job_id):
+            job = queue._load(job_id)
+            if job is None:
+                logger.error(f"Job {job_id} not found, dropping")
+                return
+            job["attempt"] = task.request.retries
+            try:
+                queue.handler(job["payload"])
+            except Exception as e:
+                logger.error(f"Job {job_id} failed (attempt {job['attempt'] + 1}): {e}")
+                if task.request.retries < queue.max_retries:
+                    raise task.retry(exc=e, countdown=retry_delay(task.request.retries))
+                queue.dead_letter(job, e)
+                return
+            queue._finish(job)
+
+        return process_whatsapp_message_task
+
+    # Consumers: worker.py threads for the Redis backend, in-process threads
+    # for the thread backend when a scheduler is used
+
+    def _promote_delayed(self):
+        due = self.redis_client.zrangebyscore(DELAYED_KEY, 0, time.time(), start=0, num=100)
+        for job_id in due:
+            # Only the worker that wins the ZREM re-queues the job
+            if not self.redis_client.zrem(DELAYED_KEY, job_id):
+                continue
+            if self.scheduler is None:
+                self.redis_client.rpush(QUEUE_KEY, job_id)
+                continue
+            job = self._load(job_id.decode("utf-8"))
+            if job is not None:
+                self.scheduler.push(job, admit=False)
+
+    def _consume(self):
+        # Only worker.py consumers (Redis backend) keep a processing list, the
+        # thread backend's jobs die with the web process either way
+        track = self.backend == "redis"
+        while not self._stopping.is_set():
+            try:
+                if self.backend == "redis":
+                    self._promote_delayed()
+                sender = None
+                if self.scheduler is not None:
+                    item = self.scheduler.pop(timeout=1)
+                    if item is None:
+                        continue
+                    job_id, sender = item
+                    if track:
+                        self.redis_client.rpush(self.processing_key, job_id)
+                else:
+                    # Moved, not popped: the id stays in Redis until the job is done
+                    item = self.redis_client.blmove(QUEUE_KEY, self.processing_key, 1, "LEFT", "RIGHT")
+                    if item is None:
+                        continue
+                    job_id = item.decode("utf-8")
+                try:
+                    job = self._load(job_id)
+                    if job is None:
+                        logger.error(f"Job {job_id} not found, dropping")
+                        if sender is not None:
+                            self.scheduler.release(sender)
+                        continue
+                    self._run(job, sender)
+                finally:
+                    if track:
+                        self.redis_client.lrem(self.processing_key, 1, job_id)
+            except Exception as e:
+                logger.error(f"Error in job consumer: {e}")
+                time.sleep(1)
+
+    def _heartbeat(self):
+        self.redis_client.set(HEARTBEAT_KEY.format(self.worker_id), int(time.time()), ex=WORKER_HEARTBEAT_TTL)
+
+    def _requeue_processing(self, worker_id):
+        # Puts the unfinished jobs of a worker back at the front of the queue
+        key = PROCESSING_KEY.format(worker_id)
+        recovered = 0
+        while True:
+            if self.scheduler is None:
+                if self.redis_client.lmove(key, QUEUE_KEY, "RIGHT", "LEFT") is None:
+                    break
+                recovered += 1
+                continue
+            job_id = self.redis_client.lpop(key)
+            if job_id is None:
+                break
+            job = self._load(job_id.decode("utf-8"))
+            if job is None:
+                continue
+            # The dead worker never released the sender's running slot
+            sender, cheap, _ = self.scheduler.classify(job["payload"])
+            if not cheap:
+                self.scheduler.release(sender)
+            self.scheduler.push(job, admit=False)
+            recovered += 1
+        return recovered
+
+    def recover(self):
+        # This worker's jobs from before a restart, and those of workers
+        # whose heartbeat expired. LMOVE/LPOP hand each job id to one worker
+        # only, even when several start at once.
+        self.redis_client.sadd(WORKERS_KEY, self.worker_id)
+        self._heartbeat()
+        recovered = 0
+        for worker_id in self.redis_client.smembers(WORKERS_KEY):
+            worker_id = worker_id.decode("utf-8")
+            if worker_id != self.worker_id and self.redis_client.exists(HEARTBEAT_KEY.format(worker_id)):
+                continue
+            recovered += self._requeue_processing(worker_id)
+            if worker_id != self.worker_id:
+                self.redis_client.srem(WORKERS_KEY, worker_id)
+        if recovered:
+            logger.info(f"Re-queued {recovered} jobs left unfinished by stopped workers")
+        return recovered
+
+    def run_worker(self):
+        if self.backend != "redis":
+            raise ValueError("run_worker is only used with QUEUE_BACKEND=redis")
+        self.recover()
+        threads = [
+            threading.Thread(target=self._consume, name=f"whatsapp-worker-{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        logger.info(f"Job worker {self.worker_id} started with {self.concurrency} consumers")
+        last_heartbeat = time.monotonic()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(1)
+                if time.monotonic() - last_heartbeat >= WORKER_HEARTBEAT_TTL / 3:
+                    try:
+                        self._heartbeat()
+                    except Exception as e:
+                        logger.error(f"Error sending worker heartbeat: {e}")
+                    last_heartbeat = time.monotonic()
+        except KeyboardInterrupt:
+            self._stopping.set()
+            for thread in threads:
+                thread.join()
+
+    def stats(self):
+        # Jobs waiting to start, waiting for a retry and given up on
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.llen(QUEUE_KEY)
+        pipe.zcard(DELAYED_KEY)
+        pipe.llen(DEAD_LETTER_KEY)
+        queued, delayed, dead = pipe.execute()
+        if self.scheduler is not None:
+            queued = self.scheduler.depth()
+        return {"depth": queued, "delayed": delayed, "dead_letters": dead}
+
+
+class InflightJobs:
+    # Jobs the asyncio app runs as tasks in its own process. Each is kept in
+    # Redis, in this process's list, until it is done, so the message is not
+    # lost with the process. Other processes take over the lists of those
+    # whose heartbeat expired. Separate from worker.py's lists: these jobs
+    # never held a scheduler slot.
+    def __init__(self, redis_client, worker_id=None):
+        self.redis_client = redis_client
+        # gunicorn runs several app processes under one DYNO
+        self.worker_id = worker_id or f"{WORKER_ID}:{os.getpid()}"
+        self.key = ASYNC_PROCESSING_KEY.format(self.worker_id)
+        self.added = 0
+        self.recovered = 0
+
+    def add(self, payload):
+        # Raises when Redis is unavailable, the webhook then fails and Twilio
+        # delivers the message again
+        job = {
+            "id": uuid.uuid4().hex,
+            "attempt": 0,
+            "enqueued_at": datetime.now().isoformat(),
+            "payload": payload,
+        }
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.setex(JOB_KEY.format(job["id"]), JOB_TTL, json.dumps(job))
+        pipe.rpush(self.key, job["id"])
+        pipe.execute()
+        self.added += 1
+        return job
+
+    def done(self, job):
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.lrem(self.key, 1, job["id"])
+            pipe.delete(JOB_KEY.format(job["id"]))
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error removing job {job['id']}: {e}")
+
+    def heartbeat(self):
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.sadd(ASYNC_WORKERS_KEY, self.worker_id)
+        pipe.set(HEARTBEAT_KEY.format(self.worker_id), int(time.time()), ex=WORKER_HEARTBEAT_TTL)
+        pipe.execute()
+
+    def recover(self):
+        # Jobs of processes whose heartbeat expired, moved into this
+        # process's list. LMOVE hands each job to one process only.
+        jobs = []
+        for worker_id in self.redis_client.smembers(ASYNC_WORKERS_KEY):
+            worker_id = worker_id.decode("utf-8")
+            if worker_id == self.worker_id or self.redis_client.exists(HEARTBEAT_KEY.format(worker_id)):
+                continue
+            key = ASYNC_PROCESSING_KEY.format(worker_id)
+            while True:
+                job_id = self.redis_client.lmove(key, self.key, "LEFT", "RIGHT")
+                if job_id is None:
+                    break
+                data = self.redis_client.get(JOB_KEY.format(job_id.decode("utf-8")))
+                if data is None:
+                    self.redis_client.lrem(self.key, 1, job_id)
+                    continue
+                jobs.append(json.loads(data.decode("utf-8")))
+            self.redis_client.srem(ASYNC_WORKERS_KEY, worker_id)
+        if jobs:
+            self.recovered += len(jobs)
+            logger.info(f"Took over {len(jobs)} jobs left unfinished by stopped processes")
+        return jobs
+
+    def stats(self):
+        return {"added": self.added, "recovered": self.recovered}
@@ -0,0 +1,223 @@
+import hashlib
+import logging
+import os
+import re
+import unicodedata
+
+import tracing
+from caches import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Below this confidence the network detector (googletrans) is asked instead
+LANG_DETECT_MIN_CONFIDENCE = float(os.getenv("LANG_DETECT_MIN_CONFIDENCE", 0.6))
+# Messages with fewer letters than this keep the session's language
+LANG_DETECT_MIN_LETTERS = int(os.getenv("LANG_DETECT_MIN_LETTERS", 4))
+LANG_DETECT_CACHE_SIZE = int(os.getenv("LANG_DETECT_CACHE_SIZE", 4096))
+
+URL_PATTERN = re.compile(r'https?://\S+')
+WORD_PATTERN = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+# (first code point, last code point, language) for scripts that are used by
+# essentially one language. Codes follow googletrans.
+SCRIPT_RANGES = [
+    (0x0370, 0x03FF, "el"),
+    (0x0530, 0x058F, "hy"),
+    (0x0590, 0x05FF, "iw"),
+    (0x0900, 0x097F, "hi"),
+    (0x0980, 0x09FF, "bn"),
+    (0x0A00, 0x0A7F, "pa"),
+    (0x0A80, 0x0AFF, "gu"),
+    (0x0B80, 0x0BFF, "ta"),
+    (0x0C00, 0x0C7F, "te"),
+    (0x0C80, 0x0CFF, "kn"),
+    (0x0D00, 0x0D7F, "ml"),
+    (0x0D80, 0x0DFF, "si"),
+    (0x0E00, 0x0E7F, "th"),
+    (0x0E80, 0x0EFF, "lo"),
+    (0x1000, 0x109F, "my"),
+    (0x10A0, 0x10FF, "ka"),
+    (0x1200, 0x139F, "am"),
+    (0x1780, 0x17FF, "km"),
+    (0x3040, 0x30FF, "ja"),
+    (0xAC00, 0xD7AF, "ko"),
+    (0x1100, 0x11FF, "ko"),
+]
+ARABIC_RANGES = [(0x0600, 0x06FF), (0x0750, 0x077F), (0xFB50, 0xFDFF), (0xFE70, 0xFEFF)]
+CYRILLIC_RANGE = (0x0400, 0x04FF)
+HAN_RANGE = (0x4E00, 0x9FFF)
+
+# Letters that single out a language within a shared script
+URDU_LETTERS = set("ٹڈڑںےھ")
+PERSIAN_LETTERS = set("پچژگ")
+UKRAINIAN_LETTERS = set("іїєґ")
+HAUSA_LETTERS = set("ɓɗƙƴ")
+YORUBA_LETTERS = set("ẹọṣ")
+IGBO_LETTERS = set("ịụṅ")
+
+# Short, frequent words that are distinctive for each Latin-script language
+STOPWORDS = {
+    "en": "the is are was were and of to in that it this with for not you what have has be by on from they will can do does true".split(),
+    "fr": "le la les est et des une un que qui dans pour pas vous ce sont avec sur au du il elle c'est vrai".split(),
+    "es": "el la los las es y que de en un una por para con no se del lo como son esto verdad".split(),
+    "pt": "o a os as é e que de em um uma não do da para com se isso são mais você verdade".split(),
+    "de": "der die das ist und nicht ein eine zu ich sie es mit auf für den dem sind wahr".split(),
+    "it": "il la è e che di un una non per con sono gli del della questo vero".split(),
+    "nl": "de het een is en van niet dat op te zijn met voor dit waar".split(),
+    "sw": "na ya wa ni kwa la za katika hii hiyo kuwa ana huu je kweli habari serikali".split(),
+    "ha": "da a na ta ba ne ce wannan shi ita su gaskiya yana tana don kuma".split(),
+    "yo": "ni ti ati o wa si kan naa fun yii je se otito".split(),
+    "ig": "na nke bu ka ndi ya o di n'ezie onye ihe a".split(),
+    "id": "yang dan di ini itu dengan untuk tidak ada dari ke adalah benar".split(),
+    "tr": "ve bir bu da de için ile değil ne mi var çok doğru".split(),
+}
+LETTER_HINTS = {"ha": HAUSA_LETTERS, "yo": YORUBA_LETTERS, "ig": IGBO_LETTERS}
+STOPWORD_INDEX = {}
+for _language, _words in STOPWORDS.items():
+    for _word in _words:
+        STOPWORD_INDEX.setdefault(_word, []).append(_language)
+
+
+def in_ranges(code, ranges):
+    return any(start <= code <= end for start, end in ranges)
+
+
+def letters_of(text):
+    return [ch for ch in text if ch.isalpha()]
+
+
+def detect_script(letters):
+    counts = {}
+    for ch in letters:
+        code = ord(ch)
+        if code < 0x0250:
+            language = "latin"
+        elif in_ranges(code, ARABIC_RANGES):
+            language = "arabic"
+        elif CYRILLIC_RANGE[0] <= code <= CYRILLIC_RANGE[1]:
+            language = "cyrillic"
+        elif HAN_RANGE[0] <= code <= HAN_RANGE[1]:
+            language = "han"
+        else:
+            language = next((lang for start, end, lang in SCRIPT_RANGES if start <= code <= end), "latin")
+        counts[language] = counts.get(language, 0) + 1
+    script, count = max(counts.items(), key=lambda item: item[1])
+    return script, count / len(letters), counts
+
+
+def score_latin(text, letters):
+    words = WORD_PATTERN.findall(text.lower())
+    scores = {}
+    for word in words:
+        for language in STOPWORD_INDEX.get(word, ()):
+            scores[language] = scores.get(language, 0) + 1
+    letter_set = set(ch.lower() for ch in letters)
+    for language, hint in LETTER_HINTS.items():
+        if letter_set & hint:
+            scores[language] = scores.get(language, 0) + 2
+    if not scores:
+        return None, 0.0, scores
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    best, best_score = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    # Confidence grows with how many words matched and how clearly the best
+    # language wins over the next one
+    coverage = min(1.0, best_score / max(2, len(words) * 0.3))
+    margin = (best_score - runner_up) / best_score
+    return best, coverage * (0.5 + 0.5 * margin), scores
+
+
+def detect_local(text):
+    # Returns (language, confidence) or (None, 0.0) when there is nothing to go on
+    text = URL_PATTERN.sub(" ", text or "")
+    letters = letters_of(text)
+    if not letters:
+        return None, 0.0
+    script, share, counts = detect_script(letters)
+    if script == "arabic":
+        letter_set = set(letters)
+        if letter_set & URDU_LETTERS:
+            return "ur", 0.9 * share
+        if letter_set & PERSIAN_LETTERS:
+            return "fa", 0.8 * share
+        return "ar", 0.85 * share
+    if script == "cyrillic":
+        if set(ch.lower() for ch in letters) & UKRAINIAN_LETTERS:
+            return "uk", 0.9 * share
+        return "ru", 0.8 * share
+    if script == "han":
+        if counts.get("ja"):
+            return "ja", share
+        return "zh-cn", 0.9 * share
+    if script != "latin":
+        return script, share
+    language, confidence, _ = score_latin(text, letters)
+    return language, confidence * share
+
+
+def is_trivial(text, min_letters=LANG_DETECT_MIN_LETTERS):
+    # Emoji-only, numeric or very short messages say nothing about language
+    letters = letters_of(URL_PATTERN.sub(" ", text or ""))
+    return len(letters) < min_letters
+
+
+class LanguageDetector:
+    def __init__(self, translator, min_confidence=LANG_DETECT_MIN_CONFIDENCE,
+                 cache_size=LANG_DETECT_CACHE_SIZE):
+        self.translator = translator
+        self.min_confidence = min_confidence
+        self._cache = LRUCache(cache_size)
+        self.detections = 0
+        self.skipped = 0
+        self.cache_hits = 0
+        self.local = 0
+        self.network_calls = 0
+
+    def _cache_key(self, text):
+        return hashlib.sha1(unicodedata.normalize("NFKC", text).strip().lower().encode("utf-8")).digest()
+
+    def detect(self, text, sticky_language="en"):
+        # sticky_language is the sender's current session language, kept for
+        # messages that can't be classified
+        self.detections += 1
+        if is_trivial(text):
+            self.skipped += 1
+            return sticky_language
+
+        key = self._cache_key(text)
+        language = self._cache.get(key)
+        if language is not None:
+            self.cache_hits += 1
+            return language
+
+        language, confidence = detect_local(text)
+        if language is not None and confidence >= self.min_confidence:
+            self.local += 1
+            self._cache.set(key, language)
+            return language
+        if language is not None and language == sticky_language:
+            # A weak guess that agrees with the session is good enough
+            self.local += 1
+            return language
+
+        try:
+            self.network_calls += 1
+            with tracing.span("language_detect.request"):
+                language = self.translator.detect(text).lang
+        except Exception as e:
+            logger.error(f"Error detecting language: {e}")
+            return language or sticky_language
+        if isinstance(language, list):
+            language = language[0]
+        language = language.lower()
+        self._cache.set(key, language)
+        return language
+
+    def stats(self):
+        return {
+            "detections": self.detections,
+            "skipped": self.skipped,
+            "cache_hits": self.cache_hits,
+            "local": self.local,
+            "network_calls": self.network_calls,
+        }
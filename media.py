@@ -0,0 +1,88 @@
+import io
+import logging
+import os
+import subprocess
+
+import requests
+from requests.adapters import HTTPAdapter
+from pydub import AudioSegment  # For processing audio files
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# WhatsApp caps media at 16 MB, anything larger is not a real voice note
+MAX_MEDIA_BYTES = int(os.getenv("MAX_MEDIA_BYTES", 16 * 1024 * 1024))
+MAX_VOICE_SECONDS = int(os.getenv("MAX_VOICE_SECONDS", 300))
+MEDIA_TIMEOUT = (5, 30)
+CHUNK_SIZE = 64 * 1024
+# Pooled connections per media host, enough for every attachment being
+# fetched at once
+MEDIA_POOL_SIZE = int(os.getenv("MEDIA_POOL_SIZE", 16))
+
+# Speech models work on 16 kHz mono, Opus keeps that at a few KB per second
+TRANSCRIBE_SAMPLE_RATE = 16000
+TRANSCRIBE_FORMAT = "ogg"
+TRANSCRIBE_CODEC = "libopus"
+TRANSCRIBE_BITRATE = "24k"
+# ffmpeg's name for pydub's raw samples, by sample width in bytes
+RAW_SAMPLE_FORMATS = {1: "u8", 2: "s16le", 3: "s24le", 4: "s32le"}
+
+media_session = requests.Session()
+media_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=MEDIA_POOL_SIZE))
+media_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=MEDIA_POOL_SIZE))
+
+
+class MediaTooLarge(ValueError):
+    pass
+
+
+class AudioEncodeError(RuntimeError):
+    pass
+
+
+def download_media(media_url, max_bytes=MAX_MEDIA_BYTES, auth=None):
+    # Stream the media into memory and stop as soon as it exceeds max_bytes
+    with tracing.http_span("media.download", "GET", media_url), \
+            media_session.get(media_url, stream=True, timeout=MEDIA_TIMEOUT, auth=auth) as response:
+        response.raise_for_status()
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > max_bytes:
+            raise MediaTooLarge(f"Media is {length} bytes, limit is {max_bytes}")
+        buffer = io.BytesIO()
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            buffer.write(chunk)
+            if buffer.tell() > max_bytes:
+                raise MediaTooLarge(f"Media exceeds {max_bytes} bytes")
+        return buffer.getvalue(), response.headers.get("Content-Type", "")
+
+
+def prepare_voice_note(data, source_format="ogg", max_seconds=MAX_VOICE_SECONDS):
+    # Decode in memory, downmix to 16 kHz mono and re-encode compactly for
+    # the transcriber. Returns (file-like buffer, duration in seconds).
+    audio = AudioSegment.from_file(io.BytesIO(data), format=source_format)
+    if audio.duration_seconds > max_seconds:
+        raise MediaTooLarge(f"Voice note is {audio.duration_seconds:.0f}s, limit is {max_seconds}s")
+    audio = audio.set_frame_rate(TRANSCRIBE_SAMPLE_RATE).set_channels(1)
+    buffer = io.BytesIO(encode_for_transcription(audio))
+    # The OpenAI client uses the file name to tell the format
+    buffer.name = f"voice.{TRANSCRIBE_FORMAT}"
+    return buffer, audio.duration_seconds
+
+
+def encode_for_transcription(audio):
+    # AudioSegment.export goes through two temporary files on disk. ffmpeg
+    # reads the raw samples from stdin and writes the Opus file to stdout
+    # instead, like from_file does for decoding.
+    command = [
+        AudioSegment.converter, "-hide_banner", "-loglevel", "error",
+        "-f", RAW_SAMPLE_FORMATS[audio.sample_width], "-ar", str(audio.frame_rate), "-ac", str(audio.channels),
+        "-i", "pipe:0",
+        "-c:a", TRANSCRIBE_CODEC, "-b:a", TRANSCRIBE_BITRATE, "-f", TRANSCRIBE_FORMAT, "pipe:1",
+    ]
+    process = subprocess.run(command, input=audio.raw_data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0 or not process.stdout:
+        raise AudioEncodeError(
+            f"ffmpeg returned {process.returncode}: {process.stderr.decode('utf-8', 'replace').strip()[-500:]}"
+        )
+    return process.stdout
@@ -0,0 +1,132 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import tracing
+from media import download_media
+
+logger = logging.getLogger(__name__)
+
+# Attachments downloaded and read at once per process, across messages
+MEDIA_CONCURRENCY = int(os.getenv("MEDIA_CONCURRENCY", 8))
+# Twilio sends at most 10 attachments per WhatsApp message
+MAX_ATTACHMENTS = 10
+
+# Content type -> the format pydub/ffmpeg decodes it as
+AUDIO_FORMATS = {
+    "audio/ogg": "ogg",
+    "audio/opus": "ogg",
+    "audio/mpeg": "mp3",
+    "audio/mp4": "mp4",
+    "audio/aac": "aac",
+    "audio/amr": "amr",
+}
+IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp"}
+
+VOICE = "voice"
+IMAGE = "image"
+UNSUPPORTED = "unsupported"
+
+
+def attachments_of(payload):
+    # [(url, content type)] of a job payload
+    return [(item["url"], item["type"]) for item in payload["media"][:MAX_ATTACHMENTS]]
+
+
+def media_type_of(payload):
+    # Content type of the first attachment, "" for a text message
+    return payload["media"][0]["type"] if payload["media"] else ""
+
+
+def normalize_type(content_type):
+    # "Image/JPEG; charset=..." -> "image/jpeg"
+    return (content_type or "").split(";", 1)[0].strip().lower()
+
+
+def kind_of(content_type):
+    content_type = normalize_type(content_type)
+    if content_type in AUDIO_FORMATS:
+        return VOICE
+    if content_type in IMAGE_TYPES:
+        return IMAGE
+    return UNSUPPORTED
+
+
+class MediaResult:
+    __slots__ = ("kind", "content_type", "text", "size", "error")
+
+    def __init__(self, kind, content_type, text=None, size=0, error=None):
+        self.kind = kind
+        self.content_type = content_type
+        self.text = text
+        self.size = size
+        self.error = error
+
+
+def merge_text(body, results):
+    # The caption first, then the text of each attachment in order. The same
+    # screenshot sent twice is only read out once.
+    parts = dict.fromkeys(part for part in [body] + [result.text for result in results] if part)
+    return "\n\n".join(parts)
+
+
+class MediaPipeline:
+    # Downloads all attachments of a message in parallel and turns each into
+    # text: voice notes are transcribed, images go through OCR. Both cache
+    # by the hash of the media bytes.
+    def __init__(self, transcriber, image_reader, auth=None, concurrency=MEDIA_CONCURRENCY):
+        self.transcriber = transcriber
+        self.image_reader = image_reader
+        self.auth = auth
+        self._executor = ThreadPoolExecutor(concurrency, thread_name_prefix="media")
+        self.counts = {}
+        # Attachments of one message are counted from the pool's threads
+        self._counts_lock = threading.Lock()
+
+    def _count(self, kind, outcome, size=0):
+        with self._counts_lock:
+            counts = self.counts.setdefault(kind, {"ok": 0, "empty": 0, "failed": 0, "bytes": 0})
+            counts[outcome] += 1
+            counts["bytes"] += size
+
+    def process(self, attachments):
+        # MediaResults in attachment order
+        if len(attachments) == 1:
+            return [self.process_one(*attachments[0])]
+        futures = [self._executor.submit(tracing.wrap(self.process_one), url, content_type)
+                   for url, content_type in attachments]
+        return [future.result() for future in futures]
+
+    def process_one(self, url, content_type):
+        content_type = normalize_type(content_type)
+        kind = kind_of(content_type)
+        if kind == UNSUPPORTED:
+            metrics.record_media(content_type, "unsupported")
+            return MediaResult(kind, content_type, error="unsupported")
+        try:
+            with metrics.media_timed(content_type, "fetch"), metrics.timed("media_fetch"):
+                # Streamed into memory, oversized media is rejected early
+                data, _ = download_media(url, auth=self.auth)
+            metrics.record_media_bytes(content_type, len(data))
+            with metrics.media_timed(content_type, "extract"):
+                if kind == VOICE:
+                    with metrics.timed("transcribe"):
+                        text = self.transcriber.transcribe(data, source_format=AUDIO_FORMATS[content_type])
+                else:
+                    with metrics.timed("ocr"):
+                        text = self.image_reader.read(data)
+        except Exception as e:
+            logger.error(f"Error reading {content_type} attachment: {e}")
+            metrics.record_media(content_type, "failed")
+            self._count(kind, "failed")
+            return MediaResult(kind, content_type, error=str(e))
+        outcome = "ok" if text else "empty"
+        metrics.record_media(content_type, outcome)
+        self._count(kind, outcome, len(data))
+        return MediaResult(kind, content_type, text=text, size=len(data))
+
+    def stats(self):
+        with self._counts_lock:
+            return {kind: dict(counts) for kind, counts in self.counts.items()}
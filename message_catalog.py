@@ -0,0 +1,205 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+import tracing
+from translation_cache import TRANSLATION_WARM_LANGUAGES, text_hash
+
+logger = logging.getLogger(__name__)
+
+# Translations of the fixed bot messages, built before deploying and
+# loaded read-only at startup
+MESSAGE_CATALOG_FILE = os.getenv(
+    "MESSAGE_CATALOG_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "message_catalog.json")
+)
+# Languages missing from it are translated in the background. They are kept
+# in memory and in the shared translation cache, and also written here when
+# set, e.g. a path on a persistent volume.
+MESSAGE_CATALOG_SAVE_FILE = os.getenv("MESSAGE_CATALOG_SAVE_FILE", "")
+# Seconds before a language whose translation failed is tried again
+MESSAGE_CATALOG_RETRY_AFTER = int(os.getenv("MESSAGE_CATALOG_RETRY_AFTER", 300))
+
+
+class MessageCatalog:
+    # Messages are keyed by the hash of their English text, so an edited
+    # message is simply missing from the catalog until it is filled again
+    def __init__(self, messages, translation_cache, path=MESSAGE_CATALOG_FILE,
+                 save_path=MESSAGE_CATALOG_SAVE_FILE, retry_after=MESSAGE_CATALOG_RETRY_AFTER):
+        self.messages = list(dict.fromkeys(messages))
+        self.translation_cache = translation_cache
+        self.path = path
+        self.save_path = save_path or None
+        self.retry_after = retry_after
+        self._keys = {text: text_hash(text) for text in self.messages}
+        self._languages = {}
+        self._filling = set()
+        self._failed = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.fill_errors = 0
+
+    def load(self):
+        # The built catalog, then what this deploy translated since
+        for path in dict.fromkeys([self.path, self.save_path]):
+            if not path:
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logger.error(f"Error loading message catalog {path}: {e}")
+                continue
+            for language, entries in data.get("languages", {}).items():
+                self._languages[language] = dict(self._languages.get(language, {}), **entries)
+        return self
+
+    def get(self, text, language):
+        # Never waits on the network: a language or message that isn't in the
+        # catalog yet is answered in English while it is filled
+        if language == "en" or not language:
+            return text
+        entries = self._languages.get(language)
+        if entries is not None:
+            value = entries.get(self._keys.get(text) or text_hash(text))
+            if value is not None:
+                self.hits += 1
+                return value
+        self.misses += 1
+        self.fill_in_background(language)
+        return text
+
+    def missing(self, language):
+        entries = self._languages.get(language, {})
+        return [text for text in self.messages if self._keys[text] not in entries]
+
+    def fill(self, language):
+        # Translates what the language is missing in one batch and persists it
+        missing = self.missing(language)
+        if not missing:
+            return True
+        with tracing.span("message_catalog.fill", language=language, messages=len(missing)):
+            translated = self.translation_cache.translate_batch(missing, language, fallback=False)
+        # Strings that failed come back as None, they stay missing and are
+        # tried again later. A translation identical to the English ("OK", a
+        # name) is kept like any other.
+        filled = {self._keys[text]: value for text, value in zip(missing, translated) if value is not None}
+        if filled:
+            entries = dict(self._languages.get(language, {}))
+            entries.update(filled)
+            # Swapped in whole, readers never see a half-filled language
+            self._languages[language] = entries
+            self.fills += 1
+            if self.save_path:
+                self.save()
+        if len(filled) < len(missing):
+            self.fill_errors += 1
+            self._failed[language] = time.monotonic()
+            logger.error(f"Error filling message catalog for {language}: {len(missing) - len(filled)} messages "
+                         "not translated, answering them in English for now")
+            return False
+        return True
+
+    def fill_in_background(self, language):
+        with self._lock:
+            if language in self._filling:
+                return None
+            failed_at = self._failed.get(language)
+            if failed_at is not None and time.monotonic() - failed_at < self.retry_after:
+                return None
+            self._filling.add(language)
+        thread = threading.Thread(target=self._fill, args=(language,), daemon=True)
+        thread.start()
+        return thread
+
+    def _fill(self, language):
+        try:
+            self.fill(language)
+        except Exception as e:
+            self.fill_errors += 1
+            self._failed[language] = time.monotonic()
+            logger.error(f"Error filling message catalog for {language}: {e}")
+        finally:
+            with self._lock:
+                self._filling.discard(language)
+
+    def warm_in_background(self, languages=TRANSLATION_WARM_LANGUAGES):
+        # Fills the common languages the file doesn't have yet
+        for language in languages:
+            if language != "en" and self.missing(language):
+                self.fill_in_background(language)
+
+    def save(self):
+        # Merged with what other workers wrote, then swapped in atomically
+        path = self.save_path
+        with self._lock:
+            try:
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        on_disk = json.load(f).get("languages", {})
+                except FileNotFoundError:
+                    on_disk = {}
+                for language, entries in self._languages.items():
+                    on_disk[language] = dict(on_disk.get(language, {}), **entries)
+                # Translations of messages that were edited or removed are dropped
+                current = set(self._keys.values())
+                data = {
+                    "messages": {self._keys[text]: text for text in self.messages},
+                    "languages": {
+                        language: {key: value for key, value in on_disk[language].items() if key in current}
+                        for language in sorted(on_disk)
+                    },
+                }
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=1, sort_keys=True)
+                os.replace(tmp, path)
+            except Exception as e:
+                logger.error(f"Error saving message catalog {path}: {e}")
+
+    def languages(self):
+        return sorted(self._languages)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "fills": self.fills,
+            "fill_errors": self.fill_errors,
+            "languages": len(self._languages),
+        }
+
+
+def main():
+    # Standalone, doesn't import or start the app
+    parser = argparse.ArgumentParser(description="Build the translated message catalog")
+    parser.add_argument("--languages", default=",".join(TRANSLATION_WARM_LANGUAGES), help="comma separated")
+    parser.add_argument("--output", default=MESSAGE_CATALOG_FILE, help="catalog file to update")
+    args = parser.parse_args()
+
+    from googletrans import Translator
+    from messages import STATIC_MESSAGES
+    from redis_store import make_redis_client
+    from translation_cache import TranslationCache
+
+    translation_cache = TranslationCache(Translator(), make_redis_client())
+    catalog = MessageCatalog(STATIC_MESSAGES, translation_cache, path=args.output, save_path=args.output).load()
+    failed = False
+    for language in [lang.strip() for lang in args.languages.split(",") if lang.strip()]:
+        ok = catalog.fill(language)
+        failed = failed or not ok
+        print(f"{language}: {'ok' if ok else 'failed'}")
+    if os.path.exists(args.output):
+        print(f"Wrote {args.output}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
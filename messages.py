@@ -0,0 +1,45 @@
+from intents import GREETING, THANKS, FAREWELL, ACKNOWLEDGEMENT, FEEDBACK
+
+# The bot's fixed messages in English. Kept apart from the app so the
+# message catalog can be built without starting it.
+
+GREETING_MORNING = "Good morning! 🌅"
+GREETING_AFTERNOON = "Good afternoon! 🌞"
+GREETING_EVENING = "Good evening! 🌙"
+WELCOME_MESSAGE = (
+    "Welcome to AI Fact Checker! 🤖✨\n\n"
+    "I'm here to help you verify information and check facts. "
+    "Feel free to ask me any questions or share statements you'd like to fact-check.\n\n"
+    "To get started, simply type your question or statement! 📝"
+)
+PROCESSING_MESSAGE = "Processing your request. ⏳"
+PROCESSING_VOICE_MESSAGE = "Processing your voice note... ⏳"
+VOICE_ERROR_MESSAGE = "Sorry, I couldn't process the voice note."
+IMAGE_ERROR_MESSAGE = "Sorry, I couldn't read any text in the image."
+UNSUPPORTED_MEDIA_MESSAGE = "Unsupported media type. Please send a voice note, a screenshot or text."
+RATING_PROMPT = "Was this response helpful? Reply with 👍 for Yes or 👎 for No."
+FEEDBACK_THANKS_MESSAGE = "Thank you for your feedback! 🙏.\n Would you like to verify another claim?"
+ERROR_MESSAGE = "An error occurred. Please try again later."
+BUSY_MESSAGE = "We're receiving a lot of requests right now. Please send your claim again in a few minutes. 🙏"
+SLOW_DOWN_MESSAGE = "You're sending claims faster than we can check them. Please wait a moment before sending the next one. ⏳"
+GREETING_REPLY = "Hello! 👋 Send me a claim, a link or a voice note and I'll fact-check it for you."
+THANKS_REPLY = "You're welcome! 😊 Send another claim whenever you want it checked."
+FAREWELL_REPLY = "Goodbye! 👋 Come back any time you want something fact-checked."
+ACKNOWLEDGEMENT_REPLY = "👍 Send me a claim whenever you're ready."
+# Canned answers for messages that aren't claims, no fact-check needed
+SMALL_TALK_REPLIES = {
+    GREETING: GREETING_REPLY,
+    THANKS: THANKS_REPLY,
+    FAREWELL: FAREWELL_REPLY,
+    ACKNOWLEDGEMENT: ACKNOWLEDGEMENT_REPLY,
+    FEEDBACK: ACKNOWLEDGEMENT_REPLY,
+}
+
+# Fixed bot messages, rendered from the translated catalog file
+STATIC_MESSAGES = (
+    GREETING_MORNING, GREETING_AFTERNOON, GREETING_EVENING, WELCOME_MESSAGE,
+    PROCESSING_MESSAGE, PROCESSING_VOICE_MESSAGE, VOICE_ERROR_MESSAGE, IMAGE_ERROR_MESSAGE,
+    UNSUPPORTED_MEDIA_MESSAGE, RATING_PROMPT, FEEDBACK_THANKS_MESSAGE, ERROR_MESSAGE,
+    BUSY_MESSAGE, SLOW_DOWN_MESSAGE, GREETING_REPLY, THANKS_REPLY, FAREWELL_REPLY,
+    ACKNOWLEDGEMENT_REPLY,
+)
@@ -0,0 +1,207 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest,
+    start_http_server,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Port for a standalone /metrics server in processes without Flask (worker.py)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# Set by gunicorn deployments with several workers, see prometheus_client's
+# multiprocess mode
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+STAGES = (
+    "webhook", "session_load", "language_detect", "media_fetch", "transcribe", "ocr", "translate", "upstream",
+    "twilio_send", "session_save",
+)
+# From a cached translation (ms) to a slow fact-check (minutes)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "factcheck_stage_seconds", "Time spent in each stage of handling a message", ["stage"], buckets=STAGE_BUCKETS
+)
+STAGE_ERRORS = Counter("factcheck_stage_errors_total", "Errors by stage", ["stage"])
+MESSAGE_SECONDS = Histogram(
+    "factcheck_message_seconds", "Time from webhook to the message being handled", ["media_type"],
+    buckets=STAGE_BUCKETS
+)
+# Seconds from Twilio handing us a message to the first message that answers
+# it being accepted by Twilio
+FIRST_REPLY_SECONDS = Histogram(
+    "factcheck_first_reply_seconds", "Time from webhook to the first answering message being sent",
+    buckets=STAGE_BUCKETS
+)
+MESSAGES = Counter("factcheck_messages_total", "Messages handled", ["language", "media_type"])
+# Per attachment: download and text extraction time, bytes and outcome
+# (ok, empty, failed, unsupported)
+MEDIA_SECONDS = Histogram(
+    "factcheck_media_seconds", "Time to fetch an attachment and to extract its text", ["media_type", "step"],
+    buckets=STAGE_BUCKETS
+)
+MEDIA_BYTES = Counter("factcheck_media_bytes_total", "Attachment bytes downloaded", ["media_type"])
+MEDIA_ATTACHMENTS = Counter("factcheck_media_attachments_total", "Attachments handled", ["media_type", "result"])
+# Per processed message, from redis_store.track_usage
+REDIS_ROUND_TRIPS = Histogram(
+    "factcheck_redis_round_trips", "Redis round trips per processed message",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64)
+)
+REDIS_COMMANDS = Histogram(
+    "factcheck_redis_commands", "Redis commands per processed message", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "factcheck_upstream_in_flight", "Fact-check API calls in progress", multiprocess_mode="livesum"
+)
+
+# Children looked up once, labels() takes a lock on every call
+_stage_seconds = {stage: STAGE_SECONDS.labels(stage) for stage in STAGES}
+_stage_errors = {stage: STAGE_ERRORS.labels(stage) for stage in STAGES}
+
+
+def media_kind(media_type):
+    # "audio/ogg" -> "audio", keeps the label set small
+    if not media_type:
+        return "text"
+    return media_type.split("/", 1)[0] or "other"
+
+
+@contextmanager
+def timed(stage):
+    # Also a tracing span named after the stage
+    start = time.perf_counter()
+    try:
+        with tracing.span(stage):
+            yield
+    except Exception:
+        _stage_errors[stage].inc()
+        raise
+    finally:
+        _stage_seconds[stage].observe(time.perf_counter() - start)
+
+
+def observe(stage, seconds):
+    _stage_seconds[stage].observe(seconds)
+
+
+def record_error(stage):
+    _stage_errors[stage].inc()
+
+
+def record_message(language, media_type):
+    MESSAGES.labels(language or "unknown", media_kind(media_type)).inc()
+
+
+@contextmanager
+def media_timed(media_type, step):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        MEDIA_SECONDS.labels(media_kind(media_type), step).observe(time.perf_counter() - start)
+
+
+def record_media_bytes(media_type, size):
+    MEDIA_BYTES.labels(media_kind(media_type)).inc(size)
+
+
+def record_media(media_type, result):
+    MEDIA_ATTACHMENTS.labels(media_kind(media_type), result).inc()
+
+
+def observe_message(media_type, received_at):
+    # received_at is the webhook's time.time(), so this includes queueing
+    if received_at is not None:
+        MESSAGE_SECONDS.labels(media_kind(media_type)).observe(max(0.0, time.time() - received_at))
+
+
+def observe_first_reply(received_at):
+    FIRST_REPLY_SECONDS.observe(max(0.0, time.time() - received_at))
+
+
+def observe_redis(usage):
+    REDIS_ROUND_TRIPS.observe(usage.round_trips)
+    REDIS_COMMANDS.observe(usage.commands)
+
+
+# stats() keys that are levels rather than running totals
+GAUGE_STATS = {
+    "depth", "delayed", "dead_letters", "pending", "waiting_senders", "local_entries", "skip_rate",
+    "duplicate_rate", "avg_latency_s", "real_time_factor", "p50", "p99", "languages", "hit_rate",
+    "avg_lookup_ms",
+}
+
+
+def flatten(stats, prefix=""):
+    # Numeric (name, key, value) for every leaf, nested dicts and lists
+    # named "outer_inner" / "outer_0_inner"
+    items = stats.items() if isinstance(stats, dict) else enumerate(stats)
+    for key, value in items:
+        if isinstance(value, (dict, list)):
+            yield from flatten(value, f"{prefix}{key}_")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", key, value
+
+
+class StatsCollector:
+    # Turns the stats() counters the caches and clients already keep into
+    # metrics when /metrics is scraped, so cache hits cost nothing extra on
+    # the hot path
+    def __init__(self):
+        self.sources = {}
+
+    def add(self, name, stats):
+        self.sources[name] = stats
+
+    def collect(self):
+        lookups = CounterMetricFamily(
+            "factcheck_cache_lookups", "Cache lookups by cache and result", labels=["cache", "result"]
+        )
+        gauges = GaugeMetricFamily("factcheck_component", "Point-in-time component stats", labels=["component", "stat"])
+        counters = CounterMetricFamily("factcheck_component_events", "Component event counts", labels=["component", "stat"])
+        for name, stats in list(self.sources.items()):
+            try:
+                values = stats()
+            except Exception as e:
+                logger.error(f"Error collecting {name} stats: {e}")
+                continue
+            for stat, key, value in flatten(values):
+                if stat.startswith("hits_") or stat in ("cache_hits", "cache_misses", "misses"):
+                    # "hits_local" -> "hit_local", "cache_misses" -> "miss"
+                    result = "miss" if "miss" in stat else stat.replace("cache_hits", "hit").replace("hits_", "hit_")
+                    lookups.add_metric([name, result], value)
+                elif key in GAUGE_STATS:
+                    gauges.add_metric([name, stat], value)
+                else:
+                    counters.add_metric([name, stat], value)
+        yield lookups
+        yield gauges
+        yield counters
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+def metrics_response():
+    # (body, content type) for a /metrics endpoint
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(stats_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port=METRICS_PORT):
+    if port:
+        start_http_server(port)
+        logger.info(f"Serving metrics on :{port}/metrics")
@@ -0,0 +1,146 @@
+import hashlib
+import importlib.util
+import io
+import logging
+import os
+import re
+import shutil
+import time
+from abc import ABC, abstractmethod
+
+import tracing
+from caches import TextCache
+
+logger = logging.getLogger(__name__)
+
+# "tesseract" (local, needs the tesseract binary, pytesseract and Pillow),
+# "none" (images aren't read) or "auto" (tesseract when it is installed)
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto").lower()
+# Tesseract language packs, e.g. "eng+fra+hau"
+OCR_LANGUAGES = os.getenv("OCR_LANGUAGES", "eng")
+# Larger images are scaled down first, screenshots stay readable and
+# tesseract's time grows with the pixel count
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", 2000))
+OCR_CACHE_TTL = int(os.getenv("OCR_CACHE_TTL", 7 * 24 * 60 * 60))
+OCR_CACHE_LOCAL_SIZE = int(os.getenv("OCR_CACHE_LOCAL_SIZE", 256))
+
+CACHE_KEY = "ocr:{}:{}"
+
+# A line needs a few letters or digits to be more than OCR noise
+WORD_PATTERN = re.compile(r"\w{2,}")
+SPACES_PATTERN = re.compile(r"[ \t]+")
+
+
+def clean_text(text):
+    lines = [SPACES_PATTERN.sub(" ", line).strip() for line in (text or "").splitlines()]
+    return "\n".join(line for line in lines if WORD_PATTERN.search(line))
+
+
+class OCRBackend(ABC):
+    name = None
+    # False when images are skipped instead of read
+    available = True
+
+    @abstractmethod
+    def read(self, data):
+        pass
+
+
+class TesseractBackend(OCRBackend):
+    name = "tesseract"
+
+    def __init__(self, languages=OCR_LANGUAGES, max_side=OCR_MAX_SIDE):
+        self.languages = languages
+        self.max_side = max_side
+
+    def read(self, data):
+        from PIL import Image
+        import pytesseract
+
+        image = Image.open(io.BytesIO(data))
+        # Grayscale, scaled in place, is what tesseract binarizes best
+        image = image.convert("L")
+        image.thumbnail((self.max_side, self.max_side))
+        return pytesseract.image_to_string(image, lang=self.languages)
+
+    @staticmethod
+    def installed():
+        modules = ("PIL", "pytesseract")
+        return all(importlib.util.find_spec(module) for module in modules) and shutil.which("tesseract") is not None
+
+
+class NoOCRBackend(OCRBackend):
+    name = "none"
+    available = False
+
+    def read(self, data):
+        return ""
+
+
+BACKENDS = {
+    TesseractBackend.name: TesseractBackend,
+    NoOCRBackend.name: NoOCRBackend,
+}
+
+
+def get_backend(name=OCR_BACKEND):
+    if name == "auto":
+        if TesseractBackend.installed():
+            return TesseractBackend()
+        logger.warning("OCR is off: tesseract, pytesseract or Pillow is not installed, images are not read. "
+                       "Install them or set OCR_BACKEND=none to silence this.")
+        return NoOCRBackend()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown OCR_BACKEND: {name}")
+    return BACKENDS[name]()
+
+
+class ImageReader:
+    # Text of an image, cached by the hash of its bytes: a forwarded
+    # screenshot is byte-identical every time it is shared
+    def __init__(self, redis_client, backend=None, ttl=OCR_CACHE_TTL, local_size=OCR_CACHE_LOCAL_SIZE):
+        self.backend = backend or get_backend()
+        self.cache = TextCache(redis_client, ttl, local_size, "OCR")
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.calls = 0
+        self.errors = 0
+        self.skipped = 0
+        self.seconds = 0.0
+
+    def read(self, data):
+        # Without an OCR backend images read as empty and nothing is cached
+        if not self.backend.available:
+            self.skipped += 1
+            return ""
+        key = CACHE_KEY.format(self.backend.name, hashlib.sha256(data).hexdigest())
+        text = self.cache.get(key)
+        if text is not None:
+            self.cache_hits += 1
+            return text
+        self.cache_misses += 1
+
+        start = time.perf_counter()
+        try:
+            with tracing.span("ocr.read", backend=self.backend.name, bytes=len(data)):
+                text = clean_text(self.backend.read(data))
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.calls += 1
+            self.seconds += time.perf_counter() - start
+
+        # Images without text are cached too, as an empty string
+        self.cache.set(key, text)
+        return text
+
+    def stats(self):
+        return {
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "calls": self.calls,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "avg_latency_s": self.seconds / self.calls if self.calls else 0.0,
+        }
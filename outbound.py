@@ -0,0 +1,250 @@
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import tracing
+from rate_limit import RedisTokenBucket, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Point this at a local mock server to test without Twilio
+TWILIO_API_BASE = os.getenv("TWILIO_API_BASE", "https://api.twilio.com").rstrip("/")
+# Messages per second allowed from one TWILIO_WHATSAPP_NUMBER across all workers
+TWILIO_RATE_LIMIT = float(os.getenv("TWILIO_RATE_LIMIT", 10))
+TWILIO_RATE_BURST = int(os.getenv("TWILIO_RATE_BURST", 10))
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", 8))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", 4))
+OUTBOUND_RETRY_BACKOFF = float(os.getenv("OUTBOUND_RETRY_BACKOFF", 1))
+OUTBOUND_TIMEOUT = (5, 30)
+
+RATE_LIMIT_KEY = "twilio:rate:{}"
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+_current_sends = contextvars.ContextVar("outbound_sends", default=None)
+
+
+@contextmanager
+def track_sends():
+    # Futures of the messages queued while handling the current message. A
+    # queued message goes out even if the handler fails afterwards.
+    sends = []
+    token = _current_sends.set(sends)
+    try:
+        yield sends
+    finally:
+        _current_sends.reset(token)
+
+
+class SentMessage:
+    # Mirrors the part of Twilio's MessageInstance the bot uses
+    __slots__ = ("sid", "status", "to")
+
+    def __init__(self, sid, status=None, to=None):
+        self.sid = sid
+        self.status = status
+        self.to = to
+
+
+class TwilioSendError(Exception):
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.status_code is None or self.status_code in RETRYABLE_STATUS
+
+
+class TwilioMessagesAPI:
+    def __init__(self, account_sid, auth_token, api_base=TWILIO_API_BASE, pool_size=OUTBOUND_WORKERS):
+        self.url = f"{api_base}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.session = requests.Session()
+        self.session.auth = (account_sid, auth_token)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def create(self, from_, to, body=None, content_sid=None):
+        with metrics.timed("twilio_send"), tracing.http_span("twilio.messages.create", "POST", self.url):
+            return self._create(from_, to, body, content_sid)
+
+    def _create(self, from_, to, body=None, content_sid=None):
+        data = {"From": from_, "To": to}
+        if body is not None:
+            data["Body"] = body
+        if content_sid:
+            data["ContentSid"] = content_sid
+        try:
+            response = self.session.post(self.url, data=data, timeout=OUTBOUND_TIMEOUT)
+        except requests.RequestException as e:
+            raise TwilioSendError(str(e))
+        if response.status_code >= 400:
+            retry_after = response.headers.get("Retry-After")
+            raise TwilioSendError(
+                f"Twilio returned {response.status_code}: {response.text[:200]}",
+                status_code=response.status_code,
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+            )
+        payload = response.json()
+        return SentMessage(payload.get("sid"), payload.get("status"), payload.get("to"))
+
+
+class OutboundJob:
+    __slots__ = ("to", "body", "content_sid", "delay", "attempt", "future", "context")
+
+    def __init__(self, to, body, content_sid, delay):
+        self.to = to
+        self.body = body
+        self.content_sid = content_sid
+        self.delay = delay
+        self.attempt = 0
+        self.future = Future()
+        # Trace context of the sender, the message is sent from another thread
+        self.context = tracing.current()
+
+
+class OutboundDispatcher:
+    # Messages to one recipient are sent strictly in submission order, each
+    # job's delay counts from the previous message to that recipient. Waits
+    # (delays, rate limiting, retry backoff) are scheduled, never slept.
+    def __init__(self, api, from_number, redis_client, workers=OUTBOUND_WORKERS,
+                 rate=TWILIO_RATE_LIMIT, burst=TWILIO_RATE_BURST, max_retries=OUTBOUND_MAX_RETRIES):
+        self.api = api
+        self.from_number = from_number
+        self.max_retries = max_retries
+        if redis_client is not None:
+            self.limiter = RedisTokenBucket(redis_client, RATE_LIMIT_KEY.format(from_number), rate, burst)
+        else:
+            # Single process only, used by the mock-server benchmark
+            self.limiter = TokenBucket(rate, burst)
+        self._queues = {}
+        self._busy = set()
+        self._ready = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.workers = workers
+        self._pid = None
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+        self.throttled = 0
+
+    def _ensure_started(self):
+        # Threads are started lazily and per process, so the dispatcher also
+        # works in forked worker processes (gunicorn, Celery prefork)
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name=f"outbound-{i}", daemon=True).start()
+
+    def send(self, to, body=None, content_sid=None, delay=0):
+        self._ensure_started()
+        job = OutboundJob(to, body, content_sid, delay)
+        sends = _current_sends.get()
+        if sends is not None:
+            sends.append(job.future)
+        with self._cond:
+            queue = self._queues.setdefault(to, deque())
+            queue.append(job)
+            if len(queue) == 1 and to not in self._busy:
+                self._schedule(to, time.monotonic() + delay)
+        return job.future
+
+    def _schedule(self, to, due):
+        heapq.heappush(self._ready, (due, next(self._seq), to))
+        self._cond.notify()
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                if not self._ready:
+                    self._cond.wait()
+                    continue
+                due, _, to = self._ready[0]
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                heapq.heappop(self._ready)
+                if to in self._busy or not self._queues.get(to):
+                    continue
+                self._busy.add(to)
+                return self._queues[to][0]
+
+    def _done(self, job, retry_in=None):
+        with self._cond:
+            self._busy.discard(job.to)
+            queue = self._queues[job.to]
+            if retry_in is not None:
+                self._schedule(job.to, time.monotonic() + retry_in)
+                return
+            queue.popleft()
+            if queue:
+                self._schedule(job.to, time.monotonic() + queue[0].delay)
+            else:
+                del self._queues[job.to]
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            wait = self.limiter.try_acquire()
+            if wait > 0:
+                self.throttled += 1
+                self._done(job, retry_in=wait)
+                continue
+            try:
+                with tracing.attached(job.context):
+                    message = self.api.create(
+                        from_=self.from_number, to=job.to, body=job.body, content_sid=job.content_sid
+                    )
+            except TwilioSendError as e:
+                if e.retryable and job.attempt < self.max_retries:
+                    job.attempt += 1
+                    self.retries += 1
+                    backoff = e.retry_after or OUTBOUND_RETRY_BACKOFF * (2 ** (job.attempt - 1))
+                    backoff *= random.uniform(1.0, 1.25)
+                    logger.warning(f"Retrying message to {job.to} in {backoff:.1f}s: {e}")
+                    self._done(job, retry_in=backoff)
+                    continue
+                self.failed += 1
+                logger.error(f"Error sending message to {job.to}: {e}")
+                job.future.set_exception(e)
+                self._done(job)
+                continue
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error sending message to {job.to}: {e}")
+                job.future.set_exception(e)
+                self._done(job)
+                continue
+            self.sent += 1
+            job.future.set_result(message)
+            self._done(job)
+
+    def stats(self):
+        with self._cond:
+            pending = sum(len(queue) for queue in self._queues.values())
+        return {
+            "sent": self.sent,
+            "retries": self.retries,
+            "failed": self.failed,
+            "throttled": self.throttled,
+            "pending": pending,
+        }
@@ -0,0 +1,67 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Token bucket shared by every worker. Uses the Redis clock so workers on
+# different hosts agree on the refill. Returns the seconds to wait, 0 when a
+# token was taken.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "ts", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 60)
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        # Returns 0 when the tokens were taken, otherwise the seconds to wait
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+
+class RedisTokenBucket:
+    def __init__(self, redis_client, key, rate, burst):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+        # Used when Redis is unreachable, so sending never stops entirely
+        self._fallback = TokenBucket(rate, burst)
+
+    def try_acquire(self):
+        try:
+            return float(self._script(keys=[self.key], args=[self.rate, self.burst]))
+        except Exception as e:
+            logger.error(f"Error using rate limiter {self.key}: {e}")
+            return self._fallback.try_acquire()
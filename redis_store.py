@@ -0,0 +1,203 @@
+import contextvars
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import redis
+from redis.client import Pipeline
+from redis.connection import Connection, SSLConnection
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL")
+# One pool per worker process, shared by all of its threads. Queue consumers
+# and single-flight waiters each hold a connection while blocked.
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 10))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", 5))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+
+
+class RedisUsage:
+    def __init__(self):
+        self.round_trips = 0
+        self.commands = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def add(self, round_trips=0, commands=0, bytes_sent=0, bytes_received=0):
+        self.round_trips += round_trips
+        self.commands += commands
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+
+
+totals = RedisUsage()
+_totals_lock = threading.Lock()
+_current_usage = contextvars.ContextVar("redis_usage", default=None)
+
+
+def record(round_trips=0, commands=0, bytes_sent=0, bytes_received=0):
+    with _totals_lock:
+        totals.add(round_trips, commands, bytes_sent, bytes_received)
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add(round_trips, commands, bytes_sent, bytes_received)
+
+
+@contextmanager
+def track_usage():
+    # Counts the Redis traffic of the current request or job
+    usage = RedisUsage()
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+
+def payload_size(response):
+    if isinstance(response, (bytes, bytearray)):
+        return len(response)
+    if isinstance(response, (list, tuple)):
+        return sum(payload_size(item) for item in response)
+    if isinstance(response, dict):
+        return sum(payload_size(k) + payload_size(v) for k, v in response.items())
+    return 8
+
+
+class CountingMixin:
+    # Bytes on the wire, only known for real connections. Round trips and
+    # commands are counted by the client below.
+    def send_packed_command(self, command, check_health=True):
+        if isinstance(command, (bytes, str)):
+            size = len(command)
+        else:
+            size = sum(len(part) for part in command)
+        record(bytes_sent=size)
+        return super().send_packed_command(command, check_health)
+
+    def read_response(self, *args, **kwargs):
+        response = super().read_response(*args, **kwargs)
+        record(bytes_received=payload_size(response))
+        return response
+
+
+class CountingConnection(CountingMixin, Connection):
+    pass
+
+
+class CountingSSLConnection(CountingMixin, SSLConnection):
+    pass
+
+
+class CountingPipeline(Pipeline):
+    # The queued commands go out together, one round trip. Commands sent
+    # while WATCHing run immediately, one round trip each.
+    def immediate_execute_command(self, *args, **options):
+        record(round_trips=1, commands=1)
+        return super().immediate_execute_command(*args, **options)
+
+    def execute(self, raise_on_error=True):
+        if self.command_stack:
+            record(round_trips=1, commands=len(self.command_stack))
+        return super().execute(raise_on_error)
+
+
+class CountingClientMixin:
+    # Counts at the client rather than the socket, so the numbers are the
+    # same against fakeredis as against a real server
+    def execute_command(self, *args, **options):
+        record(round_trips=1, commands=1)
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return CountingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class CountingRedis(CountingClientMixin, redis.Redis):
+    pass
+
+
+_fake_server = None
+
+
+def fake_server():
+    # Sync and async fake clients share one in-memory server
+    global _fake_server
+    if _fake_server is None:
+        import fakeredis
+        _fake_server = fakeredis.FakeServer()
+    return _fake_server
+
+
+def make_redis_client(redis_url=REDIS_URL):
+    # fakeredis:// runs everything in memory, for benchmarks and local runs
+    if redis_url and redis_url.startswith("fakeredis://"):
+        import fakeredis
+
+        class CountingFakeRedis(CountingClientMixin, fakeredis.FakeRedis):
+            pass
+
+        return CountingFakeRedis(server=fake_server())
+
+    url = urlparse(redis_url)
+    ssl = url.scheme == "rediss"
+    kwargs = {}
+    if ssl:
+        kwargs["ssl_cert_reqs"] = None
+    pool = redis.BlockingConnectionPool(
+        host=url.hostname,
+        port=url.port or 6379,
+        password=url.password,
+        db=int(url.path.lstrip("/") or 0),
+        connection_class=CountingSSLConnection if ssl else CountingConnection,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        **kwargs
+    )
+    return CountingRedis(connection_pool=pool)
+
+
+def make_async_redis_client(redis_url=REDIS_URL):
+    # redis.asyncio client for async_app, pooled per event loop
+    if redis_url and redis_url.startswith("fakeredis://"):
+        import fakeredis
+        return fakeredis.FakeAsyncRedis(server=fake_server())
+
+    import redis.asyncio
+    url = urlparse(redis_url)
+    kwargs = {}
+    if url.scheme == "rediss":
+        kwargs["connection_class"] = redis.asyncio.SSLConnection
+        kwargs["ssl_cert_reqs"] = None
+    pool = redis.asyncio.BlockingConnectionPool(
+        host=url.hostname,
+        port=url.port or 6379,
+        password=url.password,
+        db=int(url.path.lstrip("/") or 0),
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        **kwargs
+    )
+    return redis.asyncio.Redis(connection_pool=pool)
+
+
+def stats():
+    return {
+        "round_trips": totals.round_trips,
+        "commands": totals.commands,
+        "bytes_sent": totals.bytes_sent,
+        "bytes_received": totals.bytes_received,
+    }
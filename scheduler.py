@@ -0,0 +1,240 @@
+import logging
+import os
+import time
+
+from rate_limit import TOKEN_BUCKET_SCRIPT
+
+logger = logging.getLogger(__name__)
+
+SCHED_ENABLED = os.getenv("SCHED_ENABLED", "true").lower() == "true"
+# Jobs waiting across all senders before new messages get a busy reply
+SCHED_MAX_DEPTH = int(os.getenv("SCHED_MAX_DEPTH", 2000))
+# Fact-checks one sender may have waiting, and running at once
+SCHED_SENDER_MAX_QUEUED = int(os.getenv("SCHED_SENDER_MAX_QUEUED", 10))
+SCHED_SENDER_CONCURRENCY = int(os.getenv("SCHED_SENDER_CONCURRENCY", 1))
+# Fact-checks per second one sender may start, with bursts of SCHED_SENDER_BURST
+SCHED_SENDER_RATE = float(os.getenv("SCHED_SENDER_RATE", 0.1))
+SCHED_SENDER_BURST = int(os.getenv("SCHED_SENDER_BURST", 5))
+# "whatsapp:+123=2,whatsapp:+456=0.5", senders not listed have weight 1
+SCHED_SENDER_WEIGHTS = os.getenv("SCHED_SENDER_WEIGHTS", "")
+# Senders looked at per pop when the first ones are at their running cap
+SCHED_SCAN = int(os.getenv("SCHED_SCAN", 50))
+# Running counts expire so a crashed worker can't block a sender for good
+SCHED_RUNNING_TTL = int(os.getenv("SCHED_RUNNING_TTL", 900))
+# Fair-queuing cost of a text fact-check is 1, voice notes also need transcribing
+SCHED_MEDIA_COST = float(os.getenv("SCHED_MEDIA_COST", 3))
+
+PRIORITY_KEY = "sched:priority"
+SENDERS_KEY = "sched:senders"
+SENDER_QUEUE_KEY = "sched:queue:"
+FINISH_KEY = "sched:finish"
+VTIME_KEY = "sched:vtime"
+DEPTH_KEY = "sched:depth"
+RUNNING_KEY = "sched:running:"
+SIGNAL_KEY = "sched:signal"
+BUCKET_KEY = "sched:bucket:{}"
+
+# Cheap jobs go to one FIFO lane served first. Fact-checks go to a list per
+# sender, tagged with a weighted-fair-queuing finish time; the sender with
+# the smallest head tag is served next.
+PUSH_SCRIPT = """
+local depth = tonumber(redis.call("GET", KEYS[6]) or "0")
+local admit = ARGV[7] == "1"
+if admit and depth >= tonumber(ARGV[5]) then
+    return "busy"
+end
+if ARGV[3] == "1" then
+    redis.call("RPUSH", KEYS[1], ARGV[2] .. "\\t" .. ARGV[1])
+else
+    if admit and redis.call("LLEN", KEYS[3]) >= tonumber(ARGV[6]) then
+        return "sender_busy"
+    end
+    local vtime = tonumber(redis.call("GET", KEYS[5]) or "0")
+    local last = tonumber(redis.call("HGET", KEYS[4], ARGV[2]) or "0")
+    local tag = math.max(vtime, last) + tonumber(ARGV[4])
+    redis.call("HSET", KEYS[4], ARGV[2], tag)
+    if redis.call("RPUSH", KEYS[3], tag .. "\\t" .. ARGV[1]) == 1 then
+        redis.call("ZADD", KEYS[2], tag, ARGV[2])
+    end
+end
+redis.call("INCR", KEYS[6])
+redis.call("RPUSH", KEYS[7], "1")
+redis.call("LTRIM", KEYS[7], -1000, -1)
+return "ok"
+"""
+
+# Every key is passed in KEYS: pop() reads the first SCHED_SCAN senders
+# beforehand and adds their queue and running-count keys, the script
+# checks they are still waiting. Cheap jobs don't take a running slot, a
+# sender's 👍 never waits behind their own fact-check.
+POP_SCRIPT = """
+local cap = tonumber(ARGV[1])
+local function split(item)
+    local sep = string.find(item, "\\t", 1, true)
+    return string.sub(item, 1, sep - 1), string.sub(item, sep + 1)
+end
+
+local item = redis.call("LPOP", KEYS[1])
+if item then
+    local _, job_id = split(item)
+    redis.call("DECR", KEYS[5])
+    return {job_id, ""}
+end
+
+for n = 1, #ARGV - 2 do
+    local sender = ARGV[n + 2]
+    local queue = KEYS[4 + 2 * n]
+    local running = KEYS[5 + 2 * n]
+    if redis.call("ZSCORE", KEYS[2], sender) and tonumber(redis.call("GET", running) or "0") < cap then
+        local popped = redis.call("LPOP", queue)
+        if popped then
+            redis.call("INCR", running)
+            redis.call("EXPIRE", running, ARGV[2])
+            local tag, job_id = split(popped)
+            local vtime = tonumber(redis.call("GET", KEYS[4]) or "0")
+            if tonumber(tag) > vtime then
+                redis.call("SET", KEYS[4], tag)
+            end
+            local head = redis.call("LINDEX", queue, 0)
+            if head then
+                local next_tag = split(head)
+                redis.call("ZADD", KEYS[2], next_tag, sender)
+            else
+                redis.call("ZREM", KEYS[2], sender)
+                redis.call("HDEL", KEYS[3], sender)
+            end
+            redis.call("DECR", KEYS[5])
+            return {job_id, sender}
+        end
+        redis.call("ZREM", KEYS[2], sender)
+    end
+end
+return false
+"""
+
+RELEASE_SCRIPT = """
+if redis.call("DECR", KEYS[1]) <= 0 then
+    redis.call("DEL", KEYS[1])
+end
+"""
+
+
+class Overloaded(Exception):
+    # reason is "busy" (queue full), "sender_busy" (too many waiting for
+    # this sender) or "rate_limited" (sender's token bucket is empty)
+    def __init__(self, reason):
+        super().__init__(f"Job rejected: {reason}")
+        self.reason = reason
+
+
+def parse_weights(value):
+    weights = {}
+    for item in value.split(","):
+        sender, _, weight = item.strip().rpartition("=")
+        if sender:
+            weights[sender] = float(weight)
+    return weights
+
+
+class FairScheduler:
+    # classify(payload) returns (sender, cheap, cost). Cheap jobs (feedback,
+    # greetings) skip the token bucket and the running cap, and run before
+    # fact-checks.
+    def __init__(self, redis_client, classify, max_depth=SCHED_MAX_DEPTH,
+                 sender_max_queued=SCHED_SENDER_MAX_QUEUED, sender_concurrency=SCHED_SENDER_CONCURRENCY,
+                 sender_rate=SCHED_SENDER_RATE, sender_burst=SCHED_SENDER_BURST,
+                 weights=None, scan=SCHED_SCAN, running_ttl=SCHED_RUNNING_TTL):
+        self.redis_client = redis_client
+        self.classify = classify
+        self.max_depth = max_depth
+        self.sender_max_queued = sender_max_queued
+        self.sender_concurrency = sender_concurrency
+        self.sender_rate = sender_rate
+        self.sender_burst = sender_burst
+        self.weights = parse_weights(SCHED_SENDER_WEIGHTS) if weights is None else weights
+        self.scan = scan
+        self.running_ttl = running_ttl
+        self._push = redis_client.register_script(PUSH_SCRIPT)
+        self._pop = redis_client.register_script(POP_SCRIPT)
+        self._release = redis_client.register_script(RELEASE_SCRIPT)
+        self._bucket = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.pushed = 0
+        self.rejected = {"busy": 0, "sender_busy": 0, "rate_limited": 0}
+
+    def admit(self, payload):
+        # Per-sender token bucket, only fact-checks spend tokens
+        sender, cheap, _ = self.classify(payload)
+        if cheap or not self.sender_rate:
+            return
+        try:
+            wait = float(self._bucket(keys=[BUCKET_KEY.format(sender)], args=[self.sender_rate, self.sender_burst]))
+        except Exception as e:
+            logger.error(f"Error checking rate limit for {sender}: {e}")
+            return
+        if wait > 0:
+            self.rejected["rate_limited"] += 1
+            raise Overloaded("rate_limited")
+
+    def push(self, job, admit=True):
+        # Retries pass admit=False, the job was already accepted once
+        sender, cheap, cost = self.classify(job["payload"])
+        if admit:
+            self.admit(job["payload"])
+        result = self._push(
+            keys=[PRIORITY_KEY, SENDERS_KEY, SENDER_QUEUE_KEY + sender, FINISH_KEY, VTIME_KEY, DEPTH_KEY, SIGNAL_KEY],
+            args=[job["id"], sender, int(cheap), cost / self.weights.get(sender, 1.0),
+                  self.max_depth, self.sender_max_queued, int(admit)],
+        )
+        result = result.decode("utf-8") if isinstance(result, bytes) else result
+        if result != "ok":
+            self.rejected[result] += 1
+            raise Overloaded(result)
+        self.pushed += 1
+
+    def _pop_once(self):
+        senders = [sender.decode("utf-8") for sender in self.redis_client.zrange(SENDERS_KEY, 0, self.scan - 1)]
+        keys = [PRIORITY_KEY, SENDERS_KEY, FINISH_KEY, VTIME_KEY, DEPTH_KEY]
+        for sender in senders:
+            keys += [SENDER_QUEUE_KEY + sender, RUNNING_KEY + sender]
+        return self._pop(keys=keys, args=[self.sender_concurrency, self.running_ttl] + senders)
+
+    def pop(self, timeout=1):
+        # (job_id, sender) of the next job to run, None after timeout. The
+        # sender is None for cheap jobs, they have no running slot to release.
+        deadline = time.monotonic() + timeout
+        while True:
+            item = self._pop_once()
+            if item:
+                return item[0].decode("utf-8"), item[1].decode("utf-8") or None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # Woken by the next push, or poll again when a running job ends
+            self.redis_client.blpop(SIGNAL_KEY, timeout=min(1, max(remaining, 0.01)))
+
+    def release(self, sender):
+        if sender is None:
+            return
+        try:
+            self._release(keys=[RUNNING_KEY + sender])
+            # A sender at its cap may have work waiting
+            self.redis_client.rpush(SIGNAL_KEY, "1")
+        except Exception as e:
+            logger.error(f"Error releasing scheduler slot for {sender}: {e}")
+
+    def depth(self):
+        return int(self.redis_client.get(DEPTH_KEY) or 0)
+
+    def stats(self):
+        try:
+            depth = self.depth()
+            senders = self.redis_client.zcard(SENDERS_KEY)
+        except Exception as e:
+            logger.error(f"Error reading scheduler stats: {e}")
+            depth = senders = None
+        return {
+            "depth": depth,
+            "waiting_senders": senders,
+            "pushed": self.pushed,
+            "rejected": dict(self.rejected),
+        }
@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import zlib
+from datetime import datetime
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# "msgpack" (JSON when msgpack isn't installed) or "json"
+SERIALIZER_FORMAT = os.getenv("SERIALIZER_FORMAT", "msgpack")
+# "zlib", "zstd" (needs zstandard) or "none"
+SERIALIZER_COMPRESSION = os.getenv("SERIALIZER_COMPRESSION", "zlib")
+# Records smaller than this many bytes are stored uncompressed, the zlib
+# header and dictionary-less start would make them bigger
+SERIALIZER_COMPRESS_THRESHOLD = int(os.getenv("SERIALIZER_COMPRESS_THRESHOLD", 512))
+
+# Records start with one header byte: format in the high nibble, compression
+# in the low one. None of these can start a JSON document, so records
+# written before this format are still read as plain JSON.
+FORMATS = {"json": 0x00, "msgpack": 0x10}
+COMPRESSIONS = {"none": 0x00, "zlib": 0x01, "zstd": 0x02}
+HEADERS = {fmt | comp for fmt in FORMATS.values() for comp in COMPRESSIONS.values()}
+
+
+# Built once, json.dumps with arguments builds a new encoder per call
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def _json_dumps(value):
+    return _json_encoder.encode(value).encode("utf-8")
+
+
+def _json_loads(data):
+    return json.loads(data)
+
+
+def _msgpack_dumps(value):
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def _msgpack_loads(data):
+    if msgpack is None:
+        raise ValueError("Record was written with msgpack, which isn't installed")
+    return msgpack.unpackb(data, raw=False)
+
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+def _zstd_decompress(data):
+    if zstandard is None:
+        raise ValueError("Record was compressed with zstd, which isn't installed")
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+ENCODERS = {"json": _json_dumps, "msgpack": _msgpack_dumps}
+DECODERS = {FORMATS["json"]: _json_loads, FORMATS["msgpack"]: _msgpack_loads}
+COMPRESSORS = {"zlib": zlib.compress, "zstd": _zstd_compress}
+DECOMPRESSORS = {COMPRESSIONS["zlib"]: zlib.decompress, COMPRESSIONS["zstd"]: _zstd_decompress}
+
+
+def epoch(when=None):
+    # Timestamps are stored as integer seconds
+    return int((when or datetime.now()).timestamp())
+
+
+def parse_time(value):
+    # Epoch seconds, or an ISO string from records written before
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    if isinstance(value, (int, float)) or value.isdigit():
+        return datetime.fromtimestamp(int(value))
+    return datetime.fromisoformat(value)
+
+
+class Serializer:
+    def __init__(self, format=SERIALIZER_FORMAT, compression=SERIALIZER_COMPRESSION,
+                 threshold=SERIALIZER_COMPRESS_THRESHOLD):
+        if format == "msgpack" and msgpack is None:
+            format = "json"
+        if compression == "zstd" and zstandard is None:
+            logger.error("SERIALIZER_COMPRESSION=zstd needs zstandard, using zlib")
+            compression = "zlib"
+        if format not in FORMATS:
+            raise ValueError(f"Unknown SERIALIZER_FORMAT: {format}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown SERIALIZER_COMPRESSION: {compression}")
+        self.format = format
+        self.compression = compression
+        self.threshold = threshold
+        self._encode = ENCODERS[format]
+        self._compress = COMPRESSORS.get(compression)
+        self._plain = bytes([FORMATS[format]])
+        self._compressed = bytes([FORMATS[format] | COMPRESSIONS[compression]])
+
+    def dumps(self, value, compress=None):
+        # compress=None compresses above the threshold, True always
+        data = self._encode(value)
+        if self._compress is not None and (compress or (compress is None and len(data) >= self.threshold)):
+            packed = self._compress(data)
+            if len(packed) < len(data):
+                return self._compressed + packed
+        return self._plain + data
+
+    def loads(self, data):
+        # Reads every format and compression, whatever this instance writes
+        header = data[0] if data else None
+        if header not in HEADERS:
+            return _json_loads(data)
+        body = data[1:]
+        compression = header & 0x0F
+        if compression:
+            body = DECOMPRESSORS[compression](body)
+        return DECODERS[header & 0xF0](body)
+
+
+# Shared by the session history, feedback records and the claim cache
+serializer = Serializer()
@@ -0,0 +1,313 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# The lock must outlive the slowest upstream call (600 s timeout)
+SINGLEFLIGHT_LOCK_TTL = int(os.getenv("SINGLEFLIGHT_LOCK_TTL", 620))
+# How long a duplicate request waits for the leader before it is parked for
+# fan-out delivery instead
+SINGLEFLIGHT_WAIT = float(os.getenv("SINGLEFLIGHT_WAIT", 10))
+SINGLEFLIGHT_RESULT_TTL = int(os.getenv("SINGLEFLIGHT_RESULT_TTL", 60))
+# Errors and failures are kept only long enough to answer duplicates that
+# were already waiting, later ones try the upstream again
+SINGLEFLIGHT_FAILED_TTL = int(os.getenv("SINGLEFLIGHT_FAILED_TTL", 10))
+
+LOCK_KEY = "inflight:lock:{}"
+RESULT_KEY = "inflight:result:{}"
+CHANNEL_KEY = "inflight:channel:{}"
+WAITERS_KEY = "inflight:waiters:{}"
+
+# Only delete the lock if this worker still owns it
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+QUEUED = {"status": "queued"}
+# Published when the leader's fn raised or returned nothing: followers run fn
+# themselves and parked duplicates get the default "unable to respond" reply
+FAILED = {"status": "failed"}
+
+
+def is_failed(result):
+    return result == FAILED
+
+
+def result_ttl_for(result, result_ttl, failed_ttl):
+    if is_failed(result) or result.get("status") == "error":
+        return min(failed_ttl, result_ttl)
+    return result_ttl
+
+
+class SingleFlight:
+    def __init__(self, redis_client, fanout=None, lock_ttl=SINGLEFLIGHT_LOCK_TTL,
+                 wait_timeout=SINGLEFLIGHT_WAIT, result_ttl=SINGLEFLIGHT_RESULT_TTL,
+                 failed_ttl=SINGLEFLIGHT_FAILED_TTL):
+        self.redis_client = redis_client
+        self.fanout = fanout
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.result_ttl = result_ttl
+        self.failed_ttl = failed_ttl
+        self.leaders = 0
+        self.followers = 0
+        self.fanned_out = 0
+        self.failures = 0
+        self._release = redis_client.register_script(RELEASE_SCRIPT)
+
+    def do(self, key, fn, waiter=None):
+        # Runs fn once per key across all workers. Duplicate callers get the
+        # leader's result, or QUEUED when they were parked with waiter info
+        # for fan-out delivery.
+        if key is None:
+            return fn()
+        try:
+            token = uuid.uuid4().hex
+            if self.redis_client.set(LOCK_KEY.format(key), token, nx=True, ex=self.lock_ttl):
+                return self._lead(key, token, fn)
+            return self._follow(key, fn, waiter)
+        except Exception as e:
+            logger.error(f"Error in single-flight for {key}: {e}")
+            return fn()
+
+    def _lead(self, key, token, fn):
+        self.leaders += 1
+        result = None
+        try:
+            result = fn()
+            return result
+        finally:
+            if result is None:
+                self.failures += 1
+            self._publish(key, token, FAILED if result is None else result)
+
+    def _publish(self, key, token, result):
+        # Every outcome is published and stored, errors only briefly: they are
+        # shared with the followers too, otherwise they would all retry a
+        # failing upstream one after another
+        try:
+            data = json.dumps(result)
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.setex(RESULT_KEY.format(key), result_ttl_for(result, self.result_ttl, self.failed_ttl), data)
+            pipe.publish(CHANNEL_KEY.format(key), data)
+            pipe.execute()
+            self._release(keys=[LOCK_KEY.format(key)], args=[token])
+        except Exception as e:
+            logger.error(f"Error publishing single-flight result for {key}: {e}")
+        if self.fanout is not None:
+            # Parked duplicates are answered without delaying the leader's reply
+            threading.Thread(target=self._deliver_waiters, args=(key, result), daemon=True).start()
+
+    def _deliver_waiters(self, key, result):
+        while True:
+            item = self.redis_client.lpop(WAITERS_KEY.format(key))
+            if item is None:
+                return
+            self.fanned_out += 1
+            try:
+                self.fanout(json.loads(item.decode("utf-8")), result)
+            except Exception as e:
+                logger.error(f"Error delivering fan-out result for {key}: {e}")
+
+    def _stored_result(self, key):
+        data = self.redis_client.get(RESULT_KEY.format(key))
+        return json.loads(data.decode("utf-8")) if data is not None else None
+
+    def _follow(self, key, fn, waiter):
+        self.followers += 1
+        pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(CHANNEL_KEY.format(key))
+            # The leader may have finished before we subscribed
+            result = self._stored_result(key)
+            if result is not None:
+                return fn() if is_failed(result) else result
+            deadline = time.monotonic() + self.wait_timeout
+            while time.monotonic() < deadline:
+                message = pubsub.get_message(timeout=max(0.0, deadline - time.monotonic()))
+                if message is None:
+                    continue
+                result = json.loads(message["data"].decode("utf-8"))
+                # The leader failed, work it out ourselves
+                return fn() if is_failed(result) else result
+        finally:
+            pubsub.close()
+
+        if not self.redis_client.exists(LOCK_KEY.format(key)):
+            # The leader is gone without publishing anything
+            return self.do(key, fn, waiter)
+        if self.fanout is None or waiter is None:
+            return fn()
+
+        item = json.dumps(waiter)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.rpush(WAITERS_KEY.format(key), item)
+        pipe.expire(WAITERS_KEY.format(key), self.lock_ttl)
+        pipe.execute()
+        # Close the race with a leader that drained the waiters just now
+        result = self._stored_result(key)
+        if result is not None and self.redis_client.lrem(WAITERS_KEY.format(key), 1, item):
+            return fn() if is_failed(result) else result
+        return QUEUED
+
+    def stats(self):
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "fanned_out": self.fanned_out,
+            "failures": self.failures,
+        }
+
+
+class AsyncSingleFlight:
+    # asyncio twin of SingleFlight for async_app, using the same Redis keys so
+    # sync and async workers coalesce with each other. Coroutines are cheap
+    # to park, so duplicates simply wait for the leader; in-process
+    # duplicates share one future and all keys share one pub/sub connection.
+    def __init__(self, redis_client, fanout=None, lock_ttl=SINGLEFLIGHT_LOCK_TTL,
+                 result_ttl=SINGLEFLIGHT_RESULT_TTL, failed_ttl=SINGLEFLIGHT_FAILED_TTL):
+        self.redis_client = redis_client
+        self.fanout = fanout
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.failed_ttl = failed_ttl
+        self.leaders = 0
+        self.followers = 0
+        self.fanned_out = 0
+        self.failures = 0
+        self._release = redis_client.register_script(RELEASE_SCRIPT)
+        self._inflight = {}
+        self._channels = {}
+        self._pubsub = None
+        self._listener = None
+
+    async def do(self, key, fn):
+        if key is None:
+            return await fn()
+        existing = self._inflight.get(key)
+        if existing is not None:
+            self.followers += 1
+            return await asyncio.shield(existing)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._resolve(key, fn)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _resolve(self, key, fn):
+        while True:
+            token = uuid.uuid4().hex
+            try:
+                acquired = await self.redis_client.set(LOCK_KEY.format(key), token, nx=True, ex=self.lock_ttl)
+            except Exception as e:
+                logger.error(f"Error in single-flight for {key}: {e}")
+                return await fn()
+            if acquired:
+                return await self._lead(key, token, fn)
+            self.followers += 1
+            result = await self._follow(key)
+            if result == FAILED:
+                # The leader failed, work it out ourselves
+                return await fn()
+            if result is not None:
+                return result
+            # The leader vanished, try to take over
+
+    async def _lead(self, key, token, fn):
+        self.leaders += 1
+        result = None
+        try:
+            result = await fn()
+            return result
+        finally:
+            if result is None:
+                self.failures += 1
+            await self._publish(key, token, FAILED if result is None else result)
+
+    async def _publish(self, key, token, result):
+        try:
+            data = json.dumps(result)
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.setex(RESULT_KEY.format(key), result_ttl_for(result, self.result_ttl, self.failed_ttl), data)
+            pipe.publish(CHANNEL_KEY.format(key), data)
+            await pipe.execute()
+            await self._release(keys=[LOCK_KEY.format(key)], args=[token])
+        except Exception as e:
+            logger.error(f"Error publishing single-flight result for {key}: {e}")
+        if self.fanout is not None:
+            # Sync workers may have parked duplicates for fan-out delivery
+            asyncio.create_task(self._deliver_waiters(key, result))
+
+    async def _deliver_waiters(self, key, result):
+        while True:
+            item = await self.redis_client.lpop(WAITERS_KEY.format(key))
+            if item is None:
+                return
+            self.fanned_out += 1
+            try:
+                await self.fanout(json.loads(item.decode("utf-8")), result)
+            except Exception as e:
+                logger.error(f"Error delivering fan-out result for {key}: {e}")
+
+    async def _follow(self, key):
+        channel = CHANNEL_KEY.format(key)
+        waiter = asyncio.get_running_loop().create_future()
+        self._channels[channel] = waiter
+        try:
+            await self._ensure_listener()
+            await self._pubsub.subscribe(channel)
+            # The leader may have finished before we subscribed
+            data = await self.redis_client.get(RESULT_KEY.format(key))
+            if data is not None:
+                return json.loads(data.decode("utf-8"))
+            try:
+                return await asyncio.wait_for(waiter, timeout=self.lock_ttl)
+            except asyncio.TimeoutError:
+                return None
+        finally:
+            self._channels.pop(channel, None)
+            try:
+                await self._pubsub.unsubscribe(channel)
+            except Exception as e:
+                logger.error(f"Error unsubscribing from {channel}: {e}")
+
+    async def _ensure_listener(self):
+        if self._listener is not None and not self._listener.done():
+            return
+        self._pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+        # Subscribing to a placeholder keeps listen() alive between followers
+        await self._pubsub.subscribe("inflight:listener")
+        self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        async for message in self._pubsub.listen():
+            if message.get("type") != "message":
+                continue
+            channel = message["channel"].decode("utf-8")
+            waiter = self._channels.get(channel)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(json.loads(message["data"].decode("utf-8")))
+
+    def stats(self):
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "fanned_out": self.fanned_out,
+            "failures": self.failures,
+        }
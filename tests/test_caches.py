@@ -0,0 +1,23 @@
+import pytest
+
+from caches import LRUCache, TextCache
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def test_lru_drops_the_least_recently_used_entry():
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1 and cache.get("b") is None and len(cache) == 2
+
+
+def test_text_cache_reads_through_to_redis_and_keeps_empty_text():
+    redis_client = fakeredis.FakeRedis()
+    TextCache(redis_client, 60, 8, "test").set("ocr:x", "")
+    cache = TextCache(redis_client, 60, 8, "test")
+    assert cache.get("ocr:x") == ""
+    assert cache.get("ocr:missing") is None
+    assert 0 < redis_client.ttl("ocr:x") <= 60
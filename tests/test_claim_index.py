@@ -0,0 +1,29 @@
+from claim_index import ClaimIndex, MemoryIndexStore, changes_meaning
+
+CLAIM = "The government has banned fuel subsidies in Lagos starting next month"
+
+
+def make_index(*claims):
+    index = ClaimIndex(MemoryIndexStore())
+    for i, claim in enumerate(claims):
+        index.add(claim, f"claim{i}")
+    return index
+
+
+def test_reuses_near_duplicate():
+    index = make_index(CLAIM)
+    match = index.lookup(CLAIM + " 😱😱 pls check")
+    assert match is not None and match[0] == "claim0"
+
+
+def test_negated_claim_is_not_reused():
+    index = make_index(CLAIM)
+    assert index.lookup("The government has not banned fuel subsidies in Lagos starting next month") is None
+    assert index.lookup("The government hasn't banned fuel subsidies in Lagos starting next month") is None
+    assert index.stats()["rejected"] == 2
+
+
+def test_changed_number_or_name_changes_meaning():
+    assert changes_meaning("Fuel price rises to 700 naira", "Fuel price rises to 900 naira")
+    assert changes_meaning(CLAIM, CLAIM.replace("Lagos", "Abuja"))
+    assert not changes_meaning(CLAIM, CLAIM + " is this true?")
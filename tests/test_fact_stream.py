@@ -0,0 +1,27 @@
+import random
+
+import pytest
+
+from fact_stream import split_message
+
+
+@pytest.mark.parametrize("text", [
+    " \n\n" + "b" * 1700,
+    "a" * 1599 + "\n\n  \n\n" + "b" * 100,
+    "a" * 1000 + "\n\n" + "b" * 1000 + "\n\n \n",
+])
+def test_whitespace_around_a_split_never_makes_an_empty_part(text):
+    parts = split_message(text, 1600)
+    assert len(parts) > 1
+    assert all(part.strip() and len(part) <= 1600 for part in parts)
+
+
+def test_small_limits_never_make_empty_or_oversized_parts():
+    rng = random.Random(0)
+    for _ in range(3000):
+        limit = rng.randint(5, 40)
+        text = "".join(rng.choice(["a", "bb ", ". ", "\n", "\n\n", " ", "ccccccccccccc"]) for _ in range(40))
+        if not text.strip():
+            continue
+        parts = split_message(text, limit)
+        assert all(part.strip() and len(part) <= limit for part in parts), (text, limit, parts)
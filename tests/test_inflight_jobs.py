@@ -0,0 +1,25 @@
+import pytest
+
+from job_queue import HEARTBEAT_KEY, InflightJobs
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def test_jobs_of_a_stopped_process_are_taken_over_once():
+    redis_client = fakeredis.FakeRedis()
+    stopped = InflightJobs(redis_client, worker_id="web.1:10")
+    stopped.heartbeat()
+    job = stopped.add({"message_sid": "SM1"})
+    finished = stopped.add({"message_sid": "SM2"})
+    stopped.done(finished)
+
+    alive = InflightJobs(redis_client, worker_id="web.1:11")
+    alive.heartbeat()
+    assert alive.recover() == []
+
+    redis_client.delete(HEARTBEAT_KEY.format("web.1:10"))
+    assert alive.recover() == [job]
+    assert InflightJobs(redis_client, worker_id="web.2:12").recover() == []
+
+    alive.done(job)
+    assert redis_client.llen(alive.key) == 0
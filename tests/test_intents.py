@@ -0,0 +1,26 @@
+import pytest
+
+from intents import ACKNOWLEDGEMENT, FEEDBACK, GREETING, THANKS, IntentClassifier
+
+classifier = IntentClassifier()
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("hi", GREETING),
+    ("Good evening sir", GREETING),
+    ("heyyy bot", GREETING),
+    ("ok thanks bye", THANKS),
+    ("nice one", ACKNOWLEDGEMENT),
+    ("🙏", ACKNOWLEDGEMENT),
+    ("👍", FEEDBACK),
+])
+def test_small_talk_gets_a_canned_reply(text, intent):
+    assert classifier.classify(text) == intent
+
+
+@pytest.mark.parametrize("text", [
+    "no lockdown", "later lockdown", "hey ebola", "welcome bonus", "yes tinubu", "sure death",
+    "hello, is it true?", "hi garlic cures covid",
+])
+def test_greeting_or_ack_with_a_topic_is_fact_checked(text):
+    assert classifier.classify(text) is None
@@ -0,0 +1,30 @@
+from outbound import OutboundDispatcher, track_sends
+
+
+class RecordingAPI:
+    def __init__(self):
+        self.sent = []
+
+    def create(self, **kwargs):
+        self.sent.append(kwargs)
+        return type("Message", (), {"sid": f"SM{len(self.sent)}"})()
+
+
+def test_track_sends_counts_messages_queued_in_context():
+    dispatcher = OutboundDispatcher(RecordingAPI(), "whatsapp:+1", None)
+    dispatcher.send("whatsapp:+2", "outside")
+    with track_sends() as sends:
+        assert sends == []
+        future = dispatcher.send("whatsapp:+2", "inside")
+        assert sends == [future]
+    dispatcher.send("whatsapp:+2", "after")
+    assert len(sends) == 1
+
+
+def test_track_sends_nests():
+    dispatcher = OutboundDispatcher(RecordingAPI(), "whatsapp:+1", None)
+    with track_sends() as outer:
+        with track_sends() as inner:
+            dispatcher.send("whatsapp:+2", "inner")
+        dispatcher.send("whatsapp:+2", "outer")
+    assert len(inner) == 1 and len(outer) == 1
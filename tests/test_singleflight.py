@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import FAILED, QUEUED, RESULT_KEY, SingleFlight
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def start_failing_leader(flight):
+    # Leads "claim" with an fn that raises once released
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    def lead():
+        try:
+            flight.do("claim", failing)
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=lead)
+    thread.start()
+    assert started.wait(5)
+    return thread, release, errors
+
+
+def test_follower_computes_itself_when_leader_raises():
+    flight = SingleFlight(fakeredis.FakeRedis(), wait_timeout=5)
+    leader, release, errors = start_failing_leader(flight)
+
+    results = []
+    follower = threading.Thread(target=lambda: results.append(flight.do("claim", lambda: {"message": "own"})))
+    follower.start()
+    time.sleep(0.2)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert errors
+    assert results == [{"message": "own"}]
+    assert flight.stats()["failures"] == 1
+
+
+def test_parked_waiter_is_answered_when_leader_raises():
+    delivered = []
+    redis_client = fakeredis.FakeRedis()
+    flight = SingleFlight(redis_client, fanout=lambda waiter, result: delivered.append((waiter, result)),
+                          wait_timeout=0)
+    leader, release, _ = start_failing_leader(flight)
+
+    assert flight.do("claim", lambda: {"message": "own"}, waiter={"sender_number": "a"}) is QUEUED
+    release.set()
+    leader.join(5)
+
+    assert wait_for(lambda: delivered)
+    assert delivered == [({"sender_number": "a"}, FAILED)]
+    # Late duplicates see the failure for a short while, then retry upstream
+    assert 0 < redis_client.ttl(RESULT_KEY.format("claim")) <= flight.failed_ttl
+    assert flight.do("claim", lambda: {"message": "own"}) == {"message": "own"}
@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import os
+from contextlib import contextmanager, nullcontext
+
+from opentelemetry import context as otel_context, propagate, trace
+from opentelemetry.trace import NonRecordingSpan, SpanContext, SpanKind, TraceFlags
+
+logger = logging.getLogger(__name__)
+
+# "none" (off), "otlp" (OTEL_EXPORTER_OTLP_ENDPOINT, needs
+# opentelemetry-exporter-otlp-proto-http), "file" (one JSON span per line in
+# TRACE_FILE) or "console"
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+# Share of messages traced. Decided once per MessageSid, so all spans of a
+# message, in the web process and in the worker, are kept or dropped together.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.05))
+TRACE_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "factcheck-whatsapp")
+
+# Key of the W3C trace context in a queued job's payload
+CARRIER_KEY = "trace"
+
+tracer = trace.get_tracer("factcheck")
+enabled = False
+
+
+def _exporter(name):
+    if name == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+    if name == "file":
+        out = open(TRACE_FILE, "a", buffering=1)
+        return ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n")
+    if name == "console":
+        return ConsoleSpanExporter()
+    raise ValueError(f"Unknown TRACE_EXPORTER: {name}")
+
+
+def configure(exporter=TRACE_EXPORTER, sample_rate=TRACE_SAMPLE_RATE):
+    global enabled
+    if exporter == "none":
+        return
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    try:
+        span_exporter = _exporter(exporter)
+    except Exception as e:
+        logger.error(f"Error setting up trace exporter {exporter}, tracing is off: {e}")
+        return
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": TRACE_SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(sample_rate)),
+    )
+    # Spans are exported from a background thread in batches
+    provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    trace.set_tracer_provider(provider)
+    enabled = True
+
+
+configure()
+
+
+def span(name, kind=SpanKind.INTERNAL, **attributes):
+    # Child span of whatever is current. Free when tracing is off.
+    if not enabled:
+        return nullcontext()
+    return tracer.start_as_current_span(name, kind=kind, attributes=attributes)
+
+
+def http_span(name, method, url):
+    if not enabled:
+        return nullcontext()
+    return tracer.start_as_current_span(
+        name, kind=SpanKind.CLIENT, attributes={"http.request.method": method, "url.full": url}
+    )
+
+
+def message_context(message_sid):
+    # A remote parent derived from the MessageSid, so Twilio's redeliveries
+    # of one message land in the same trace. The sampling decision follows
+    # TraceIdRatioBased's rule on the derived trace id.
+    digest = hashlib.sha256(message_sid.encode("utf-8")).digest()
+    trace_id = int.from_bytes(digest[:16], "big")
+    span_id = int.from_bytes(digest[16:24], "big")
+    sampled = (trace_id & 0xFFFFFFFFFFFFFFFF) < TRACE_SAMPLE_RATE * 2 ** 64
+    span_context = SpanContext(
+        trace_id, span_id, is_remote=True,
+        trace_flags=TraceFlags(TraceFlags.SAMPLED if sampled else TraceFlags.DEFAULT),
+    )
+    return trace.set_span_in_context(NonRecordingSpan(span_context))
+
+
+@contextmanager
+def message_span(name, message_sid=None, carrier=None, kind=SpanKind.SERVER):
+    # Span for one inbound message: continues the trace in carrier (a queued
+    # job's payload) or starts the MessageSid's trace
+    if not enabled:
+        yield None
+        return
+    if carrier:
+        parent = propagate.extract(carrier)
+    elif message_sid:
+        parent = message_context(message_sid)
+    else:
+        parent = None
+    attributes = {"messaging.message.id": message_sid} if message_sid else {}
+    with tracer.start_as_current_span(name, context=parent, kind=kind, attributes=attributes) as current:
+        yield current
+
+
+def inject(carrier=None):
+    # W3C traceparent of the current span, for job payloads and HTTP headers
+    carrier = {} if carrier is None else carrier
+    if enabled:
+        propagate.inject(carrier)
+    return carrier
+
+
+def current():
+    return otel_context.get_current() if enabled else None
+
+
+@contextmanager
+def attached(ctx):
+    # Run a block of another thread under a captured context
+    if ctx is None:
+        yield
+        return
+    token = otel_context.attach(ctx)
+    try:
+        yield
+    finally:
+        otel_context.detach(token)
+
+
+def wrap(fn):
+    # fn bound to the caller's context, for thread pools
+    if not enabled:
+        return fn
+    ctx = otel_context.get_current()
+
+    def run(*args, **kwargs):
+        with attached(ctx):
+            return fn(*args, **kwargs)
+
+    return run
+
+
+def set_attributes(attributes):
+    if enabled:
+        trace.get_current_span().set_attributes(attributes)
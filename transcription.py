@@ -0,0 +1,153 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import openai
+
+import tracing
+from media import prepare_voice_note
+from caches import TextCache
+
+logger = logging.getLogger(__name__)
+
+# "openai" (Whisper API) or "faster-whisper" (local CPU model)
+TRANSCRIBE_BACKEND = os.getenv("TRANSCRIBE_BACKEND", "openai").lower()
+OPENAI_TRANSCRIBE_MODEL = os.getenv("OPENAI_TRANSCRIBE_MODEL", "whisper-1")
+LOCAL_WHISPER_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "small")
+LOCAL_WHISPER_COMPUTE_TYPE = os.getenv("LOCAL_WHISPER_COMPUTE_TYPE", "int8")
+LOCAL_WHISPER_THREADS = int(os.getenv("LOCAL_WHISPER_THREADS", 2))
+TRANSCRIPT_CACHE_TTL = int(os.getenv("TRANSCRIPT_CACHE_TTL", 7 * 24 * 60 * 60))
+TRANSCRIPT_CACHE_LOCAL_SIZE = int(os.getenv("TRANSCRIPT_CACHE_LOCAL_SIZE", 256))
+
+CACHE_KEY = "transcript:{}"
+
+# Models are loaded once per worker process and shared by its threads
+_models = {}
+_models_lock = threading.Lock()
+
+
+def load_local_model(size=LOCAL_WHISPER_MODEL, compute_type=LOCAL_WHISPER_COMPUTE_TYPE):
+    key = (size, compute_type)
+    with _models_lock:
+        if key not in _models:
+            from faster_whisper import WhisperModel
+            start = time.perf_counter()
+            _models[key] = WhisperModel(
+                size, device="cpu", compute_type=compute_type, cpu_threads=LOCAL_WHISPER_THREADS
+            )
+            logger.info(f"Loaded faster-whisper model {size} ({compute_type}) in {time.perf_counter() - start:.1f}s")
+        return _models[key]
+
+
+class TranscriptionBackend(ABC):
+    name = None
+
+    @abstractmethod
+    def transcribe(self, audio_file):
+        # Text of a prepared voice note (file-like Ogg/Opus)
+        pass
+
+
+class OpenAIBackend(TranscriptionBackend):
+    name = "openai"
+
+    def __init__(self, model=OPENAI_TRANSCRIBE_MODEL):
+        self.model = model
+
+    def transcribe(self, audio_file):
+        return openai.Audio.transcribe(model=self.model, file=audio_file, response_format="text").strip()
+
+
+class FasterWhisperBackend(TranscriptionBackend):
+    name = "faster-whisper"
+
+    def __init__(self, size=LOCAL_WHISPER_MODEL, compute_type=LOCAL_WHISPER_COMPUTE_TYPE):
+        self.size = size
+        self.compute_type = compute_type
+
+    def transcribe(self, audio_file):
+        model = load_local_model(self.size, self.compute_type)
+        segments, _ = model.transcribe(audio_file, beam_size=1, vad_filter=True)
+        return " ".join(segment.text.strip() for segment in segments).strip()
+
+
+BACKENDS = {
+    OpenAIBackend.name: OpenAIBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+
+def get_backend(name=TRANSCRIBE_BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown TRANSCRIBE_BACKEND: {name}")
+    return BACKENDS[name]()
+
+
+class BackendStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.audio_seconds = 0.0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_latency_s": self.seconds / self.calls if self.calls else 0.0,
+            # Real-time factor: processing time per second of audio
+            "real_time_factor": self.seconds / self.audio_seconds if self.audio_seconds else 0.0,
+        }
+
+
+class Transcriber:
+    def __init__(self, redis_client, backend=None, ttl=TRANSCRIPT_CACHE_TTL,
+                 local_size=TRANSCRIPT_CACHE_LOCAL_SIZE):
+        self.backend = backend or get_backend()
+        self.cache = TextCache(redis_client, ttl, local_size, "transcript")
+        self.backend_stats = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def transcribe(self, data, source_format="ogg"):
+        # Forwarded voice notes are byte-identical, so the raw media hash
+        # identifies them before any decoding happens
+        key = CACHE_KEY.format(hashlib.sha256(data).hexdigest())
+        text = self.cache.get(key)
+        if text is not None:
+            self.cache_hits += 1
+            return text
+        self.cache_misses += 1
+
+        audio_file, duration = prepare_voice_note(data, source_format=source_format)
+        stats = self.backend_stats.setdefault(self.backend.name, BackendStats())
+        start = time.perf_counter()
+        try:
+            with tracing.span("transcribe.request", backend=self.backend.name, audio_seconds=duration):
+                text = self.backend.transcribe(audio_file)
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            stats.calls += 1
+            stats.seconds += elapsed
+            stats.audio_seconds += duration
+        logger.info(
+            f"Transcribed {duration:.1f}s of audio with {self.backend.name} in {elapsed:.2f}s "
+            f"(RTF {elapsed / duration if duration else 0:.2f})"
+        )
+
+        if text:
+            self.cache.set(key, text)
+        return text
+
+    def stats(self):
+        return {
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "backends": {name: stats.as_dict() for name, stats in self.backend_stats.items()},
+        }
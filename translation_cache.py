@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+
+import tracing
+from caches import LRUCache
+
+logger = logging.getLogger(__name__)
+
+TRANSLATION_CACHE_TTL = int(os.getenv("TRANSLATION_CACHE_TTL", 7 * 24 * 60 * 60))
+TRANSLATION_CACHE_LOCAL_SIZE = int(os.getenv("TRANSLATION_CACHE_LOCAL_SIZE", 2048))
+TRANSLATION_WARM_LANGUAGES = [
+    lang.strip() for lang in
+    os.getenv("TRANSLATION_WARM_LANGUAGES", "fr,es,pt,ar,ha,yo,ig,sw,hi").split(",")
+    if lang.strip()
+]
+
+CACHE_KEY = "translation:{}:{}"
+
+# Regular expression to find URLs in the text
+URL_PATTERN = re.compile(r'(https?://\S+)')
+# Unique placeholder format
+PLACEHOLDER_FORMAT = '__URL_PLACEHOLDER_{}__'
+
+
+def protect_urls(text):
+    # Replace URLs with placeholders so they survive translation
+    urls = re.findall(URL_PATTERN, text)
+    for i, url in enumerate(urls):
+        text = text.replace(url, PLACEHOLDER_FORMAT.format(i))
+    return text, urls
+
+
+def restore_urls(text, urls):
+    for i, url in enumerate(urls):
+        text = text.replace(PLACEHOLDER_FORMAT.format(i), url)
+    return text
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class TranslationCache:
+    def __init__(self, translator, redis_client, ttl=TRANSLATION_CACHE_TTL,
+                 local_size=TRANSLATION_CACHE_LOCAL_SIZE):
+        self.translator = translator
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self._local = LRUCache(local_size)
+        self.hits_local = 0
+        self.hits_redis = 0
+        self.misses = 0
+        self.translate_calls = 0
+
+    def translate(self, text, dest_language):
+        return self.translate_batch([text], dest_language)[0]
+
+    def translate_batch(self, texts, dest_language, fallback=True):
+        # Translates several strings for one user with at most one Redis
+        # round trip, only the strings found in neither cache are translated.
+        # Strings that fail come back untranslated, or as None without fallback.
+        results = list(texts)
+        keys = [(dest_language, text_hash(text)) for text in texts]
+
+        missing = []
+        for i, key in enumerate(keys):
+            if not texts[i] or not texts[i].strip():
+                continue
+            value = self._local.get(key)
+            if value is not None:
+                self.hits_local += 1
+                results[i] = value
+            else:
+                missing.append(i)
+        if not missing:
+            return results
+
+        try:
+            values = self.redis_client.mget([CACHE_KEY.format(*keys[i]) for i in missing])
+        except Exception as e:
+            logger.error(f"Error reading translation cache: {e}")
+            values = [None] * len(missing)
+        still_missing = []
+        for i, value in zip(missing, values):
+            if value is None:
+                still_missing.append(i)
+                continue
+            self.hits_redis += 1
+            results[i] = value.decode("utf-8")
+            self._local.set(keys[i], results[i])
+        if not still_missing:
+            return results
+
+        self.misses += len(still_missing)
+        unique = list(dict.fromkeys(texts[i] for i in still_missing))
+        translated = self._translate_uncached(unique, dest_language)
+        by_text = {text: value for text, value in zip(unique, translated) if value is not None}
+        if by_text:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for text, value in by_text.items():
+                    key = (dest_language, text_hash(text))
+                    self._local.set(key, value)
+                    pipe.setex(CACHE_KEY.format(*key), self.ttl, value)
+                pipe.execute()
+            except Exception as e:
+                logger.error(f"Error writing translation cache: {e}")
+        for i in still_missing:
+            results[i] = by_text.get(texts[i], results[i] if fallback else None)
+        return results
+
+    def _translate_uncached(self, texts, dest_language):
+        # googletrans 4.0.0-rc1 translates one string per call, it doesn't
+        # accept a list. Strings that fail come back as None.
+        translated = []
+        for text in texts:
+            try:
+                protected, urls = protect_urls(text)
+                self.translate_calls += 1
+                with tracing.span("translate.request", target=dest_language):
+                    translation = self.translator.translate(protected, dest=dest_language)
+                if not translation.text or not translation.text.strip():
+                    raise ValueError("empty translation")
+                translated.append(restore_urls(translation.text, urls))
+            except Exception as e:
+                logger.error(f"Error translating text: {e}")
+                translated.append(None)
+        return translated
+
+    def warm(self, texts, languages=TRANSLATION_WARM_LANGUAGES):
+        for language in languages:
+            self.translate_batch(list(texts), language)
+
+    def warm_in_background(self, texts, languages=TRANSLATION_WARM_LANGUAGES):
+        thread = threading.Thread(target=self.warm, args=(texts, languages), daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        return {
+            "hits_local": self.hits_local,
+            "hits_redis": self.hits_redis,
+            "misses": self.misses,
+            "translate_calls": self.translate_calls,
+        }
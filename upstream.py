@@ -0,0 +1,292 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import tracing
+from fact_stream import EXTERNAL_API_STREAM, STREAM_ACCEPT, read_fact_check_response
+
+logger = logging.getLogger(__name__)
+
+# Second fact-check deployment, used for failover and hedged requests
+EXTERNAL_API_FALLBACK = os.getenv("EXTERNAL_API_FALLBACK")
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", 32))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 5))
+# The read timeout (longest silence while waiting for data) adapts to recent
+# response times, staying between these bounds
+UPSTREAM_MIN_READ_TIMEOUT = float(os.getenv("UPSTREAM_MIN_READ_TIMEOUT", 30))
+UPSTREAM_MAX_READ_TIMEOUT = float(os.getenv("UPSTREAM_MAX_READ_TIMEOUT", 600))
+UPSTREAM_TIMEOUT_FACTOR = float(os.getenv("UPSTREAM_TIMEOUT_FACTOR", 3))
+# Seconds without response headers before the same query is also sent to the
+# fallback endpoint. 0 uses the primary's recent p95.
+UPSTREAM_HEDGE_AFTER = float(os.getenv("UPSTREAM_HEDGE_AFTER", 0))
+UPSTREAM_CONNECT_RETRIES = int(os.getenv("UPSTREAM_CONNECT_RETRIES", 2))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))
+LATENCY_WINDOW = 200
+LATENCY_MIN_SAMPLES = 20
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Opens after consecutive failures so callers fail fast instead of
+    # waiting on a broken backend. After reset_timeout one probe request is
+    # let through; its outcome closes or re-opens the circuit.
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.opens += 1
+
+
+class LatencyWindow:
+    def __init__(self, size=LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q):
+        with self._lock:
+            if len(self._samples) < LATENCY_MIN_SAMPLES:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+class Endpoint:
+    def __init__(self, url, failure_threshold, reset_timeout):
+        self.url = url
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        # Time to response headers drives hedging, time to the complete
+        # answer drives the read timeout
+        self.headers_latency = LatencyWindow()
+        self.total_latency = LatencyWindow()
+        self.requests = 0
+        self.failures = 0
+
+    def record_success(self, seconds):
+        self.total_latency.add(seconds)
+        self.breaker.record_success()
+
+    def record_failure(self):
+        self.failures += 1
+        self.breaker.record_failure()
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "state": self.breaker.state,
+            "requests": self.requests,
+            "failures": self.failures,
+            "opens": self.breaker.opens,
+            "p50": self.total_latency.percentile(0.5),
+            "p99": self.total_latency.percentile(0.99),
+        }
+
+
+def counts_as_failure(error):
+    # 4xx means the request was bad, not that the backend is unhealthy
+    status = getattr(error, "status", None)  # aiohttp
+    response = getattr(error, "response", None)
+    if status is None and response is not None:
+        status = response.status_code
+    return status is None or status >= 500
+
+
+class FactCheckClient:
+    def __init__(self, urls, pool_size=UPSTREAM_POOL_SIZE, connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+                 min_read_timeout=UPSTREAM_MIN_READ_TIMEOUT, max_read_timeout=UPSTREAM_MAX_READ_TIMEOUT,
+                 timeout_factor=UPSTREAM_TIMEOUT_FACTOR, hedge_after=UPSTREAM_HEDGE_AFTER,
+                 failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.endpoints = [Endpoint(url, failure_threshold, reset_timeout) for url in urls if url]
+        self.connect_timeout = connect_timeout
+        self.min_read_timeout = min_read_timeout
+        self.max_read_timeout = max_read_timeout
+        self.timeout_factor = timeout_factor
+        self.hedge_after = hedge_after
+        self.session = requests.Session()
+        # Only connection failures are retried, a POST that reached the
+        # backend may already be running
+        retry = Retry(
+            total=UPSTREAM_CONNECT_RETRIES, connect=UPSTREAM_CONNECT_RETRIES, read=0, status=0, other=0,
+            backoff_factor=0.2, allowed_methods=None, raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=max(1, len(self.endpoints)), pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="upstream")
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.rejected = 0
+
+    def pick(self, exclude=()):
+        # First endpoint whose circuit lets a request through
+        for endpoint in self.endpoints:
+            if endpoint not in exclude and endpoint.breaker.allow():
+                endpoint.requests += 1
+                return endpoint
+        return None
+
+    def read_timeout(self, endpoint):
+        p99 = endpoint.total_latency.percentile(0.99)
+        if p99 is None:
+            return self.max_read_timeout
+        return min(self.max_read_timeout, max(self.min_read_timeout, p99 * self.timeout_factor))
+
+    def hedge_delay(self, endpoint):
+        if len(self.endpoints) < 2:
+            return None
+        if self.hedge_after:
+            return self.hedge_after
+        return endpoint.headers_latency.percentile(0.95)
+
+    def _send(self, endpoint, payload):
+        start = time.monotonic()
+        headers = {"Accept": STREAM_ACCEPT} if EXTERNAL_API_STREAM else {}
+        # Span ends at the response headers, reading the body is its own span
+        with tracing.http_span("fact_check.request", "POST", endpoint.url):
+            response = self.session.post(
+                endpoint.url, json=payload, headers=tracing.inject(headers), stream=True,
+                timeout=(self.connect_timeout, self.read_timeout(endpoint))
+            )
+            tracing.set_attributes({"http.response.status_code": response.status_code})
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            raise
+        endpoint.headers_latency.add(time.monotonic() - start)
+        return response
+
+    def record_error(self, endpoint, error):
+        logger.error(f"Fact-check request to {endpoint.url} failed: {error}")
+        if counts_as_failure(error):
+            endpoint.record_failure()
+
+    def _discard(self, future, endpoint):
+        # The losing side of a hedge is closed, its errors still count
+        if future.exception() is not None:
+            self.record_error(endpoint, future.exception())
+        else:
+            future.result().close()
+
+    def fact_check(self, user_query, on_partial=None):
+        payload = {"query": user_query}
+        start = time.monotonic()
+        pending = {}
+        tried = []
+
+        def launch():
+            endpoint = self.pick(exclude=tried)
+            if endpoint is not None:
+                tried.append(endpoint)
+                pending[self._executor.submit(tracing.wrap(self._send), endpoint, payload)] = endpoint
+            return endpoint
+
+        if launch() is None:
+            self.rejected += 1
+            raise CircuitOpen("All fact-check endpoints are failing")
+        delay = self.hedge_delay(tried[0])
+        hedge_at = start + delay if delay is not None else None
+
+        winner = None
+        last_error = None
+        while pending and winner is None:
+            timeout = None
+            if hedge_at is not None and len(tried) < len(self.endpoints):
+                timeout = max(0.0, hedge_at - time.monotonic())
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # The primary is slower than usual, race it against the fallback
+                hedge_at = None
+                if launch() is not None:
+                    self.hedged += 1
+                continue
+            for future in done:
+                endpoint = pending.pop(future)
+                if future.exception() is not None:
+                    last_error = future.exception()
+                    self.record_error(endpoint, last_error)
+                    if not pending:
+                        # Fail over straight away rather than waiting to hedge
+                        launch()
+                    continue
+                if winner is None:
+                    winner = (future.result(), endpoint)
+                else:
+                    future.result().close()
+
+        for future, endpoint in pending.items():
+            future.add_done_callback(lambda f, endpoint=endpoint: self._discard(f, endpoint))
+        if winner is None:
+            if last_error is not None:
+                raise last_error
+            self.rejected += 1
+            raise CircuitOpen("All fact-check endpoints are failing")
+
+        response, endpoint = winner
+        if endpoint is not tried[0]:
+            self.hedge_wins += 1
+        try:
+            with response, tracing.span("fact_check.read", hedged=endpoint is not tried[0]):
+                result = read_fact_check_response(response, on_partial)
+        except Exception as e:
+            self.record_error(endpoint, e)
+            raise
+        endpoint.record_success(time.monotonic() - start)
+        return result
+
+    def stats(self):
+        return {
+            "endpoints": [endpoint.stats() for endpoint in self.endpoints],
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "rejected": self.rejected,
+        }
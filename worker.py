@@ -0,0 +1,21 @@
+import logging
+
+from app2 import celery, job_queue, QUEUE_BACKEND, QUEUE_CONCURRENCY
+from metrics import start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    if QUEUE_BACKEND not in ("redis", "celery"):
+        # The thread backend runs jobs inside the web process, a separate
+        # worker has nothing to consume. Exit without an error so the
+        # platform doesn't keep restarting it.
+        logger.info(f"QUEUE_BACKEND={QUEUE_BACKEND} runs jobs in the web process, "
+                    "set QUEUE_BACKEND=redis or celery to use worker.py. Exiting.")
+    else:
+        # Stage timings of queued jobs are recorded here, not in the web process
+        start_metrics_server()
+        if QUEUE_BACKEND == "celery":
+            celery.worker_main(["worker", "--loglevel=INFO", f"--concurrency={QUEUE_CONCURRENCY}"])
+        else:
+            job_queue.run_worker()